@@ -0,0 +1,172 @@
+"""Synthetic input generators for the pipeline micro-benchmarks.
+
+Every generator takes an explicit seed so repeated runs produce identical
+inputs and timings stay comparable against the stored baselines.
+"""
+import json
+import random
+
+SPEAKERS = ['CLINICIAN_0', 'PATIENT_0', 'CLINICIAN_1', 'PATIENT_1']
+
+PHRASES = [
+    "I've been feeling more tired than usual over the past few weeks",
+    "my blood sugar readings have been running high in the mornings",
+    "any chest pain or shortness of breath when you climb stairs",
+    "I stopped taking the metformin because it upset my stomach",
+    "let's check your A1C and a basic metabolic panel today",
+    "my feet tingle at night and sometimes feel numb",
+    "we'll increase the lisinopril dose and recheck your blood pressure",
+    "I have trouble affording my medications every month",
+    "have you noticed any changes in your vision recently",
+    "I'd like you to see a dietitian about meal planning",
+]
+
+SECTION_NAMES = [
+    'CHIEF_COMPLAINT',
+    'HISTORY_OF_PRESENT_ILLNESS',
+    'REVIEW_OF_SYSTEMS',
+    'PAST_MEDICAL_HISTORY',
+    'PAST_FAMILY_HISTORY',
+    'PAST_SOCIAL_HISTORY',
+    'PHYSICAL_EXAMINATION',
+    'ASSESSMENT',
+    'PLAN',
+]
+
+DIAGNOSES = [
+    "Type 2 diabetes mellitus without complications",
+    "Essential (primary) hypertension",
+    "Hyperlipidemia, unspecified",
+    "Chronic kidney disease, stage 3a",
+    "Diabetic peripheral neuropathy",
+    "Obesity, unspecified",
+    "Allergic rhinitis due to pollen",
+]
+
+
+def _sentence(rng, words=1):
+    return ". ".join(rng.choice(PHRASES) for _ in range(words))
+
+
+def make_transcript(segment_count, seed=0):
+    """Build a HealthScribe transcript.json document with N segments."""
+    rng = random.Random(seed)
+    segments = []
+    clock = 0.0
+    for index in range(segment_count):
+        duration = round(rng.uniform(0.8, 9.5), 3)
+        segments.append({
+            'SegmentId': f"seg-{index:06d}",
+            'BeginAudioTime': round(clock, 3),
+            'EndAudioTime': round(clock + duration, 3),
+            'Content': _sentence(rng, rng.randint(1, 3)),
+            'ParticipantDetails': {'ParticipantRole': rng.choice(SPEAKERS)},
+            'SectionDetails': {'SectionName': rng.choice(SECTION_NAMES)},
+        })
+        clock += duration
+    return {
+        'Conversation': {
+            'ConversationId': f"bench-{seed}",
+            'SessionId': f"bench-session-{seed}",
+            'LanguageCode': 'en-US',
+            'TranscriptSegments': segments,
+        }
+    }
+
+
+def make_clinical_doc(section_count, items_per_section=4, seed=0):
+    """Build a HealthScribe clinicalDoc.json document with N sections.
+
+    Known section names are cycled first and padded with numbered custom
+    sections, with the sections the pipeline reads placed at the end so a
+    linear scan has to walk the whole list to find them.
+    """
+    rng = random.Random(seed)
+    names = [f"CUSTOM_SECTION_{index:03d}" for index in range(max(0, section_count - len(SECTION_NAMES)))]
+    names += SECTION_NAMES[:section_count]
+    sections = []
+    for name in names:
+        sections.append({
+            'SectionName': name,
+            'Summary': [
+                {
+                    'EvidenceLinks': [{'SegmentId': f"seg-{rng.randint(0, 9999):06d}"}],
+                    'SummarizedSegment': _sentence(rng, rng.randint(1, 2)),
+                }
+                for _ in range(items_per_section)
+            ],
+        })
+    return {'ClinicalDocumentation': {'Sections': sections}}
+
+
+def make_summary(items_per_section=3, seed=0):
+    """Build the simplified clinical summary produced by the summary processor."""
+    rng = random.Random(seed)
+    return {
+        'chief_complaint': [_sentence(rng)],
+        'history_present_illness': [_sentence(rng, 2) for _ in range(items_per_section)],
+        'review_systems': [_sentence(rng) for _ in range(items_per_section)],
+        'assessment': [f"- {rng.choice(DIAGNOSES)}" for _ in range(items_per_section)],
+        'plan': [_sentence(rng) for _ in range(items_per_section)],
+    }
+
+
+def make_assessment(item_count, seed=0):
+    """Build an assessment list in the bullet style HealthScribe emits."""
+    rng = random.Random(seed)
+    return [f"  - {rng.choice(DIAGNOSES)}  " for _ in range(item_count)]
+
+
+def make_model_output(target_bytes, seed=0):
+    """Build a care-plan model response of roughly target_bytes.
+
+    The JSON object is wrapped in conversational preamble and trailing
+    notes the way Nova often answers, so the extractor has to skip text on
+    both sides.
+    """
+    rng = random.Random(seed)
+    keys = ["diagnosticTests", "treatmentOptions", "patientEducation",
+            "followUpRecommendations", "specialistReferrals"]
+    plan = {key: [] for key in keys}
+    preamble = "Here is the comprehensive care plan based on the clinical information provided:\n\n"
+    notes = "\n\nPlease note that these recommendations should be reviewed by the treating clinician."
+    size = len(preamble) + len(notes)
+    while size < target_bytes:
+        key = keys[rng.randrange(len(keys))]
+        sentence = _sentence(rng, rng.randint(2, 4)) + "."
+        plan[key].append(sentence)
+        size += len(sentence) + 8
+    return preamble + json.dumps(plan, indent=2) + notes
+
+
+def make_visit_records(visit_id, seed=0):
+    """Build (Visit item, visit-data items) as stored once a visit's workflow has finished."""
+    rng = random.Random(seed)
+    summary = make_summary(3, seed=seed)
+    care_plan = {
+        key: [_sentence(rng, 2) + "." for _ in range(rng.randint(2, 5))]
+        for key in ("diagnosticTests", "treatmentOptions", "patientEducation",
+                    "followUpRecommendations", "specialistReferrals")
+    }
+    visit = {
+        'visitID': visit_id,
+        'date': '2025-01-15',
+        'summaryFile': f"s3://bench-bucket/{visit_id}/summary.json",
+        'soapNote': {
+            'subjective': {'chiefComplaint': summary['chief_complaint'][0],
+                           'historyOfPresentIllness': ' '.join(summary['history_present_illness'])},
+            'objective': ' '.join(summary['review_systems']),
+            'assessment': {
+                'primaryDiagnosis': {'condition': summary['assessment'][0].lstrip('- '), 'icd10': 'E11.9'},
+                'secondaryDiagnosis': {'condition': summary['assessment'][1].lstrip('- '), 'icd10': ''},
+            },
+            'plan': {'treatment': ' '.join(summary['plan']), 'followUp': ''},
+        },
+    }
+    items = [
+        dict({'visitId': visit_id, 'dataCategory': 'finalSummary'},
+             **{key: json.dumps(value) for key, value in summary.items()}),
+        dict({'visitId': visit_id, 'dataCategory': 'carePlan'},
+             **{key: json.dumps(value) for key, value in care_plan.items()}),
+    ]
+    return visit, items
@@ -0,0 +1,380 @@
+"""Micro-benchmarks for the CPU-bound helpers every visit runs through.
+
+Usage:
+    python benchmarks/run_benchmarks.py                  # compare against baselines.json
+    python benchmarks/run_benchmarks.py --update-baseline
+    python benchmarks/run_benchmarks.py --filter dbwriter
+
+Each timed sample of a case is paired with a run of a fixed pure-Python
+calibration loop just before it, and the case is stored as the median of
+the sample/calibration ratios. A baseline recorded on one machine so stays
+meaningful on another, and a slow spell on a shared machine slows both
+halves of a pair instead of skewing every case. A case fails when its normalised time or its peak
+traced memory grows by more than the tolerance, and the script exits
+non-zero so CI stops on it. The default time tolerance is deliberately wide:
+the regressions worth catching here are algorithmic, not a few percent.
+"""
+import argparse
+import gc
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import generators
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, 'lambda')
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# Handlers import the shared layer, which Lambda mounts at /opt/python
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared', 'python'))
+
+
+def load_handler(function_dir):
+    """Import a Lambda's lambda_function.py under a unique module name."""
+    path = os.path.join(LAMBDA_DIR, function_dir, 'lambda_function.py')
+    name = 'bench_' + function_dir.replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def calibration_workload():
+    """A fixed workload used to normalise results across machines."""
+    total = 0
+    items = {}
+    for index in range(200000):
+        total += index * index % 7
+        items[str(index % 1000)] = total
+    return total
+
+
+def calibrate():
+    """Time one run of the calibration workload."""
+    gc.collect()
+    start = time.perf_counter()
+    calibration_workload()
+    return time.perf_counter() - start
+
+
+def build_cases():
+    """Return (name, setup, run) tuples; setup builds inputs outside the timed region."""
+    dbwriter = load_handler('asclepiius-dynamoDBwriter')
+    summary_processor = load_handler('asclepius-summary-processor')
+    care_plan = load_handler('asclepius-generate-care-plan')
+    icd10 = load_handler('asclepius-icd10-verify')
+    hl_handler = load_handler('asclepius-HLhandler')
+    # The import request is validated against the HealthLake API model, so it needs a complete configuration
+    hl_handler.DATASTORE_ID = 'bench-datastore'
+    hl_handler.IMPORT_ROLE_ARN = 'arn:aws:iam::123456789012:role/bench-import'
+    hl_handler.KMS_KEY_ID = 'alias/bench'
+    visit_view = load_handler('asclepius-visit-view')
+    from asclepius_shared import fhir, log, prompts, routing_cache, search_index
+
+    def extract_sections(raw):
+        index = summary_processor.parse_clinical_doc(io.BytesIO(raw))
+        return summary_processor.build_clinical_summary(index)
+
+    def clinical_doc_bytes(section_count, seed):
+        return json.dumps(generators.make_clinical_doc(section_count, seed=seed)).encode('utf-8')
+
+    def visit_item(args):
+        summary, conversation = args
+        return dbwriter.create_visit_item('bench-visit', summary, 'bench-bucket',
+                                          'bench/clinicalDoc.json', conversation)
+
+    def visit_batch(count):
+        records = {f"bench-visit-{index:05d}": generators.make_visit_records(f"bench-visit-{index:05d}", seed=index)
+                   for index in range(count)}
+        return list(records), records, hl_handler.LocalImportClient()
+
+    def export_visits(args):
+        # Files are discarded as written, so the traced peak is what the exporter itself holds
+        visit_ids, records, healthlake = args
+        return hl_handler.export_batch(visit_ids, records.get, lambda index: DiscardingWriter(),
+                                       healthlake, 'bench', 's3://bench-bucket/batch/')
+
+    def visit_write(segment_count, seed):
+        def setup():
+            client, table = offline_dynamodb(dbwriter.CLIENT_CONFIG)
+            return client, table, generators.make_summary(3, seed=seed), generators.make_transcript(segment_count, seed=seed)
+        return setup
+
+    def resource_write(args):
+        # The previous path: plain item with Decimal timestamps, serialized again by the resource layer
+        _, table, summary, transcript = args
+        table.put_item(Item=dbwriter.create_visit_item('bench-visit', summary, 'bench-bucket', 'bench/clinicalDoc.json',
+                                                       dbwriter.process_transcript_segments(transcript)))
+
+    def client_write(args):
+        client, _, summary, transcript = args
+        dbwriter.put_visit(client, 'bench-visits', 'bench-visit', summary, 'bench-bucket', 'bench/clinicalDoc.json',
+                           transcript)
+
+    def view_rows():
+        visit, items = generators.make_visit_records('bench-visit', seed=14)
+        items += [{'visitId': 'bench-visit', 'dataCategory': category,
+                   'expertResult': json.dumps(generators.make_model_output(3 * 1024, seed=index))}
+                  for index, category in enumerate(EXPERT_CATEGORIES)]
+        return visit, items
+
+    def encode_view(rows):
+        visit, items = rows
+        return visit_view.encode_view({
+            'visitId': visit['visitID'],
+            'visit': visit_view.visit_section(visit),
+            'data': {item['dataCategory']: visit_view.data_section(item) for item in items}
+        })
+
+    def transcript_texts(segment_count, seed):
+        transcript = generators.make_transcript(segment_count, seed=seed)
+        return [segment['Content'] for segment in transcript['Conversation']['TranscriptSegments']]
+
+    def search_segment(visit_count):
+        # One merged segment's postings for a phrase and a term, as a query decodes them
+        documents = [search_index.document_terms(transcript_texts(300, seed=index)) for index in range(visit_count)]
+        phrase = search_index.tokenize(transcript_texts(300, seed=0)[0])[:2]
+        term = phrase[-1]
+        postings = {}
+        for word in set(phrase + [term]):
+            encoded = search_index.encode_postings([(ordinal, terms[word]) for ordinal, terms in enumerate(documents)
+                                                    if word in terms])
+            postings[word] = search_index.decode_postings(encoded)
+        tree = search_index.parse_query(f'"{" ".join(phrase)}" OR NOT {term}')
+        return tree, postings, set(range(visit_count))
+
+    write_cases = []
+    for label, segment_count in (('1k', 1000), ('10k', 10000), ('50k', 50000)):
+        write_cases += [
+            (f'dbwriter.put_visit[resource {label}]', visit_write(segment_count, seed=17), resource_write),
+            (f'dbwriter.put_visit[client {label}]', visit_write(segment_count, seed=17), client_write),
+        ]
+
+    return write_cases + [
+        ('dbwriter.process_transcript_segments[300]',
+         lambda: generators.make_transcript(300, seed=1),
+         dbwriter.process_transcript_segments),
+        ('dbwriter.process_transcript_segments[10k]',
+         lambda: generators.make_transcript(10000, seed=2),
+         dbwriter.process_transcript_segments),
+        ('dbwriter.create_visit_item[realistic]',
+         lambda: (generators.make_summary(3, seed=3),
+                  dbwriter.process_transcript_segments(generators.make_transcript(300, seed=3))),
+         visit_item),
+        ('dbwriter.create_visit_item[10k]',
+         lambda: (generators.make_summary(200, seed=4),
+                  dbwriter.process_transcript_segments(generators.make_transcript(10000, seed=4))),
+         visit_item),
+        ('summary_processor.parse_clinical_doc[9]',
+         lambda: clinical_doc_bytes(9, seed=5),
+         extract_sections),
+        ('summary_processor.parse_clinical_doc[200]',
+         lambda: clinical_doc_bytes(200, seed=6),
+         extract_sections),
+        ('generate_care_plan.extract_json[3KB]',
+         lambda: generators.make_model_output(3 * 1024, seed=7),
+         care_plan.extract_json),
+        ('generate_care_plan.extract_json[50KB]',
+         lambda: generators.make_model_output(50 * 1024, seed=8),
+         care_plan.extract_json),
+        ('icd10_verify.extract_diagnoses_from_assessment[20]',
+         lambda: generators.make_assessment(20, seed=9),
+         icd10.extract_diagnoses_from_assessment),
+        ('icd10_verify.extract_diagnoses_from_assessment[5k]',
+         lambda: generators.make_assessment(5000, seed=10),
+         icd10.extract_diagnoses_from_assessment),
+        ('prompts.prepare[realistic]',
+         lambda: generators.make_summary(3, seed=11),
+         lambda summary: prompts.prepare(summary, 'agent')),
+        ('prompts.prepare[200]',
+         lambda: generators.make_summary(200, seed=12),
+         lambda summary: prompts.prepare(summary, 'agent')),
+        ('fhir.visit_resources[realistic]',
+         lambda: generators.make_visit_records('bench-visit', seed=13),
+         lambda records: list(fhir.visit_resources(*records))),
+        ('hl_handler.export_batch[1k]',
+         lambda: visit_batch(1000),
+         export_visits),
+        ('visit_view.encode_view[12 experts]',
+         view_rows,
+         encode_view),
+        ('log.shrink[10k visit item]',
+         lambda: visit_item((generators.make_summary(200, seed=15),
+                             dbwriter.process_transcript_segments(generators.make_transcript(10000, seed=15)))),
+         log.shrink),
+        ('search_index.document_terms[10k segments]',
+         lambda: transcript_texts(10000, seed=18),
+         search_index.document_terms),
+        ('search_index.evaluate[500 visits]',
+         lambda: search_segment(500),
+         lambda args: search_index.evaluate(*args)),
+        ('routing_cache.signature[3KB care plan]',
+         lambda: care_plan.extract_json(generators.make_model_output(3 * 1024, seed=16)),
+         routing_cache.signature),
+    ]
+
+
+EXPERT_CATEGORIES = ['diabetesExpert', 'allergiesExpert', 'kidneyExpert', 'insuranceExpert',
+                     'nutritionExpert', 'ophthalmologistExpert', 'podiatristExpert', 'hospitalCareTeamExpert',
+                     'adaExpert', 'socialDeterminantsExpert', 'physicalTherapistExpert', 'pharmacistExpert']
+
+
+def offline_dynamodb(client_config=None):
+    """A low-level client and a Table that build, serialize and sign each request but never send it."""
+    import boto3
+    session = boto3.session.Session(aws_access_key_id='bench', aws_secret_access_key='bench',
+                                    region_name='us-east-1')
+    client = session.client('dynamodb', config=client_config)
+    table = session.resource('dynamodb').Table('bench-visits')
+    for events in (client.meta.events, table.meta.client.meta.events):
+        events.register('before-send', empty_response)
+    return client, table
+
+
+def empty_response(request, **kwargs):
+    from botocore.awsrequest import AWSResponse
+    return AWSResponse(request.url, 200, {}, EmptyBody())
+
+
+class EmptyBody:
+    """Raw body of a successful PutItem response."""
+
+    def stream(self, **kwargs):
+        yield b'{}'
+
+
+class DiscardingWriter:
+    """NDJSON file stand-in that counts bytes instead of keeping them."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def measure(setup, run, repeat, min_time=0.3):
+    """Return (best seconds per call, relative time, calibration seconds, peak traced bytes) for one case.
+
+    Each sample is timed right after a calibration run, and the relative
+    time is the median of the sample/calibration ratios: a pair shares the
+    machine's state, and the median ignores the odd pair a burst of noise
+    hits. The fastest sample is reported as the case's time.
+    """
+    data = setup()
+
+    # Peak memory from a single traced call
+    gc.collect()
+    tracemalloc.start()
+    run(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Pick a loop count so each sample runs long enough to be stable
+    start = time.perf_counter()
+    run(data)
+    single = max(time.perf_counter() - start, 1e-7)
+    loops = max(1, int(min_time / repeat / single))
+
+    samples = []
+    calibrations = []
+    for _ in range(repeat):
+        calibrations.append(calibrate())
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(loops):
+            run(data)
+        samples.append((time.perf_counter() - start) / loops)
+    ratios = [sample / calibration for sample, calibration in zip(samples, calibrations)]
+    return min(samples), statistics.median(ratios), statistics.median(calibrations), peak
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--update-baseline', action='store_true', help='overwrite baselines.json with this run')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown (default 0.5)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.10, help='allowed relative peak memory growth')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this string')
+    args = parser.parse_args(argv)
+
+    # The handlers print progress on every call; keep benchmark output readable
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        cases = [case for case in build_cases() if args.filter in case[0]]
+        results = {}
+        for name, setup, run in cases:
+            seconds, relative, calibration, peak = measure(setup, run, args.repeat)
+            results[name] = {
+                'seconds': seconds,
+                'relative': relative,
+                'calibration': calibration,
+                'peakBytes': peak,
+            }
+
+    baselines = load_baselines()
+    stored = baselines.get('cases', {})
+    failures = []
+    if results:
+        calibration = statistics.median(result['calibration'] for result in results.values())
+        print(f"calibration: {calibration * 1000:.2f} ms (median)")
+    print(f"{'case':<55}{'time':>12}{'vs base':>10}{'peak KiB':>12}{'vs base':>10}")
+    for name, result in results.items():
+        base = stored.get(name)
+        time_delta = mem_delta = ''
+        if base:
+            time_ratio = result['relative'] / base['relative']
+            mem_ratio = result['peakBytes'] / max(base['peakBytes'], 1)
+            time_delta = f"{(time_ratio - 1) * 100:+.0f}%"
+            mem_delta = f"{(mem_ratio - 1) * 100:+.0f}%"
+            if time_ratio > 1 + args.tolerance:
+                failures.append(f"{name}: time {time_delta} (limit +{args.tolerance * 100:.0f}%)")
+            if mem_ratio > 1 + args.memory_tolerance:
+                failures.append(f"{name}: peak memory {mem_delta} (limit +{args.memory_tolerance * 100:.0f}%)")
+        print(f"{name:<55}{result['seconds'] * 1000:>10.3f}ms{time_delta:>10}"
+              f"{result['peakBytes'] / 1024:>12.1f}{mem_delta:>10}")
+
+    if args.update_baseline:
+        stored.update({
+            name: {'relative': float(f"{r['relative']:.4g}"), 'peakBytes': r['peakBytes']}
+            for name, r in results.items()
+        })
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'cases': dict(sorted(stored.items()))}, f, indent=2)
+            f.write('\n')
+        print(f"Baselines written to {BASELINE_PATH}")
+        return 0
+
+    missing = [name for name in results if name not in stored]
+    if missing:
+        print("No baseline for: " + ", ".join(missing) + " (run with --update-baseline)")
+
+    if failures:
+        print("\nREGRESSIONS:")
+        for failure in failures:
+            print("  " + failure)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,7 @@ import * as ecs from 'aws-cdk-lib/aws-ecs';
 import * as ecsPatterns from 'aws-cdk-lib/aws-ecs-patterns';
 import * as elbv2 from 'aws-cdk-lib/aws-elasticloadbalancingv2';
 import * as events from 'aws-cdk-lib/aws-events';
+import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import * as fs from 'fs';
 import * as path from 'path';
@@ -73,6 +74,7 @@ export class AsclepiusStack extends cdk.Stack {
       partitionKey: { name: 'visitId', type: dynamodb.AttributeType.STRING },
       sortKey: { name: 'dataCategory', type: dynamodb.AttributeType.STRING },
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      stream: dynamodb.StreamViewType.NEW_IMAGE, // Keeps the visit view current
       removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
       pointInTimeRecoverySpecification: {
         pointInTimeRecoveryEnabled: stage === 'prod',
@@ -95,12 +97,22 @@ export class AsclepiusStack extends cdk.Stack {
       tableName: `asclepius-visit-${stage}`,
       partitionKey: { name: 'visitID', type: dynamodb.AttributeType.STRING },
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      stream: dynamodb.StreamViewType.NEW_IMAGE, // Keeps the visit view current
       removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
       pointInTimeRecoverySpecification: {
         pointInTimeRecoveryEnabled: stage === 'prod',
       },
     });
 
+    // Patient visit index, written by the dynamoDBwriter. Keys only: visit lists need
+    // visitID, patientID and date, and the full item (with the conversation) is a GetItem away.
+    visitTable.addGlobalSecondaryIndex({
+      indexName: 'patientID-date-index',
+      partitionKey: { name: 'patientID', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'date', type: dynamodb.AttributeType.STRING },
+      projectionType: dynamodb.ProjectionType.KEYS_ONLY,
+    });
+
     // Transcript/conversation table
     const transcriptTable = new dynamodb.Table(this, 'TranscriptTable', {
       tableName: `asclepius-transcript-${stage}`,
@@ -112,6 +124,53 @@ export class AsclepiusStack extends cdk.Stack {
       },
     });
 
+    // Shared Bedrock rate limiter state (adaptive token buckets, one item per model)
+    const rateLimitTable = new dynamodb.Table(this, 'RateLimitTable', {
+      tableName: `asclepius-rate-limit-${stage}`,
+      partitionKey: { name: 'bucketId', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Materialized visit views (one compressed document per visit), rebuilt from the two tables above.
+    // Views rebuilt from the visit archive expire again after VISIT_VIEW_REHYDRATED_TTL_DAYS.
+    const visitViewTable = new dynamodb.Table(this, 'VisitViewTable', {
+      tableName: `asclepius-visit-view-${stage}`,
+      partitionKey: { name: 'visitID', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Drafts of visits still being recorded, built by asclepius-live-draft from streamed transcript segments
+    const liveDraftTable = new dynamodb.Table(this, 'LiveDraftTable', {
+      tableName: `asclepius-live-draft-${stage}`,
+      partitionKey: { name: 'visitID', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Expert routing of recent care plans, looked up by MinHash band so near-duplicate plans reuse it
+    const routingCacheTable = new dynamodb.Table(this, 'RoutingCacheTable', {
+      tableName: `asclepius-routing-cache-${stage}`,
+      partitionKey: { name: 'bucketId', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Size-capped history digest per patient, merged by asclepius-patient-digest after each visit
+    const patientDigestTable = new dynamodb.Table(this, 'PatientDigestTable', {
+      tableName: `asclepius-patient-digest-${stage}`,
+      partitionKey: { name: 'patientID', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
+      pointInTimeRecoverySpecification: {
+        pointInTimeRecoveryEnabled: stage === 'prod',
+      },
+    });
+
     // ===========================================
     // S3 Bucket for Audio Recordings
     // ===========================================
@@ -126,10 +185,42 @@ export class AsclepiusStack extends cdk.Stack {
           enabled: true,
           expiration: cdk.Duration.days(stage === 'prod' ? 2555 : 30), // 7 years for prod, 30 days for dev
         },
+        {
+          // Claim-check copies of large workflow state (payload_store); only needed while a visit is processed
+          id: 'DeleteWorkflowPayloads',
+          enabled: true,
+          prefix: 'workflow-payloads/',
+          expiration: cdk.Duration.days(7),
+        },
       ],
       removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
     });
 
+    // Visits moved out of DynamoDB by asclepius-visit-archive, one gzipped JSON object each
+    const visitArchiveBucket = new s3.Bucket(this, 'VisitArchiveBucket', {
+      bucketName: `asclepius-visit-archive-${stage}-${this.account}`,
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
+      versioned: stage === 'prod',
+      removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Parquet datasets written by asclepius-analytics-export for the quality team's analytics
+    const analyticsBucket = new s3.Bucket(this, 'AnalyticsBucket', {
+      bucketName: `asclepius-analytics-${stage}-${this.account}`,
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
+      removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Full-text search index segments, written by asclepius-search-index
+    const searchIndexBucket = new s3.Bucket(this, 'SearchIndexBucket', {
+      bucketName: `asclepius-search-index-${stage}-${this.account}`,
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
+      removalPolicy: stage === 'prod' ? cdk.RemovalPolicy.RETAIN : cdk.RemovalPolicy.DESTROY,
+    });
+
     // ===========================================
     // OpenSearch Domain for Knowledge Base (DISABLED FOR NOW)
     // ===========================================
@@ -157,7 +248,10 @@ export class AsclepiusStack extends cdk.Stack {
     // ===========================================
     // IAM Roles
     // ===========================================
-    const lambdaExecutionRole = this.createLambdaExecutionRole(visitDataTable, patientTable, visitTable, transcriptTable, audioBucket); // Removed openSearchDomain parameter
+    const lambdaExecutionRole = this.createLambdaExecutionRole(visitDataTable, patientTable, visitTable, transcriptTable, rateLimitTable, visitViewTable, liveDraftTable, routingCacheTable, patientDigestTable, audioBucket, stage); // Removed openSearchDomain parameter
+    visitArchiveBucket.grantReadWrite(lambdaExecutionRole);
+    analyticsBucket.grantReadWrite(lambdaExecutionRole);
+    searchIndexBucket.grantReadWrite(lambdaExecutionRole);
     const stepFunctionsRole = this.createStepFunctionsRole();
 
     // ===========================================
@@ -177,6 +271,44 @@ export class AsclepiusStack extends cdk.Stack {
       }
     );
 
+    // ===========================================
+    // Stream Triggers for the Visit View Lambda
+    // ===========================================
+    // Row changes after the workflow has built a visit's view are patched into it
+    [visitTable, visitDataTable].forEach(table => {
+      lambdaFunctions['asclepius-visit-view'].addEventSource(new lambdaEventSources.DynamoEventSource(table, {
+        startingPosition: lambda.StartingPosition.LATEST,
+        batchSize: 100,
+        maxBatchingWindow: cdk.Duration.seconds(2),
+        bisectBatchOnError: true,
+        retryAttempts: 5,
+      }));
+    });
+
+    // Every change to a visit re-exports its analytics records; a wide batching window keeps files few
+    [visitTable, visitDataTable].forEach(table => {
+      lambdaFunctions['asclepius-analytics-export'].addEventSource(new lambdaEventSources.DynamoEventSource(table, {
+        startingPosition: lambda.StartingPosition.LATEST,
+        batchSize: 1000,
+        maxBatchingWindow: cdk.Duration.minutes(1),
+        bisectBatchOnError: true,
+        retryAttempts: 5,
+      }));
+    });
+
+    // Clinician edits to a finalSummary re-run only the stages that read the edited fields
+    lambdaFunctions['asclepius-recompute'].addEventSource(new lambdaEventSources.DynamoEventSource(visitDataTable, {
+      startingPosition: lambda.StartingPosition.LATEST,
+      batchSize: 10,
+      bisectBatchOnError: true,
+      retryAttempts: 2,
+      filters: [
+        lambda.FilterCriteria.filter({
+          dynamodb: { NewImage: { dataCategory: { S: lambda.FilterRule.isEqual('finalSummary') } } }
+        })
+      ],
+    }));
+
     // ===========================================
     // Step Functions Workflows
     // ===========================================
@@ -200,6 +332,56 @@ export class AsclepiusStack extends cdk.Stack {
     transcriptProcessingRule.addTarget(new targets.SfnStateMachine(mainWorkflow));
     transcriptProcessingRule.addTarget(new targets.SfnStateMachine(visitDbWorkflow));
 
+    // Flushes visits queued by asclepius-HLhandler into one HealthLake import per batch.
+    // Enable together with the HEALTHLAKE_* environment variables.
+    const healthLakeExportRule = new events.Rule(this, 'HealthLakeExportSchedule', {
+      ruleName: `HealthLakeExportSchedule-${stage}`,
+      description: 'Starts a HealthLake import for visits pending FHIR export',
+      schedule: events.Schedule.rate(cdk.Duration.minutes(15)),
+      enabled: false
+    });
+    healthLakeExportRule.addTarget(new targets.LambdaFunction(lambdaFunctions['asclepius-HLhandler'], {
+      event: events.RuleTargetInput.fromObject({ action: 'flush' })
+    }));
+
+    // Merges the one-visit segments of the search index into larger sharded ones
+    const searchIndexMergeRule = new events.Rule(this, 'SearchIndexMergeSchedule', {
+      ruleName: `SearchIndexMergeSchedule-${stage}`,
+      description: 'Merges small segments of the visit search index',
+      schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
+      enabled: true
+    });
+    searchIndexMergeRule.addTarget(new targets.LambdaFunction(lambdaFunctions['asclepius-search-index'], {
+      event: events.RuleTargetInput.fromObject({ action: 'merge' })
+    }));
+
+    // Visit search API; callers sign requests with IAM credentials
+    const visitSearchUrl = lambdaFunctions['asclepius-visit-search'].addFunctionUrl({
+      authType: lambda.FunctionUrlAuthType.AWS_IAM,
+    });
+
+    // Merges the small files the analytics export writes into one per partition
+    const analyticsCompactionRule = new events.Rule(this, 'AnalyticsCompactionSchedule', {
+      ruleName: `AnalyticsCompactionSchedule-${stage}`,
+      description: 'Compacts the Parquet files of the analytics export',
+      schedule: events.Schedule.rate(cdk.Duration.hours(1)),
+      enabled: true
+    });
+    analyticsCompactionRule.addTarget(new targets.LambdaFunction(lambdaFunctions['asclepius-analytics-export'], {
+      event: events.RuleTargetInput.fromObject({ action: 'compact' })
+    }));
+
+    // Moves visits older than VISIT_ARCHIVE_AFTER_DAYS from DynamoDB to the visit archive bucket
+    const visitArchiveRule = new events.Rule(this, 'VisitArchiveSchedule', {
+      ruleName: `VisitArchiveSchedule-${stage}`,
+      description: 'Archives old visits to S3, leaving stub rows',
+      schedule: events.Schedule.rate(cdk.Duration.days(1)),
+      enabled: true
+    });
+    visitArchiveRule.addTarget(new targets.LambdaFunction(lambdaFunctions['asclepius-visit-archive'], {
+      event: events.RuleTargetInput.fromObject({ action: 'archive' })
+    }));
+
     // ===========================================
     // ECS Cluster and Service
     // ===========================================
@@ -212,7 +394,8 @@ export class AsclepiusStack extends cdk.Stack {
       visitDataTable,
       patientTable,
       visitTable,
-      transcriptTable
+      transcriptTable,
+      lambdaFunctions['asclepius-live-draft']
     );
 
     // ===========================================
@@ -249,12 +432,54 @@ export class AsclepiusStack extends cdk.Stack {
       exportName: `Asclepius-${stage}-VisitTableName`
     });
 
+    new cdk.CfnOutput(this, 'VisitViewTableName', {
+      value: visitViewTable.tableName,
+      description: 'DynamoDB table for materialized visit views',
+      exportName: `Asclepius-${stage}-VisitViewTableName`
+    });
+
+    new cdk.CfnOutput(this, 'LiveDraftTableName', {
+      value: liveDraftTable.tableName,
+      description: 'DynamoDB table for drafts of visits still being recorded',
+      exportName: `Asclepius-${stage}-LiveDraftTableName`
+    });
+
+    new cdk.CfnOutput(this, 'PatientDigestTableName', {
+      value: patientDigestTable.tableName,
+      description: 'DynamoDB table for per-patient history digests',
+      exportName: `Asclepius-${stage}-PatientDigestTableName`
+    });
+
     new cdk.CfnOutput(this, 'TranscriptTableName', {
       value: transcriptTable.tableName,
       description: 'DynamoDB table for conversation transcripts',
       exportName: `Asclepius-${stage}-TranscriptTableName`
     });
 
+    new cdk.CfnOutput(this, 'VisitArchiveBucketName', {
+      value: visitArchiveBucket.bucketName,
+      description: 'S3 bucket for archived visits',
+      exportName: `Asclepius-${stage}-VisitArchiveBucketName`
+    });
+
+    new cdk.CfnOutput(this, 'AnalyticsBucketName', {
+      value: analyticsBucket.bucketName,
+      description: 'S3 bucket for the Parquet analytics export',
+      exportName: `Asclepius-${stage}-AnalyticsBucketName`
+    });
+
+    new cdk.CfnOutput(this, 'SearchIndexBucketName', {
+      value: searchIndexBucket.bucketName,
+      description: 'S3 bucket for the visit full-text search index',
+      exportName: `Asclepius-${stage}-SearchIndexBucketName`
+    });
+
+    new cdk.CfnOutput(this, 'VisitSearchUrl', {
+      value: visitSearchUrl.url,
+      description: 'Function URL of the visit search API (IAM auth)',
+      exportName: `Asclepius-${stage}-VisitSearchUrl`
+    });
+
     new cdk.CfnOutput(this, 'AudioBucketName', {
       value: audioBucket.bucketName,
       description: 'S3 bucket for audio recordings',
@@ -305,7 +530,13 @@ export class AsclepiusStack extends cdk.Stack {
     patientTable: dynamodb.Table,
     visitTable: dynamodb.Table,
     transcriptTable: dynamodb.Table,
-    audioBucket: s3.Bucket
+    rateLimitTable: dynamodb.Table,
+    visitViewTable: dynamodb.Table,
+    liveDraftTable: dynamodb.Table,
+    routingCacheTable: dynamodb.Table,
+    patientDigestTable: dynamodb.Table,
+    audioBucket: s3.Bucket,
+    stage: string
     // openSearchDomain: opensearchservice.Domain // DISABLED FOR NOW
   ): iam.Role {
     const role = new iam.Role(this, 'LambdaExecutionRole', {
@@ -321,6 +552,23 @@ export class AsclepiusStack extends cdk.Stack {
     patientTable.grantReadWriteData(role);
     visitTable.grantReadWriteData(role);
     transcriptTable.grantReadWriteData(role);
+    rateLimitTable.grantReadWriteData(role);
+    visitViewTable.grantReadWriteData(role);
+    liveDraftTable.grantReadWriteData(role);
+    routingCacheTable.grantReadWriteData(role);
+    patientDigestTable.grantReadWriteData(role);
+
+    // Functions invoked by other functions: asclepius-live-draft runs the care-plan function on the draft as
+    // soon as a recording stops, and asclepius-recompute re-runs routing and the affected experts after an edit
+    role.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: ['lambda:InvokeFunction'],
+      resources: [
+        `arn:aws:lambda:${this.region}:${this.account}:function:asclepius-generate-care-plan-${stage}`,
+        `arn:aws:lambda:${this.region}:${this.account}:function:asclepius-orchestrator-${stage}`,
+        `arn:aws:lambda:${this.region}:${this.account}:function:asclepius-agent-*-${stage}`,
+      ],
+    }));
 
     // Bedrock permissions
     role.addToPolicy(new iam.PolicyStatement({
@@ -355,6 +603,23 @@ export class AsclepiusStack extends cdk.Stack {
       resources: ['arn:aws:s3:::*'],
     }));
 
+    // HealthLake FHIR import from the export bucket (used by asclepius-HLhandler)
+    role.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: [
+        'healthlake:StartFHIRImportJob',
+        's3:ListBucket',
+        's3:AbortMultipartUpload',
+      ],
+      resources: ['*'],
+    }));
+    role.addToPolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: ['iam:PassRole'],
+      resources: ['*'],
+      conditions: { StringEquals: { 'iam:PassedToService': 'healthlake.amazonaws.com' } },
+    }));
+
     // EventBridge permissions for publishing events
     role.addToPolicy(new iam.PolicyStatement({
       effect: iam.Effect.ALLOW,
@@ -428,6 +693,14 @@ export class AsclepiusStack extends cdk.Stack {
       'asclepiius-dynamoDBwriter',
       'asclepius-dynamoDB-icd-insertion',
       'asclepius-extract-session-id',
+      'asclepius-visit-view',
+      'asclepius-live-draft',
+      'asclepius-recompute',
+      'asclepius-patient-digest',
+      'asclepius-visit-archive',
+      'asclepius-analytics-export',
+      'asclepius-search-index',
+      'asclepius-visit-search',
     ];
 
     // Specialist agent functions
@@ -444,10 +717,32 @@ export class AsclepiusStack extends cdk.Stack {
       'asclepius-agent-social-determinants',
       'asclepius-agent-physical-therapist',
       'asclepius-agent-pharmacist',
+      'asclepius-agent-panel',
     ];
 
     const allFunctions = [...coreFunction, ...agentFunctions];
 
+    // Shared Python helpers (lambda/shared/python/asclepius_shared) for every function
+    const sharedLayer = new lambda.LayerVersion(this, 'AsclepiusSharedLayer', {
+      layerVersionName: `asclepius-shared-${stage}`,
+      code: lambda.Code.fromAsset('../lambda/shared', { exclude: ['*.js'] }),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
+      description: 'Shared Python helpers for Asclepius pipeline functions',
+    });
+
+    // pyarrow for the Parquet analytics export, installed from lambda/layers/analytics/requirements.txt
+    const analyticsLayer = new lambda.LayerVersion(this, 'AsclepiusAnalyticsLayer', {
+      layerVersionName: `asclepius-analytics-${stage}`,
+      code: lambda.Code.fromAsset('../lambda/layers/analytics', {
+        bundling: {
+          image: lambda.Runtime.PYTHON_3_9.bundlingImage,
+          command: ['bash', '-c', 'pip install -r requirements.txt -t /asset-output/python'],
+        },
+      }),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
+      description: 'pyarrow for the Asclepius analytics export',
+    });
+
     allFunctions.forEach(functionName => {
       const functionNameWithStage = `${functionName}-${stage}`;
       const logGroupName = `/aws/lambda/${functionNameWithStage}`;
@@ -464,6 +759,7 @@ export class AsclepiusStack extends cdk.Stack {
         runtime: lambda.Runtime.PYTHON_3_9,
         handler: 'lambda_function.lambda_handler',
         code: lambda.Code.fromAsset(`../lambda/${functionName}`),
+        layers: functionName === 'asclepius-analytics-export' ? [sharedLayer, analyticsLayer] : [sharedLayer],
         timeout: cdk.Duration.minutes(5),
         memorySize: 512,
         role: executionRole,
@@ -473,8 +769,35 @@ export class AsclepiusStack extends cdk.Stack {
           PATIENT_TABLE: `asclepius-patient-${stage}`,
           VISIT_TABLE: `asclepius-visit-${stage}`,
           TRANSCRIPT_TABLE: `asclepius-transcript-${stage}`,
+          RATE_LIMIT_TABLE: `asclepius-rate-limit-${stage}`,
+          VISIT_VIEW_TABLE: `asclepius-visit-view-${stage}`,
+          LIVE_DRAFT_TABLE: `asclepius-live-draft-${stage}`,
+          ROUTING_CACHE_TABLE: `asclepius-routing-cache-${stage}`,
+          PATIENT_DIGEST_TABLE: `asclepius-patient-digest-${stage}`,
+          ROUTING_CACHE_THRESHOLD: '0.85',
+          ROUTING_CACHE_SPOT_CHECK_RATE: '0.05',
+          CARE_PLAN_FUNCTION: `asclepius-generate-care-plan-${stage}`,
           AUDIO_BUCKET: `asclepius-audio-${stage}-${this.account}`,
+          PAYLOAD_BUCKET: `asclepius-audio-${stage}-${this.account}`,
+          PAYLOAD_OFFLOAD_MIN_BYTES: '2048',
+          VISIT_ARCHIVE_BUCKET: `asclepius-visit-archive-${stage}-${this.account}`,
+          VISIT_ARCHIVE_AFTER_DAYS: '365',
+          VISIT_VIEW_REHYDRATED_TTL_DAYS: '7',
+          ANALYTICS_BUCKET: `asclepius-analytics-${stage}-${this.account}`,
+          ANALYTICS_COMPACT_MIN_FILES: '8',
+          SEARCH_INDEX_BUCKET: `asclepius-search-index-${stage}-${this.account}`,
+          SEARCH_INDEX_SHARDS: '16',
+          METRICS_NAMESPACE: 'Asclepius/Pipeline',
+          VISIT_LATENCY_BUDGET_MS: '120000',
+          CARE_PLAN_FUSED_ROUTING: 'false',
+          CARE_PLAN_DELTA_MODE: 'false',
+          EXPERT_PANEL_MODE: 'auto',
+          AGENT_STRUCTURED_RATE: '0',
+          LOG_LEVEL: stage === 'prod' ? 'INFO' : 'DEBUG',
           // HEALTHLAKE_BUCKET: `asclepius-healthlake-${stage}-${this.account}`, // Commented out - not integrating HealthLake now
+          // HEALTHLAKE_DATASTORE_ID: 'your-datastore-id',
+          // HEALTHLAKE_IMPORT_ROLE_ARN: 'arn:aws:iam::<account>:role/<healthlake-import-role>',
+          // KMS_KEY_ID: 'arn:aws:kms:<region>:<account>:key/<key-id>', // Encrypts the import job's output
           // Add knowledge base ID when OpenSearch is re-enabled
           // KNOWLEDGE_BASE_ID: 'your-knowledge-base-id',
         },
@@ -578,7 +901,8 @@ export class AsclepiusStack extends cdk.Stack {
     visitDataTable?: dynamodb.Table,
     patientTable?: dynamodb.Table,
     visitTable?: dynamodb.Table,
-    transcriptTable?: dynamodb.Table
+    transcriptTable?: dynamodb.Table,
+    liveDraftFunction?: lambda.Function
   ): ecs.Cluster {
     const cluster = new ecs.Cluster(this, 'AsclepiusCluster', {
       clusterName: `asclepius-cluster-${stage}`,
@@ -637,6 +961,7 @@ export class AsclepiusStack extends cdk.Stack {
           PATIENT_TABLE: patientTable?.tableName || '',
           VISIT_TABLE: visitTable?.tableName || '',
           TRANSCRIPT_TABLE: transcriptTable?.tableName || '',
+          LIVE_DRAFT_FUNCTION_NAME: liveDraftFunction?.functionName || '',
         },
         // Use the explicit log group
         logDriver: ecs.LogDrivers.awsLogs({
@@ -885,6 +1210,9 @@ def send_response(event, context, status, data):
     if (transcriptTable) {
       transcriptTable.grantReadWriteData(taskRole);
     }
+    if (liveDraftFunction) {
+      liveDraftFunction.grantInvoke(taskRole);
+    }
 
     // Output the task role ARN for reference
     new cdk.CfnOutput(this, 'TaskRoleArn', {
@@ -1,9 +1,18 @@
 import json
+import math
 import boto3
 import os
 from datetime import datetime
 from decimal import Decimal
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from asclepius_shared import log, payload_store
+
+logger = log.get_logger('dbwriter')
+
+# The visit item is built as AttributeValue maps by attribute_value and conversation_attribute, so
+# botocore's parameter validation, most of the write's CPU time for a long transcript, is skipped
+CLIENT_CONFIG = Config(parameter_validation=False)
 
 def get_transcript_from_s3(s3_client, bucket, key):
     """Retrieve and parse transcript from S3."""
@@ -12,29 +21,22 @@ def get_transcript_from_s3(s3_client, bucket, key):
         directory_path = clean_key.replace('/clinicalDoc.json', '')
         transcript_key = f"{directory_path}/transcript.json"
         
-        print(f"Original key: {key}")
-        print(f"Clean key: {clean_key}")
-        print(f"Directory path: {directory_path}")
-        print(f"Looking for transcript at: {bucket}/{transcript_key}")
+        logger.debug("Looking for transcript at %s/%s", bucket, transcript_key, originalKey=key)
         
         response = s3_client.get_object(Bucket=bucket, Key=transcript_key)
         return json.loads(response['Body'].read().decode('utf-8'))
     except Exception as e:
-        print(f"Error getting transcript: {str(e)}")
+        logger.warning("Error getting transcript: %s", e)
         return None
 
 def process_transcript_segments(transcript_data):
-    """Process transcript segments into conversation format."""
+    """Process transcript segments into conversation format (plain values, for the resource API)."""
     conversation = []
-    print("Starting transcript processing...")
-    
     if not transcript_data or 'Conversation' not in transcript_data:
-        print("No valid transcript data found")
+        logger.info("No valid transcript data found")
         return conversation
     
     segments = transcript_data['Conversation'].get('TranscriptSegments', [])
-    print(f"Found {len(segments)} segments to process")
-    
     for segment in segments:
         try:
             dialogue_entry = {
@@ -44,21 +46,89 @@ def process_transcript_segments(transcript_data):
             }
             conversation.append(dialogue_entry)
         except Exception as e:
-            print(f"Error processing segment: {str(e)}")
+            logger.warning("Error processing segment: %s", e)
             continue
     
-    print(f"Processed {len(conversation)} conversation entries")
+    logger.info("Processed %d of %d transcript segments", len(conversation), len(segments))
     return conversation
 
-def create_visit_item(visit_id, summary, bucket, original_key, conversation):
+def number_value(value):
+    """DynamoDB number string of a value, as Decimal(str(value)) would be stored."""
+    if type(value) is int:
+        return str(value)
+    if type(value) is float and math.isfinite(value):
+        text = repr(value)
+        return text if 'e' not in text else str(Decimal(text))
+    number = Decimal(str(value))
+    if not number.is_finite():
+        raise ValueError(f"DynamoDB cannot store {value!r}")
+    return str(number)
+
+def attribute_value(value):
+    """Low-level AttributeValue of a plain value: what the resource layer's TypeSerializer produces."""
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': number_value(value)}
+    if isinstance(value, dict):
+        return {'M': {key: attribute_value(inner) for key, inner in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [attribute_value(inner) for inner in value]}
+    raise TypeError(f"Unsupported type {type(value).__name__} for DynamoDB")
+
+def conversation_attribute(transcript_data):
+    """The conversation as a DynamoDB list attribute, built straight from the transcript segments.
+
+    Same entries as process_transcript_segments, but in one pass with no
+    Decimal per segment and no second walk by the TypeSerializer.
+    """
+    entries = []
+    if not transcript_data or 'Conversation' not in transcript_data:
+        logger.info("No valid transcript data found")
+        return {'L': entries}
+
+    segments = transcript_data['Conversation'].get('TranscriptSegments', [])
+    append = entries.append
+    for segment in segments:
+        try:
+            message = segment.get('Content', '')
+            append({'M': {
+                'speaker': {'S': segment.get('ParticipantDetails', {}).get('ParticipantRole', 'UNKNOWN').replace('_0', '').replace('_1', '')},
+                'message': {'S': message} if type(message) is str else attribute_value(message),
+                'timestamp': {'N': number_value(segment.get('BeginAudioTime', 0))}
+            }})
+        except Exception as e:
+            logger.warning("Error processing segment: %s", e)
+            continue
+
+    logger.info("Processed %d of %d transcript segments", len(entries), len(segments))
+    return {'L': entries}
+
+def put_visit(dynamodb_client, table_name, visit_id, summary, bucket, original_key, transcript_data,
+              patient_id=None, visit_date=None):
+    """Write the visit item through the low-level client; returns the item without its conversation, and the segment count."""
+    visit_item = create_visit_item(visit_id, summary, bucket, original_key, [], patient_id=patient_id,
+                                   visit_date=visit_date)
+    del visit_item['conversation']
+    attributes = {key: attribute_value(value) for key, value in visit_item.items()}
+    attributes['conversation'] = conversation_attribute(transcript_data)
+    dynamodb_client.put_item(TableName=table_name, Item=attributes)
+    return visit_item, len(attributes['conversation']['L'])
+
+def create_visit_item(visit_id, summary, bucket, original_key, conversation, patient_id=None, visit_date=None):
     """Create the visit item for DynamoDB."""
     # Get assessments list and handle secondary diagnosis if it exists
     assessments = summary.get('assessment', [])
     secondary_condition = assessments[1] if len(assessments) > 1 else ""  # Changed to empty string
+    date = visit_date or datetime.now().strftime('%Y-%m-%d')
 
-    return {
+    item = {
         "visitID": visit_id,
-        "date": datetime.now().strftime('%Y-%m-%d'),
+        "date": date,
         "summaryFile": f"s3://{bucket}/{original_key}",
         "soapNote": {
             "subjective": {
@@ -83,23 +153,28 @@ def create_visit_item(visit_id, summary, bucket, original_key, conversation):
         },
         "conversation": conversation
     }
+    # Key of the patient index (patientID-date-index); index keys cannot be empty
+    if patient_id:
+        item["patientID"] = patient_id
+    return item
 
 
 
 def lambda_handler(event, context):
-    print("Received event:", json.dumps(event, indent=2))
+    logger.bind(visitId=event.get('visitId'))
+    logger.debug("Received event", event=event)
     
     # Initialize AWS clients
     s3 = boto3.client('s3')
-    dynamodb = boto3.resource('dynamodb')
+    # The low-level client: the item is serialized once, by put_visit
+    dynamodb_client = boto3.client('dynamodb', config=CLIENT_CONFIG)
     
     # Use environment variable for table name
     visit_table_name = os.environ.get('VISIT_TABLE', 'asclepiusMVP-Visit')
-    visit_table = dynamodb.Table(visit_table_name)
 
     try:
         # Extract event data
-        summary = event.get('summary', {})
+        summary = payload_store.resolve(event.get('summary', {}))
         bucket = event.get('bucket')
         visit_id = event.get('visitId')
         original_key = event.get('originalKey')
@@ -111,56 +186,45 @@ def lambda_handler(event, context):
         # Get transcript data
         transcript_data = None
         if 'transcript' in event:
-            print("Using transcript from event")
-            transcript_data = event['transcript']
+            logger.debug("Using transcript from event")
+            transcript_data = payload_store.resolve(event['transcript'])
         else:
-            print("Attempting to get transcript from S3")
+            logger.debug("Attempting to get transcript from S3")
             transcript_data = get_transcript_from_s3(s3, bucket, original_key)
 
-        if transcript_data:
-            print("Successfully retrieved transcript data")
-        else:
-            print("No transcript data available")
-
-        # Process conversation from transcript
-        conversation = process_transcript_segments(transcript_data)
-
-        # Create visit item
-        visit_item = create_visit_item(
+        # Build the item from the transcript and store it in DynamoDB
+        visit_item, segments = put_visit(
+            dynamodb_client,
+            visit_table_name,
             visit_id, 
             summary, 
             bucket, 
             original_key, 
-            conversation
+            transcript_data,
+            patient_id=event.get('patientId'),
+            visit_date=event.get('visitDate')
         )
-
-        # Store in DynamoDB
-        print("Attempting to write to DynamoDB...")
-        visit_table.put_item(Item=visit_item)
-        print("Successfully wrote to DynamoDB")
+        logger.info("Stored visit item", segments=segments, patientID=visit_item.get('patientID'))
 
         return {
             'statusCode': 200,
             'body': 'Successfully processed visit and transcript data',
             'visitID': visit_id,
+            # The conversation is only in the table; the rest of the item can still be large
             'data': {
-                'visit': visit_item
+                'visit': payload_store.offload(visit_item),
+                'segments': segments
             }
         }
 
     except ValueError as ve:
-        print(f"Validation error: {str(ve)}")
+        logger.warning("Validation error: %s", ve)
         return {
             'statusCode': 400,
             'body': f'Validation error: {str(ve)}'
         }
     except Exception as e:
-        print(f"Error: {str(e)}")
-        print("Full error:", json.dumps({
-            'error': str(e),
-            'type': str(type(e)),
-            'trace': str(e.__traceback__)
-        }, default=str))
+        logger.exception("Error storing visit")
         return {
             'statusCode': 500,
             'body': f'Error processing request: {str(e)}'
@@ -1,92 +1,271 @@
 import json
-import boto3
 import os
-from datetime import datetime
+import uuid
+import boto3
+from botocore.exceptions import ParamValidationError
+from botocore.session import get_session
+from botocore.validate import ParamValidator
+from datetime import datetime, timezone
+from asclepius_shared import fhir, log, visit_archive
+
+## Exports visits to HealthLake as FHIR R4 in micro-batches
+##
+## Each visit event only leaves a pending marker in the export bucket. A
+## scheduled flush ({"action": "flush"}) converts every pending visit old
+## enough for its care plan to have been stored, streams the resources into
+## a few large NDJSON files, and starts one HealthLake import for the batch.
+## The import needs HEALTHLAKE_IMPORT_ROLE_ARN and KMS_KEY_ID (for its output) as well.
+
+EXPORT_BUCKET = os.environ.get('HEALTHLAKE_BUCKET')
+DATASTORE_ID = os.environ.get('HEALTHLAKE_DATASTORE_ID')
+IMPORT_ROLE_ARN = os.environ.get('HEALTHLAKE_IMPORT_ROLE_ARN')
+KMS_KEY_ID = os.environ.get('KMS_KEY_ID')
+EXPORT_PREFIX = os.environ.get('HEALTHLAKE_EXPORT_PREFIX', 'fhir-export/')
+VISIT_TABLE = os.environ.get('VISIT_TABLE', 'asclepiusMVP-Visit')
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+
+# Pending visits are exported once the rest of the workflow has had time to finish
+EXPORT_MIN_AGE_SECONDS = int(os.environ.get('HEALTHLAKE_EXPORT_MIN_AGE_SECONDS', '900'))
+# Visits whose records never appear are dropped after this long
+EXPORT_MAX_AGE_SECONDS = int(os.environ.get('HEALTHLAKE_EXPORT_MAX_AGE_SECONDS', '86400'))
+BATCH_MAX_VISITS = int(os.environ.get('HEALTHLAKE_BATCH_MAX_VISITS', '5000'))
+NDJSON_FILE_MAX_BYTES = int(os.environ.get('HEALTHLAKE_NDJSON_FILE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# S3 needs parts of at least 5 MiB, except the last; this is also the upload buffer size
+UPLOAD_PART_BYTES = 8 * 1024 * 1024
+
+logger = log.get_logger('hl-handler')
 
-def lambda_handler(event, context):
-    """
-    HealthLake integration is currently disabled.
-    This function is a placeholder for future HealthLake integration.
-    """
-    print("HealthLake integration is currently disabled")
-    print("Received event:", json.dumps(event, indent=2))
-    
-    # Return success without processing
-    return {
-        'statusCode': 200,
-        'body': 'HealthLake integration is currently disabled',
-        'message': 'This function is a placeholder for future HealthLake integration'
-    }
 
-# The following code is commented out until HealthLake integration is needed
-"""
 def lambda_handler(event, context):
-    print("Received event:", json.dumps(event, indent=2))
-    
-    # Use environment variables instead of hardcoded values
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    healthlake_bucket = os.environ.get('HEALTHLAKE_BUCKET', 'asclepius-healthlake')
-    
-    healthlake = boto3.client('healthlake', region_name=region)
-    s3 = boto3.client('s3', region_name=region)
-    
+    logger.bind(visitId=event.get('visitId'))
+    if not (EXPORT_BUCKET and DATASTORE_ID):
+        logger.info("HealthLake integration is disabled: HEALTHLAKE_BUCKET and HEALTHLAKE_DATASTORE_ID are not set")
+        return {
+            'statusCode': 200,
+            'body': 'HealthLake integration is currently disabled'
+        }
+    # Checked before queueing, so a misconfiguration shows up before markers pile up
+    missing = [name for name, value in (('HEALTHLAKE_IMPORT_ROLE_ARN', IMPORT_ROLE_ARN), ('KMS_KEY_ID', KMS_KEY_ID))
+               if not value]
+    if missing:
+        logger.error("HealthLake export is misconfigured: %s not set", ', '.join(missing))
+        return {
+            'statusCode': 500,
+            'body': f"HealthLake export is misconfigured: {', '.join(missing)} not set"
+        }
+
+    s3 = boto3.client('s3')
     try:
-        # Extract data from event
-        summary = event.get('summary', {})
+        if event.get('action') == 'flush' or event.get('source') == 'aws.events':
+            return flush(s3, boto3.client('healthlake'))
+
         visit_id = event.get('visitId')
-        bucket = event.get('bucket')
-        
-        if not all([summary, visit_id, bucket]):
-            raise ValueError("Missing required fields in event")
-        
-        # Convert summary to FHIR format
-        fhir_bundle = convert_to_fhir(summary, visit_id)
-        
-        # Upload FHIR bundle to S3
-        ndjson_key = f"fhir-data/{visit_id}.ndjson"
-        s3.put_object(
-            Bucket=healthlake_bucket,
-            Key=ndjson_key,
-            Body=json.dumps(fhir_bundle),
-            ContentType='application/x-ndjson'
-        )
-        
-        # Start import job to HealthLake
-        response = healthlake.start_fhir_import_job(
-            JobName=f"import-{visit_id}-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
-            InputDataConfig={
-                'S3Uri': f's3://{healthlake_bucket}/{ndjson_key}',
-                'S3Configuration': {
-                    'S3Uri': f's3://{healthlake_bucket}/{ndjson_key}',
-                    'KmsKeyId': os.environ.get('KMS_KEY_ID', 'arn:aws:kms:us-east-1:120569639545:key/cc66a8eb-23e4-4350-bdcd-01a8a1c91e70')
-                }
-            },
-            DatastoreId=os.environ.get('HEALTHLAKE_DATASTORE_ID', 'your-datastore-id')
-        )
-        
+        if not visit_id:
+            raise ValueError("Missing visitId in event")
+        s3.put_object(Bucket=EXPORT_BUCKET, Key=f"{EXPORT_PREFIX}pending/{visit_id}", Body=b'')
+        logger.info("Queued visit for HealthLake export")
         return {
             'statusCode': 200,
-            'body': 'Successfully started HealthLake import job',
-            'jobId': response['JobId'],
+            'body': 'Visit queued for HealthLake export',
             'visitId': visit_id
         }
-        
+
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("Error processing HealthLake export")
         return {
             'statusCode': 500,
-            'body': f'Error processing HealthLake import: {str(e)}'
+            'body': f'Error processing HealthLake export: {str(e)}'
         }
 
-def convert_to_fhir(summary, visit_id):
-    # FHIR conversion logic would go here
-    # This is a placeholder for actual FHIR conversion
-    fhir_bundle = {
-        "resourceType": "Bundle",
-        "id": visit_id,
-        "type": "collection",
-        "entry": []
+
+def flush(s3, healthlake):
+    """Export the pending visits that are due as one HealthLake import job."""
+    now = datetime.now(timezone.utc)
+    due, expired = pending_visits(s3, now)
+    if expired:
+        logger.warning("Dropping %d visits whose records never appeared", len(expired), visitIds=expired)
+        delete_markers(s3, expired)
+    if not due:
+        return {'statusCode': 200, 'body': 'No visits pending export'}
+
+    batch_id = f"{now.strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+    batch_prefix = f"{EXPORT_PREFIX}batches/{batch_id}/"
+    visit_table = boto3.resource('dynamodb').Table(VISIT_TABLE)
+    data_table = boto3.resource('dynamodb').Table(VISIT_DATA_TABLE)
+
+    def open_file(index):
+        return S3MultipartWriter(s3, EXPORT_BUCKET, f"{batch_prefix}visits-{index:04d}.ndjson")
+
+    result = export_batch(due, lambda visit_id: fetch_visit(visit_table, data_table, visit_id),
+                          open_file, healthlake, batch_id, f"s3://{EXPORT_BUCKET}/{batch_prefix}")
+    # Visits without a Visit item yet keep their marker and are retried next flush
+    delete_markers(s3, result['exported'])
+    return dict(result, statusCode=200, body='Started HealthLake import job' if result.get('jobId')
+                else 'No visit records ready for export')
+
+
+def pending_visits(s3, now):
+    """Return (due, expired) visit IDs from the pending markers, oldest first."""
+    markers = []
+    prefix = f"{EXPORT_PREFIX}pending/"
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=EXPORT_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            age = (now - obj['LastModified']).total_seconds()
+            if age >= EXPORT_MIN_AGE_SECONDS:
+                markers.append((obj['LastModified'], obj['Key'][len(prefix):], age))
+    markers.sort()
+    due = [visit_id for _, visit_id, age in markers if age < EXPORT_MAX_AGE_SECONDS][:BATCH_MAX_VISITS]
+    expired = [visit_id for _, visit_id, age in markers if age >= EXPORT_MAX_AGE_SECONDS]
+    return due, expired
+
+
+def delete_markers(s3, visit_ids):
+    for start in range(0, len(visit_ids), 1000):
+        s3.delete_objects(Bucket=EXPORT_BUCKET, Delete={
+            'Objects': [{'Key': f"{EXPORT_PREFIX}pending/{visit_id}"} for visit_id in visit_ids[start:start + 1000]],
+            'Quiet': True
+        })
+
+
+def fetch_visit(visit_table, data_table, visit_id):
+    """Return (visit item, visit-data items), or None if the visit has not been written yet."""
+    visit, items = visit_archive.load_visit(visit_id, visit_table, data_table)
+    if not visit:
+        return None
+    return visit, items
+
+
+def export_batch(visit_ids, fetch, open_file, healthlake, batch_id, input_uri):
+    """Stream the visits' FHIR resources into NDJSON files and start one import for them.
+
+    Visits are fetched and converted one at a time and written straight to the
+    open file, so memory is bounded by one visit plus the writer's buffer,
+    whatever the batch size. A new file is started once the current one
+    reaches NDJSON_FILE_MAX_BYTES.
+    """
+    exported, skipped = [], []
+    files = []
+    resource_count = 0
+    writer, written = None, 0
+    try:
+        for visit_id in visit_ids:
+            records = fetch(visit_id)
+            if records is None:
+                skipped.append(visit_id)
+                continue
+            for resource in fhir.visit_resources(*records):
+                line = (json.dumps(resource, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+                if writer is None or written + len(line) > NDJSON_FILE_MAX_BYTES and written:
+                    if writer is not None:
+                        writer.close()
+                    writer, written = open_file(len(files)), 0
+                    files.append(writer)
+                writer.write(line)
+                written += len(line)
+                resource_count += 1
+            exported.append(visit_id)
+        if writer is not None:
+            writer.close()
+    except Exception:
+        for open_writer in files:
+            open_writer.abort()
+        raise
+
+    result = {
+        'batchId': batch_id,
+        'exported': exported,
+        'skipped': skipped,
+        'files': len(files),
+        'resources': resource_count
     }
-    
-    return fhir_bundle
-"""
+    if not exported:
+        return result
+
+    job_config = {
+        'JobName': f"asclepius-{batch_id}",
+        'InputDataConfig': {'S3Uri': input_uri},
+        'JobOutputDataConfig': {'S3Configuration': {
+            'S3Uri': f"{input_uri.rstrip('/')}-output/",
+            'KmsKeyId': KMS_KEY_ID
+        }},
+        'DatastoreId': DATASTORE_ID,
+        'DataAccessRoleArn': IMPORT_ROLE_ARN,
+        # Retrying a flush for the same batch must not start a second import
+        'ClientToken': batch_id
+    }
+    response = healthlake.start_fhir_import_job(**job_config)
+    logger.info("Started HealthLake import %s for %d visits, %d resources in %d files",
+                response['JobId'], len(exported), resource_count, len(files))
+    result['jobId'] = response['JobId']
+    return result
+
+
+class S3MultipartWriter:
+    """Write-only file that uploads to S3 in UPLOAD_PART_BYTES parts as it fills."""
+
+    def __init__(self, s3, bucket, key, part_size=UPLOAD_PART_BYTES):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType='application/fhir+ndjson')['UploadId']
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=number, Body=bytes(self.buffer))
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.upload_id is None:
+            # Small enough for a single request
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer),
+                               ContentType='application/fhir+ndjson')
+            return
+        if self.buffer:
+            self._upload_part()
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                          MultipartUpload={'Parts': self.parts})
+        self.upload_id = None
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+
+class LocalImportClient:
+    """Stand-in for the HealthLake client's start_fhir_import_job, for local runs, tests and benchmarks.
+
+    Parameters are validated against botocore's StartFHIRImportJob model, as
+    the real client does before sending, so a request it accepts is one the
+    real client would send.
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self.input_shape = get_session().get_service_model('healthlake').operation_model(
+            'StartFHIRImportJob').input_shape
+
+    def start_fhir_import_job(self, **kwargs):
+        report = ParamValidator().validate(kwargs, self.input_shape)
+        if report.has_errors():
+            raise ParamValidationError(report=report.generate_report())
+        for job in self.jobs:
+            if job['ClientToken'] == kwargs.get('ClientToken'):
+                return {'JobId': job['JobId'], 'JobStatus': 'SUBMITTED', 'DatastoreId': kwargs.get('DatastoreId')}
+        job = dict(kwargs, JobId=f"local-{len(self.jobs) + 1}")
+        self.jobs.append(job)
+        return {'JobId': job['JobId'], 'JobStatus': 'SUBMITTED', 'DatastoreId': kwargs.get('DatastoreId')}
@@ -0,0 +1,141 @@
+import json
+import os
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from asclepius_shared import bedrock_client, expert_panel, log, prompts
+from asclepius_shared.budget import VisitBudget
+from asclepius_shared.events import get_visit_id
+from asclepius_shared.experts import DATA_CATEGORIES, needed_experts
+from asclepius_shared.personas import PERSONAS
+
+## Generates every needed expert's response in one model call and stores them as the per-expert results the fan-out would have written
+
+MODEL_ID = 'us.amazon.nova-micro-v1:0'
+
+logger = log.get_logger('agent-panel')
+
+def lambda_handler(event, context):
+    bedrock = bedrock_client.get_runtime_client('us-east-1')
+    required_experts = event.get('experts', {})
+    experts = needed_experts(required_experts)
+    visit_id = get_visit_id(event)
+    logger.bind(visitId=visit_id, experts=len(experts))
+    budget = VisitBudget.from_event(event)
+    deadline = budget.deadline('agent', context)
+
+    context_data = prompts.agent_context({'originalData': event.get('originalData')}, experts)
+    context_data = dict(context_data, consultReasons={
+        expert: required_experts[expert].get('reasons', []) for expert in experts
+    })
+    prompt_data = prompts.prepare(context_data, 'agent', original=event)
+
+    results = {}
+    try:
+        if experts:
+            results = run_panel(bedrock, prompt_data.text, experts, visit_id, deadline)
+    except Exception:
+        logger.exception("Expert panel call failed, falling back to individual calls")
+
+    # Experts the panel did not cover get the same call their own agent would make
+    missing = [expert for expert in experts if expert not in results]
+    if missing:
+        logger.warning("Panel output missing %d experts, invoking them individually", len(missing), missing=missing)
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            fallbacks = executor.map(
+                lambda expert: invoke_single_expert(bedrock, prompt_data.text, expert, visit_id, deadline),
+                missing
+            )
+            results.update(zip(missing, fallbacks))
+
+    table_name = event.get('tableName') or os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+    store_results(table_name, visit_id, results)
+
+    budget.report('agent-panel', visit_id)
+    prompt_data.report('agent-panel', visit_id)
+    return {
+        "mode": "panel",
+        "experts": experts,
+        "fallbackExperts": missing,
+        "results": results
+    }
+
+def run_panel(bedrock_runtime, context_text, experts, visit_id=None, deadline=None):
+    request_body = {
+        "schemaVersion": "messages-v1",
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"text": expert_panel.build_prompt(context_text, experts)}]
+            }
+        ],
+        "inferenceConfig": {
+            "maxTokens": expert_panel.max_output_tokens(len(experts)),
+            "temperature": 0.7,
+            "topP": 0.9
+        }
+    }
+
+    response_body = bedrock_client.invoke_model(
+        bedrock_runtime,
+        request_body,
+        stage='agent-panel',
+        model_id=MODEL_ID,
+        visit_id=visit_id,
+        deadline=deadline
+    )
+    sections = expert_panel.split_sections(bedrock_client.get_response_text(response_body), experts)
+    return {expert: {"response": text} for expert, text in sections.items()}
+
+def invoke_single_expert(bedrock_runtime, context_text, expert, visit_id=None, deadline=None):
+    prompt = f"""
+
+General Care Plan:
+{context_text}
+
+{PERSONAS[expert]}
+
+"""
+
+    request_body = {
+        "schemaVersion": "messages-v1",
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"text": prompt}]
+            }
+        ],
+        "inferenceConfig": {
+            "maxTokens": 2000,
+            "temperature": 0.7,
+            "topP": 0.9
+        }
+    }
+
+    try:
+        response_body = bedrock_client.invoke_model(
+            bedrock_runtime,
+            request_body,
+            stage='agent',
+            model_id=MODEL_ID,
+            visit_id=visit_id,
+            expert=expert,
+            deadline=deadline
+        )
+        return {"response": bedrock_client.get_response_text(response_body)}
+    except Exception as e:
+        return {"error": f"Unexpected error: {str(e)}"}
+
+def store_results(table_name, visit_id, results):
+    """Write one expertResult item per expert, matching the workflow's Store<Expert>Result states."""
+    table = boto3.resource('dynamodb').Table(table_name)
+    with table.batch_writer() as batch:
+        for expert, result in results.items():
+            # Failed experts are skipped; the fan-out has no response to store for them either
+            if 'response' not in result:
+                continue
+            batch.put_item(Item={
+                'visitId': visit_id,
+                'dataCategory': DATA_CATEGORIES[expert],
+                # Same encoding as States.JsonToString on the agent's response
+                'expertResult': json.dumps(result['response'])
+            })
@@ -1,35 +1,22 @@
-import json
-import boto3
+from asclepius_shared import agent_output, bedrock_client, prompts
+from asclepius_shared.budget import VisitBudget
+from asclepius_shared.events import get_visit_id
+
+# Key of this expert in the orchestrator's requiredExperts
+EXPERT = 'pharmacist'
 
 def lambda_handler(event, context):
-    bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
+    bedrock = bedrock_client.get_runtime_client('us-east-1')
+    prompt_data = prompts.prepare(prompts.agent_context(event, [EXPERT]), 'agent', original=event)
+    visit_id = get_visit_id(event)
+    structured = agent_output.is_structured(event, visit_id)
     
     prompt = f"""
 
 General Care Plan:
-{json.dumps(event, indent=2)}
-
-You are an experienced Pharmacist Expert creating a personalized medication management plan for a patient with specific pharmaceutical needs. Using the provided patient information, create a comprehensive, evidence-based medication plan that addresses the patient's specific condition, potential drug interactions, and adherence strategies.
-
-Format your response exactly like this example: "Given that [patient] is taking [specific medications/has specific condition], the primary focus of medication management should be on [main pharmaceutical goal]. I would recommend [specific medication intervention].
-
-Specifically, [patient] should [specific medication administration guidance], which can [therapeutic benefit]. Instead, they should focus on [alternative medication approach], which can help [specific symptom management or side effect reduction].
-
-[Additional recommendation paragraph with specific guidance on drug interactions, timing, or storage requirements]. This knowledge will empower the patient to make informed choices and adjust accordingly.
-
-[Further recommendations paragraph with practical advice on adherence strategies and monitoring for adverse effects]. Given the patient's [relevant medication factors], they have [favorable factors] that can facilitate successful medication management.
+{prompt_data.text}
 
-With a comprehensive medication plan and proper education, the patient can effectively manage their [condition] while minimizing risks associated with their pharmaceutical regimen."
-
-Based on the patient data provided, develop a detailed pharmacotherapy plan that:
-
-Addresses the specific medication regimen directly
-Provides specific recommendations for optimizing medication effectiveness and safety
-Includes patient education specific to medication self-management
-Details appropriate monitoring and follow-up recommendations
-References appropriate coordination with prescribers and other healthcare providers when needed
-
-Present your response in clear paragraphs without citations. Do not use bullet points, headers, or asterisks.
+{agent_output.instructions(EXPERT, structured)}
 
 """
 
@@ -42,22 +29,30 @@ Present your response in clear paragraphs without citations. Do not use bullet p
             }
         ],
         "inferenceConfig": {
-            "maxTokens": 2000,
+            "maxTokens": agent_output.max_tokens(structured),
             "temperature": 0.7,
             "topP": 0.9
         }
     }
 
+    budget = VisitBudget.from_event(event)
+
     try:
-        response = bedrock.invoke_model(
-            modelId='us.amazon.nova-micro-v1:0',
-            body=json.dumps(request_body)
+        response_body = bedrock_client.invoke_model(
+            bedrock,
+            request_body,
+            stage=agent_output.stage(structured),
+            model_id='us.amazon.nova-micro-v1:0',
+            visit_id=visit_id,
+            expert=EXPERT,
+            deadline=budget.deadline('agent', context)
         )
+        content = bedrock_client.get_response_text(response_body)
         
-        response_body = json.loads(response['body'].read())
-        content = response_body['output']['message']['content'][0]['text']
-        
-        return {"response": content}
+        return agent_output.result(content, structured)
         
     except Exception as e:
         return {"error": f"Unexpected error: {str(e)}"}
+    finally:
+        budget.report('agent', visit_id, EXPERT)
+        prompt_data.report('agent', visit_id, EXPERT)
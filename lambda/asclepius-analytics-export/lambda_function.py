@@ -0,0 +1,241 @@
+import io
+import os
+import time
+import uuid
+from collections import defaultdict
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from boto3.dynamodb.types import TypeDeserializer
+from asclepius_shared import analytics, log, visit_archive
+from asclepius_shared.deadline import Deadline
+
+## Exports visits and their visit-data rows to partitioned Parquet for analytics
+##
+## Runs on the Visit and visit-data streams. Every visit changed in a batch is re-read whole and written as one
+## small "delta" file per partition:
+##   <prefix>visits/date=YYYY-MM-DD/                          one record per visit (see asclepius_shared.analytics)
+##   <prefix>visit-data/date=YYYY-MM-DD/dataCategory=<c>/     one record per visit-data row
+## Visits without a Visit item yet are skipped; the writer's insert exports them with every row written so far.
+## A scheduled {"action": "compact"} merges the files of each partition with at least ANALYTICS_COMPACT_MIN_FILES
+## files into one, keeping only the latest record of each visit and dropping deleted ones.
+## {"action": "backfill"} exports every visit in the Visit table, resuming from "startKey" if given.
+
+ANALYTICS_BUCKET = os.environ.get('ANALYTICS_BUCKET')
+ANALYTICS_PREFIX = os.environ.get('ANALYTICS_PREFIX', 'analytics/')
+VISIT_TABLE = visit_archive.VISIT_TABLE
+VISIT_DATA_TABLE = visit_archive.VISIT_DATA_TABLE
+
+# Partitions with fewer files are left for a later compaction
+COMPACT_MIN_FILES = int(os.environ.get('ANALYTICS_COMPACT_MIN_FILES', '8'))
+BACKFILL_PAGE_SIZE = 100
+BACKFILL_PAGE_SECONDS = 30
+
+VISITS_SCHEMA = pa.schema([
+    pa.field('visitId', pa.string()),
+    pa.field('patientId', pa.string()),
+    pa.field('primaryIcd10', pa.string()),
+    pa.field('icd10Codes', pa.list_(pa.string())),
+    pa.field('diagnosisCount', pa.int32()),
+    pa.field('carePlanItems', pa.int32()),
+    pa.field('carePlanChars', pa.int64()),
+    pa.field('routedExperts', pa.list_(pa.string())),
+    pa.field('expertCount', pa.int32()),
+    pa.field('archived', pa.bool_()),
+    pa.field('exportedAt', pa.int64()),
+    pa.field('deleted', pa.bool_()),
+] + [pa.field(category, pa.bool_()) for category in analytics.EXPERT_COLUMNS])
+
+VISIT_DATA_SCHEMA = pa.schema([
+    pa.field('visitId', pa.string()),
+    pa.field('patientId', pa.string()),
+    pa.field('attributes', pa.list_(pa.string())),
+    pa.field('chars', pa.int64()),
+    pa.field('items', pa.int32()),
+    pa.field('exportedAt', pa.int64()),
+    pa.field('deleted', pa.bool_()),
+])
+
+SCHEMAS = {'visits': VISITS_SCHEMA, 'visit-data': VISIT_DATA_SCHEMA}
+
+_deserializer = TypeDeserializer()
+
+logger = log.get_logger('analytics-export')
+
+
+def lambda_handler(event, context):
+    if not ANALYTICS_BUCKET:
+        logger.info("Analytics export is disabled: ANALYTICS_BUCKET is not set")
+        return {'statusCode': 200, 'exported': 0}
+
+    logger.bind()
+    dynamodb = boto3.resource('dynamodb')
+    visit_table = dynamodb.Table(VISIT_TABLE)
+    data_table = dynamodb.Table(VISIT_DATA_TABLE)
+    s3 = boto3.client('s3')
+    deadline = Deadline.from_context(context)
+
+    if 'Records' in event:
+        return apply_stream_records(event['Records'], visit_table, data_table, s3)
+    if event.get('action') == 'compact' or event.get('source') == 'aws.events':
+        return compact(s3, deadline, int(event.get('minFiles', COMPACT_MIN_FILES)))
+    if event.get('action') == 'backfill':
+        return backfill(visit_table, data_table, s3, deadline, event.get('startKey'))
+    if event.get('visitIds'):
+        return dict(export_visits(event['visitIds'], visit_table, data_table, s3), statusCode=200)
+    raise ValueError("Expected stream records, an action or visitIds")
+
+
+def apply_stream_records(records, visit_table, data_table, s3):
+    """Export every visit changed in a stream batch once."""
+    visit_ids = []
+    removed = defaultdict(set)
+    for record in records:
+        table = record['eventSourceARN'].split(':table/')[1].split('/')[0]
+        keys = {key: _deserializer.deserialize(value) for key, value in record['dynamodb']['Keys'].items()}
+        visit_id = keys.get('visitID') if table == VISIT_TABLE else keys.get('visitId')
+        if not visit_id:
+            continue
+        if visit_id not in visit_ids:
+            visit_ids.append(visit_id)
+        if table == VISIT_DATA_TABLE and record['eventName'] == 'REMOVE':
+            removed[visit_id].add(keys['dataCategory'])
+    result = export_visits(visit_ids, visit_table, data_table, s3, removed)
+    logger.info("Exported %d stream records", len(records), **result)
+    return dict(result, statusCode=200)
+
+
+def export_visits(visit_ids, visit_table, data_table, s3, removed=None):
+    """Write the current records of the given visits as one delta file per partition.
+
+    removed maps visit IDs to the dataCategories whose rows were deleted;
+    those still absent from the visit get a deleted record.
+    """
+    removed = removed or {}
+    # Taken before reading: of two exports of the same visit, the one that started reading later wins
+    exported_at = int(time.time() * 1000)
+    partitions = defaultdict(list)
+    skipped = []
+    for visit_id in visit_ids:
+        visit, rows = visit_archive.load_visit(visit_id, visit_table, data_table)
+        date = analytics.visit_date(visit)
+        if date is None:
+            skipped.append(visit_id)
+            continue
+        partitions[('visits', (('date', date),))].append(analytics.visit_record(visit, rows, exported_at))
+        categories = set()
+        for row in rows:
+            category = row['dataCategory']
+            if category == visit_archive.ARCHIVED_CATEGORY:
+                continue
+            categories.add(category)
+            partitions[('visit-data', (('date', date), ('dataCategory', category)))].append(
+                analytics.data_record(visit, row, exported_at))
+        for category in removed.get(visit_id, set()) - categories - {visit_archive.ARCHIVED_CATEGORY}:
+            partitions[('visit-data', (('date', date), ('dataCategory', category)))].append(
+                analytics.deleted_data_record(visit, exported_at))
+
+    for (dataset, partition), records in partitions.items():
+        write_file(s3, dataset, partition, records, 'delta')
+    if skipped:
+        logger.info("Skipped visits without a Visit item or date", visitIds=skipped)
+    return {'visits': len(visit_ids) - len(skipped), 'skipped': len(skipped), 'files': len(partitions)}
+
+
+def partition_prefix(dataset, partition):
+    return f"{ANALYTICS_PREFIX}{dataset}/" + ''.join(f"{name}={value}/" for name, value in partition)
+
+
+def write_file(s3, dataset, partition, records, kind):
+    """Write records as one Parquet file in the partition; returns its key."""
+    table = pa.Table.from_pylist(records, schema=SCHEMAS[dataset])
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='zstd')
+    stamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    key = f"{partition_prefix(dataset, partition)}{kind}-{stamp}-{uuid.uuid4().hex[:8]}.parquet"
+    s3.put_object(Bucket=ANALYTICS_BUCKET, Key=key, Body=buffer.getvalue(),
+                  ContentType='application/vnd.apache.parquet')
+    return key
+
+
+def read_records(s3, key):
+    body = s3.get_object(Bucket=ANALYTICS_BUCKET, Key=key)['Body'].read()
+    return pq.read_table(io.BytesIO(body)).to_pylist()
+
+
+def latest_records(records):
+    """The latest record of each visit, without the deleted ones, ordered by visit ID."""
+    latest = {}
+    for record in records:
+        current = latest.get(record['visitId'])
+        if current is None or record['exportedAt'] >= current['exportedAt']:
+            latest[record['visitId']] = record
+    return [latest[visit_id] for visit_id in sorted(latest) if not latest[visit_id]['deleted']]
+
+
+def partition_files(s3):
+    """Parquet keys under the analytics prefix, grouped by partition prefix."""
+    files = defaultdict(list)
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=ANALYTICS_BUCKET, Prefix=ANALYTICS_PREFIX):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.parquet'):
+                files[obj['Key'].rsplit('/', 1)[0] + '/'].append(obj['Key'])
+    return files
+
+
+def parse_partition(prefix):
+    """(dataset, partition) of a partition prefix written by partition_prefix."""
+    dataset, *parts = prefix[len(ANALYTICS_PREFIX):].strip('/').split('/')
+    return dataset, tuple(tuple(part.split('=', 1)) for part in parts)
+
+
+def compact(s3, deadline, min_files=COMPACT_MIN_FILES):
+    """Merge the files of each partition with at least min_files files into one.
+
+    The merged file is written before its inputs are deleted, so a reader
+    never misses a record; at worst it sees one twice, which latest-record
+    reads already handle. Files written during the run are left for the next.
+    """
+    compacted = files_removed = 0
+    for prefix, keys in sorted(partition_files(s3).items()):
+        if len(keys) < max(min_files, 2):
+            continue
+        if deadline.expired():
+            logger.info("Stopping compaction at the deadline", partition=prefix)
+            break
+        dataset, partition = parse_partition(prefix)
+        if dataset not in SCHEMAS:
+            continue
+        records = latest_records([record for key in keys for record in read_records(s3, key)])
+        if records:
+            write_file(s3, dataset, partition, records, 'part')
+        for start in range(0, len(keys), 1000):
+            s3.delete_objects(Bucket=ANALYTICS_BUCKET, Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+                'Quiet': True
+            })
+        compacted += 1
+        files_removed += len(keys)
+        logger.info("Compacted partition", partition=prefix, files=len(keys), records=len(records))
+    return {'statusCode': 200, 'partitions': compacted, 'filesRemoved': files_removed}
+
+
+def backfill(visit_table, data_table, s3, deadline, start_key=None):
+    """Export every visit in the Visit table; returns nextKey to resume from if the deadline ends the run."""
+    kwargs = {'ProjectionExpression': 'visitID', 'Limit': BACKFILL_PAGE_SIZE}
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    exported = 0
+    while True:
+        response = visit_table.scan(**kwargs)
+        result = export_visits([item['visitID'] for item in response.get('Items', [])], visit_table, data_table, s3)
+        exported += result['visits']
+        next_key = response.get('LastEvaluatedKey')
+        if not next_key:
+            logger.info("Backfill complete", visits=exported)
+            return {'statusCode': 200, 'visits': exported, 'nextKey': None}
+        # Another page must fit in the time left
+        if deadline.remaining() is not None and deadline.remaining() < BACKFILL_PAGE_SECONDS:
+            logger.info("Backfill stopped at the deadline", visits=exported, nextKey=next_key)
+            return {'statusCode': 200, 'visits': exported, 'nextKey': next_key}
+        kwargs['ExclusiveStartKey'] = next_key
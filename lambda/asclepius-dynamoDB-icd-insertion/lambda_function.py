@@ -2,10 +2,11 @@ import json
 import boto3
 import os
 from botocore.exceptions import ClientError
+from asclepius_shared import log
+
+logger = log.get_logger('icd-insertion')
 
 def lambda_handler(event, context):
-    print("Received event:", json.dumps(event, indent=2))
-    
     # Initialize DynamoDB resource
     dynamodb = boto3.resource('dynamodb')
     
@@ -19,12 +20,12 @@ def lambda_handler(event, context):
     try:
         # Extract visitId from event
         visit_id = event.get('visitId') or event.get('visitID')
+        logger.bind(visitId=visit_id)
+        logger.debug("Received event", event=event)
         
         if not visit_id:
             raise ValueError("Missing visitId in event")
         
-        print(f"Processing ICD insertion for visitId: {visit_id}")
-        
         # Query source table for finalSummary data
         response = source_table.query(
             KeyConditionExpression='visitId = :vid AND dataCategory = :cat',
@@ -35,14 +36,14 @@ def lambda_handler(event, context):
         )
         
         if not response['Items']:
-            print(f"No finalSummary found for visitId: {visit_id}")
+            logger.warning("No finalSummary found for visitId: %s", visit_id)
             return {
                 'statusCode': 404,
                 'body': f'No finalSummary found for visitId: {visit_id}'
             }
         
         final_summary = response['Items'][0]
-        print(f"Found finalSummary: {json.dumps(final_summary, default=str)}")
+        logger.debug("Found finalSummary", finalSummary=final_summary)
         
         # Extract assessment data (which should contain ICD-10 codes)
         assessment_data = final_summary.get('assessment')
@@ -73,7 +74,7 @@ def lambda_handler(event, context):
                 ExpressionAttributeValues=expression_values
             )
             
-            print(f"Successfully updated ICD-10 codes for visitId: {visit_id}")
+            logger.info("Updated primary diagnosis ICD-10 code", icd10=expression_values[':primary_icd'])
             
         return {
             'statusCode': 200,
@@ -82,19 +83,19 @@ def lambda_handler(event, context):
         }
         
     except ValueError as ve:
-        print(f"Validation error: {str(ve)}")
+        logger.warning("Validation error: %s", ve)
         return {
             'statusCode': 400,
             'body': f'Validation error: {str(ve)}'
         }
     except ClientError as ce:
-        print(f"DynamoDB error: {str(ce)}")
+        logger.exception("DynamoDB error")
         return {
             'statusCode': 500,
             'body': f'Database error: {str(ce)}'
         }
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("ICD insertion failed")
         return {
             'statusCode': 500,
             'body': f'Error processing request: {str(e)}'
@@ -1,5 +1,10 @@
 import json
 import boto3
+from datetime import datetime, timezone
+from asclepius_shared import log
+from asclepius_shared.budget import VisitBudget
+
+logger = log.get_logger('extract-session-id')
 
 def lambda_handler(event, context):
     s3 = boto3.client('s3')
@@ -12,7 +17,7 @@ def lambda_handler(event, context):
         
         # Only process if it's a transcript.json file
         if 'transcript.json' not in key.lower():
-            print(f"Not a transcript file: {key}")
+            logger.debug("Not a transcript file", key=key)
             return
             
         try:
@@ -22,10 +27,19 @@ def lambda_handler(event, context):
             
             # Extract SessionId
             session_id = transcript_data['Conversation']['SessionId']
+            logger.bind(visitId=session_id)
             
             # Get summary key (assuming same directory as transcript)
             summary_key = key.replace('transcript.json', 'clinicalDoc.json')
             
+            # The visit's latency budget starts when HealthScribe delivers the transcript
+            event_time_ms = get_event_time_ms(event['Records'][0])
+            budget = VisitBudget.start(event_time_ms)
+            
+            # Patient and visit date recorded by the streaming server when the session started
+            metadata = get_session_metadata(s3, bucket, session_id)
+            visit_date = (metadata.get('startedAt') or '')[:10] or get_visit_date(event_time_ms)
+            
             # Emit event to EventBridge
             response = events.put_events(
                 Entries=[
@@ -35,15 +49,41 @@ def lambda_handler(event, context):
                         'Detail': json.dumps({
                             'bucket': bucket,
                             'key': summary_key,
-                            'visitId': session_id
+                            'visitId': session_id,
+                            'patientId': metadata.get('patientId'),
+                            'visitDate': visit_date,
+                            'visitBudget': budget.to_dict()
                         })
                     }
                 ]
             )
             
-            print(f"Emitted event to EventBridge: {response}")
+            logger.info("Emitted TranscriptProcessed event", failedEntries=response.get('FailedEntryCount'))
             return response
             
         except Exception as e:
-            print(f"Error: {str(e)}")
+            logger.exception("Error processing transcript", bucket=bucket, key=key)
             raise e
+
+def get_session_metadata(s3, bucket, session_id):
+    """Session metadata the streaming server stored next to the audio, or {} if there is none."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"session-metadata/{session_id}.json")
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except Exception as e:
+        logger.info("No session metadata: %s", e)
+        return {}
+
+def get_visit_date(event_time_ms):
+    """YYYY-MM-DD (UTC) of the transcript event, or today if its time is unknown."""
+    if event_time_ms is None:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    return datetime.fromtimestamp(event_time_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+def get_event_time_ms(record):
+    """Epoch milliseconds of an S3 event record, or None if it has no usable eventTime."""
+    try:
+        event_time = datetime.strptime(record['eventTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
+        return int((event_time - datetime(1970, 1, 1)).total_seconds() * 1000)
+    except (KeyError, ValueError):
+        return None
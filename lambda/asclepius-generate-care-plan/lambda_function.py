@@ -1,13 +1,54 @@
 import json
-import boto3
+import os
 import re
+from asclepius_shared import (bedrock_client, expert_panel, live_draft, log, patient_digest, patient_history,
+                              payload_store, prompts)
+from asclepius_shared.budget import VisitBudget
+from asclepius_shared.experts import ROUTING_INSTRUCTIONS, skip_low_priority_experts, validate_routing
+
+# Fused mode: the care-plan call also decides expert routing so the workflow can skip the orchestrator
+FUSED_ROUTING = os.environ.get('CARE_PLAN_FUSED_ROUTING', 'false').lower() == 'true'
+
+# Delta mode: a returning patient's care plan is their previous one plus the changes the model returns
+DELTA_MODE = os.environ.get('CARE_PLAN_DELTA_MODE', 'false').lower() == 'true'
+# Previous care plans older than this are not built on
+DELTA_MAX_AGE_DAYS = int(os.environ.get('CARE_PLAN_DELTA_MAX_AGE_DAYS', '365'))
+
+CARE_PLAN_SECTIONS = patient_history.CARE_PLAN_SECTIONS
+
+logger = log.get_logger('generate-care-plan')
 
 def lambda_handler(event, context):
-    bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
+    bedrock_runtime = bedrock_client.get_runtime_client('us-east-1')
     
-    clinical_summary = event['summary']
+    clinical_summary = payload_store.resolve(event['summary'])
     visitId = event['visitId']  
-    care_plan = generate_care_plan(bedrock_runtime, clinical_summary)
+    logger.bind(visitId=visitId)
+    budget = VisitBudget.from_event(event)
+    fused_routing = event.get('fusedRouting', FUSED_ROUTING)
+    # Speculative runs come from asclepius-live-draft, on the draft summary, before the visit's workflow starts
+    speculative = event.get('speculative', False)
+
+    history = patient_digest.prompt_text(patient_digest.get_digest(event.get('patientId')))
+    draft_care_plan = None if speculative else live_draft.reusable_care_plan(
+        live_draft.get_draft(visitId), clinical_summary, history=bool(history))
+    if draft_care_plan is not None:
+        logger.info("Reusing the care plan drafted during the visit")
+        care_plan = draft_care_plan
+        fused_routing = 'requiredExperts' in draft_care_plan
+    else:
+        # A fused call does the orchestrator's work too, so it may use that stage's slice
+        deadline = budget.deadline('orchestrator' if fused_routing else 'generate-care-plan', context)
+        care_plan = None
+        if DELTA_MODE and not speculative:
+            previous_plan, previous_visit = patient_history.latest_care_plan(
+                event.get('patientId'), visitId, event.get('visitDate'), DELTA_MAX_AGE_DAYS)
+            if previous_plan:
+                care_plan = generate_delta_care_plan(bedrock_runtime, clinical_summary, previous_plan,
+                                                     previous_visit, visitId, deadline, fused_routing, history)
+        if care_plan is None:
+            care_plan = generate_care_plan(bedrock_runtime, clinical_summary, visitId, deadline, fused_routing,
+                                           history)
     
 
     # Only log the suggested care plan part
@@ -19,10 +60,28 @@ def lambda_handler(event, context):
             "patientEducation": care_plan["patientEducation"],
             "followUpRecommendations": care_plan["followUpRecommendations"],
             "specialistReferrals": care_plan["specialistReferrals"]
-        }
+        },
+        "visitBudget": budget.to_dict()
     }
+    # Passed on to the experts, so the digest is read once per visit
+    if history:
+        care_plan_result["patientHistory"] = payload_store.offload(history)
+
+    # The workflow only skips the orchestrator when requiredExperts is present
+    if fused_routing:
+        required_experts = validate_routing(care_plan.get("requiredExperts"))
+        if required_experts is None:
+            logger.warning("Fused routing missing or invalid, leaving routing to the orchestrator")
+        else:
+            if budget.behind_schedule('orchestrator'):
+                required_experts = skip_low_priority_experts(required_experts)
+            care_plan_result["requiredExperts"] = required_experts
+            if not speculative:
+                care_plan_result["expertMode"] = expert_panel.choose_mode(required_experts, 'generate-care-plan', visitId, budget)
     
-    print("Care Plan Result:", json.dumps(care_plan_result, indent=2))
+    logger.debug("Care plan result", result=care_plan_result)
+    if not speculative:
+        budget.report('generate-care-plan', visitId)
     return care_plan_result
 
 
@@ -35,17 +94,33 @@ def extract_json(text):
             json_str = match.group(0)
             return json.loads(json_str)
         else:
-            print("No JSON object found in text")
+            logger.warning("No JSON object found in text")
             return {}
     except json.JSONDecodeError as e:
-        print(f"Invalid JSON in response: {str(e)}")
+        logger.warning("Invalid JSON in response: %s", e)
         return {}
 
-def generate_care_plan(bedrock_runtime, clinical_summary):
+def prepare_clinical_sections(clinical_summary, visit_id=None):
+    """The summary sections the care plan is based on, shortened to the stage's token budget."""
+    sections, sections_data = prompts.prepare_sections({
+        'chief_complaint': clinical_summary['chief_complaint'],
+        'history_present_illness': clinical_summary['history_present_illness'],
+        'assessment': clinical_summary['assessment'],
+    }, 'generate-care-plan')
+    sections_data.report('generate-care-plan', visit_id)
+    return sections
+
+def history_section(history):
+    """The patient's history digest as a prompt section, or '' for a first visit."""
+    return f"\n{history}\n" if history else ''
+
+def generate_care_plan(bedrock_runtime, clinical_summary, visit_id=None, deadline=None, fused_routing=False,
+                       history=''):
     # Pre-format the clinical data to avoid backslashes in f-strings
-    chief_complaint_text = '\n'.join(clinical_summary['chief_complaint'])
-    history_text = '\n'.join(clinical_summary['history_present_illness'])
-    assessment_text = '\n'.join(clinical_summary['assessment'])
+    sections = prepare_clinical_sections(clinical_summary, visit_id)
+    chief_complaint_text = sections['chief_complaint']
+    history_text = sections['history_present_illness']
+    assessment_text = sections['assessment']
     
     prompt = f"""Given the following clinical information, generate a detailed care plan in natural language:
 
@@ -57,7 +132,7 @@ History of Present Illness:
 
 Assessment:
 {assessment_text}
-
+{history_section(history)}
 Please provide a comprehensive care plan that addresses each of these areas in clear, natural language paragraphs:
 
 1. Diagnostic Tests and Procedures: Describe recommended tests and procedures to confirm or monitor the condition.
@@ -78,6 +153,8 @@ Format your response as a JSON object with the following structure, using comple
   "followUpRecommendations": ["Write follow-up instructions in clear, complete sentences"],
   "specialistReferrals": ["Explain each referral recommendation in detail"]
 }}"""
+    if fused_routing:
+        prompt += "\n\n" + ROUTING_INSTRUCTIONS
 
     request_body = {
         "schemaVersion": "messages-v1",
@@ -93,7 +170,8 @@ Format your response as a JSON object with the following structure, using comple
             }
         ],
         "inferenceConfig": {
-            "maxTokens": 2000,
+            # Routing for twelve experts needs room on top of the care plan
+            "maxTokens": 3500 if fused_routing else 2000,
             "temperature": 0.7,
             "topP": 0.9,
             "topK": 20
@@ -101,26 +179,27 @@ Format your response as a JSON object with the following structure, using comple
     }
 
     try:
-        bedrock_response = bedrock_runtime.invoke_model(
-            modelId='us.amazon.nova-micro-v1:0',
-            body=json.dumps(request_body)
+        response_body = bedrock_client.invoke_model(
+            bedrock_runtime,
+            request_body,
+            stage='generate-care-plan',
+            model_id='us.amazon.nova-micro-v1:0',
+            visit_id=visit_id,
+            deadline=deadline
         )
-        
-        response_body = json.loads(bedrock_response['body'].read())
-        care_plan_text = response_body['output']['message']['content'][0]['text']
+        care_plan_text = bedrock_client.get_response_text(response_body)
         
         # Extract JSON from the response
         care_plan_json = extract_json(care_plan_text)
         
         # Ensure all expected keys are present
-        expected_keys = ["diagnosticTests", "treatmentOptions", "patientEducation", "followUpRecommendations", "specialistReferrals"]
-        for key in expected_keys:
+        for key in CARE_PLAN_SECTIONS:
             if key not in care_plan_json:
                 care_plan_json[key] = []
         
         return care_plan_json
     except Exception as e:
-        print(f"Error generating care plan: {str(e)}")
+        logger.exception("Error generating care plan")
         return {
             "diagnosticTests": [],
             "treatmentOptions": [],
@@ -129,3 +208,129 @@ Format your response as a JSON object with the following structure, using comple
             "specialistReferrals": [],
             "error": str(e)
         }
+
+
+def generate_delta_care_plan(bedrock_runtime, clinical_summary, previous_plan, previous_visit, visit_id=None,
+                             deadline=None, fused_routing=False, history=''):
+    """Update a returning patient's previous care plan for this visit.
+
+    The model returns only what changes in each section, which is merged
+    into the previous plan here. Returns None if the call or its response
+    fails, so the caller can generate the plan in full.
+    """
+    sections = prepare_clinical_sections(clinical_summary, visit_id)
+    # Items are numbered so changes can refer to them without repeating them
+    previous_text = "\n\n".join(
+        f"{section}:\n" + ("\n".join(f"{number}. {item}" for number, item in enumerate(previous_plan[section], 1))
+                           or "(none)")
+        for section in CARE_PLAN_SECTIONS
+    )
+
+    prompt = f"""This patient is returning for a follow-up visit. Update their previous care plan for today's visit.
+
+Today's clinical information:
+
+Chief Complaint:
+{sections['chief_complaint']}
+
+History of Present Illness:
+{sections['history_present_illness']}
+
+Assessment:
+{sections['assessment']}
+{history_section(history)}
+Previous care plan (visit of {previous_visit.get('date') or 'unknown date'}):
+
+{previous_text}
+
+Return only the changes, as a JSON object with an entry for each section that changes:
+{{
+  "diagnosticTests": {{
+    "remove": [numbers of items that no longer apply],
+    "modify": {{"number of an item": "the item rewritten as a complete sentence"}},
+    "add": ["each new item as a complete sentence"]
+  }}
+}}
+Leave out sections that need no change, and leave out "remove", "modify" or "add" when empty. Return {{}} if the previous care plan still applies in full."""
+    if fused_routing:
+        prompt += "\n\n" + ROUTING_INSTRUCTIONS
+
+    request_body = {
+        "schemaVersion": "messages-v1",
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"text": prompt}]
+            }
+        ],
+        "system": [
+            {
+                "text": "You are a medical assistant that keeps care plans current across a patient's visits while maintaining clinical accuracy. Always respond in the requested JSON format."
+            }
+        ],
+        "inferenceConfig": {
+            "maxTokens": 2500 if fused_routing else 1000,
+            "temperature": 0.3,
+            "topP": 0.9,
+            "topK": 20
+        }
+    }
+
+    try:
+        response_body = bedrock_client.invoke_model(
+            bedrock_runtime,
+            request_body,
+            stage='generate-care-plan-delta',
+            model_id='us.amazon.nova-micro-v1:0',
+            visit_id=visit_id,
+            deadline=deadline
+        )
+        match = re.search(r'\{[\s\S]*\}', bedrock_client.get_response_text(response_body))
+        delta = json.loads(match.group(0)) if match else None
+    except Exception:
+        logger.exception("Error generating care plan changes, generating it in full")
+        return None
+    if not isinstance(delta, dict):
+        logger.warning("No JSON object in the care plan changes, generating it in full")
+        return None
+
+    care_plan = apply_care_plan_delta(previous_plan, delta)
+    logger.info("Updated the care plan of the previous visit", previousVisitId=previous_visit.get('visitID'),
+                changedSections=[section for section in CARE_PLAN_SECTIONS if isinstance(delta.get(section), dict)])
+    return care_plan
+
+
+def _item_index(number, count):
+    """Zero-based index of a 1-based item number from the model, or None if it is not an item."""
+    try:
+        index = int(str(number).strip().rstrip('.')) - 1
+    except ValueError:
+        return None
+    return index if 0 <= index < count else None
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def apply_care_plan_delta(previous_plan, delta):
+    """Merge changes into a previous care plan: numbered items are modified or removed, new items appended."""
+    care_plan = {}
+    for section in CARE_PLAN_SECTIONS:
+        items = list(previous_plan.get(section) or [])
+        changes = delta.get(section)
+        if isinstance(changes, dict):
+            modify = changes.get('modify')
+            for number, text in (modify.items() if isinstance(modify, dict) else []):
+                index = _item_index(number, len(items))
+                if index is not None and str(text).strip():
+                    items[index] = str(text)
+            remove = {_item_index(number, len(items)) for number in _as_list(changes.get('remove'))}
+            items = [item for index, item in enumerate(items) if index not in remove]
+            items += [str(item) for item in _as_list(changes.get('add')) if str(item).strip()]
+        care_plan[section] = items
+    if 'requiredExperts' in delta:
+        care_plan['requiredExperts'] = delta['requiredExperts']
+    return care_plan
@@ -1,14 +1,27 @@
-import json
 import boto3
+import json
 import os
-import re
-from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+from asclepius_shared import icd10, live_draft, log, payload_store
+from asclepius_shared.budget import VisitBudget
+from asclepius_shared.icd10 import extract_diagnoses_from_assessment
+
+logger = log.get_logger('icd10-verify')
 
 ## Extracts diagnoses from summary.json. Performs RAG query on ICD-10 database using diagnoses and returns SOAP with validated codes
+##
+## Stores the verified summary as the visit's finalSummary row itself, so the summary is not passed back through
+## the workflow state just to be written.
+
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+# Unset until OpenSearch is re-enabled; verification is skipped without it
+KNOWLEDGE_BASE_ID = os.environ.get('KNOWLEDGE_BASE_ID')
+
+# Summary sections stored in the finalSummary row, each as a JSON string
+SUMMARY_FIELDS = ['chief_complaint', 'history_present_illness', 'review_systems', 'assessment', 'plan',
+                  'past_medical_history', 'physical_examination']
 
 def lambda_handler(event, context):
-    print("Received event:", json.dumps(event, indent=2))  # Debug log
-    
     # Use environment variable for region
     region = os.environ.get('AWS_REGION', 'us-east-1')
     bedrock_runtime = boto3.client('bedrock-runtime', region_name=region)
@@ -17,129 +30,77 @@ def lambda_handler(event, context):
     # Get data from Step Functions input
     payload = event.get('Payload', event)  # Handles both direct and Step Functions input
     
-    clinical_summary = payload['summary']
+    clinical_summary = payload_store.resolve(payload['summary'])
     bucket = payload['bucket']
     visit_id = payload['visitId']
+    budget = VisitBudget.from_event(payload)
+    logger.bind(visitId=visit_id)
+    logger.debug("Received event", event=event)
     
     try:
         # 1. Extract diagnoses from assessment section
         diagnoses = extract_diagnoses_from_assessment(clinical_summary['assessment'])
-        print(f"Extracted diagnoses: {diagnoses}")
+        logger.info("Extracted %d diagnoses", len(diagnoses), diagnoses=diagnoses)
         
-        # 2. Verify ICD-10 codes using RAG query (commented out until OpenSearch is re-enabled)
-        verified_codes = {}
-        # knowledge_base_id = os.environ.get('KNOWLEDGE_BASE_ID')
-        # if knowledge_base_id:
-        #     for diagnosis in diagnoses:
-        #         verified_code = query_knowledge_base(diagnosis, knowledge_base_id)
-        #         if verified_code:
-        #             verified_codes[diagnosis] = verified_code
-        #             print(f"Found code for {diagnosis}: {verified_code}")
-        #         else:
-        #             print(f"No code found for {diagnosis}")
-        # else:
-        #     print("Knowledge base ID not configured, skipping ICD-10 verification")
+        # 2. Verify ICD-10 codes using RAG query.
+        # Diagnoses already looked up while the visit was recorded reuse those codes.
+        cached_codes = live_draft.cached_codes(live_draft.get_draft(visit_id))
+        verified_codes = {diagnosis: cached_codes[diagnosis] for diagnosis in diagnoses if diagnosis in cached_codes}
+        if verified_codes:
+            logger.info("Reused %d codes from the live draft", len(verified_codes))
+        if KNOWLEDGE_BASE_ID:
+            uncached = [diagnosis for diagnosis in diagnoses if diagnosis not in verified_codes]
+            verified_codes.update(icd10.lookup_codes(uncached, KNOWLEDGE_BASE_ID, visit_id=visit_id))
+        else:
+            logger.info("Knowledge base ID not configured, skipping ICD-10 verification")
         
-        print(f"Verified codes: {verified_codes}")
+        logger.info("Verified %d codes", len(verified_codes), verifiedCodes=verified_codes)
         
-        # 3. Update assessment with ICD-10 codes (if any were found)
+        # 3. Update assessment with ICD-10 codes (if any were found); diagnoses without one stay as they are
         updated_assessment = []
         if verified_codes:
-            for diagnosis, code in verified_codes.items():
-                updated_assessment.append(f"{diagnosis} (ICD-10: {code})")
+            for diagnosis in diagnoses:
+                code = verified_codes.get(diagnosis)
+                updated_assessment.append(f"{diagnosis} (ICD-10: {code})" if code else diagnosis)
         else:
             # Keep original assessment if no codes were verified
             updated_assessment = clinical_summary['assessment']
         
         clinical_summary['assessment'] = updated_assessment
         
+        store_final_summary(visit_id, clinical_summary, verified_codes)
+
         result = {
-            "summary": clinical_summary,
+            "summary": payload_store.offload(clinical_summary),
             "bucket": bucket,
             "visitId": visit_id,
             "originalKey": payload.get('originalKey'),  
-            "verifiedCodes": verified_codes
+            "verifiedCodes": verified_codes,
+            "visitBudget": budget.to_dict()
         }
         
-        print("Function output:", json.dumps(result, indent=2))  # Debug log
+        logger.debug("Function output", result=result)
+        budget.report('icd10-verify', visit_id)
         return result
         
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("ICD-10 verification failed")
         raise e
 
-def extract_diagnoses_from_assessment(assessment_items):
-    """Extract potential diagnoses from assessment items"""
-    diagnoses = []
-    for item in assessment_items:
-        # Remove leading/trailing whitespace and dash
-        cleaned_item = item.strip().lstrip('-').strip()
-        diagnoses.append(cleaned_item)
-    return diagnoses
 
-def query_knowledge_base(diagnosis, knowledge_base_id):
-    """Query the knowledge base for ICD-10 code of a diagnosis"""
-    region = os.environ.get('AWS_REGION', 'us-east-1')
-    bedrock_agent = boto3.client('bedrock-agent-runtime', region_name=region)
-    try:
-        query = f"""Find the exact ICD-10 code for: '{diagnosis}'
-
-Rules:
-1. EXACT MATCH REQUIRED: If '{diagnosis}' exists as an exact term match in the database, use that code
-2. Only if no exact match exists:
-   - Use the most general/unspecified version of the condition
-   - Avoid specific subtypes or variants unless explicitly mentioned
-3. Return only a single code
-
-Required format:
-[CODE]"""
-        
-        print(f"Querying knowledge base with: '{query}'")
-        
-        response = bedrock_agent.retrieve_and_generate(
-            input={
-                'text': query
-            },
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': knowledge_base_id,
-                    'modelArn': f'arn:aws:bedrock:{region}::foundation-model/amazon.nova-micro-v1:0',
-                    'retrievalConfiguration': {
-                        'vectorSearchConfiguration': {
-                            'numberOfResults': 3
-                        }
-                    },
-                    'generationConfiguration': {
-                        'promptTemplate': {
-                            'textPromptTemplate': """Given the following retrieved information:
-$search_results$
-
-Return ONLY the single most appropriate ICD-10 code for: {query}
-
-Format: [CODE]"""
-                        },
-                        'inferenceConfig': {
-                            'textInferenceConfig': {
-                                'maxTokens': 500,
-                                'temperature': 0,
-                                'topP': 1
-                            }
-                        }
-                    }
-                }
-            }
-        )
-        generated_text = response.get('output', {}).get('text', 'No response generated')
-        print(f"Raw response from knowledge base: {generated_text}")
-        
-        cleaned_code = generated_text.strip('[]').strip()
-        if re.match(r'^[A-Z]\d+(\.\d+)?$', cleaned_code):
-            return cleaned_code
-        else:
-            print(f"No valid ICD-10 code found in response for {diagnosis}: {cleaned_code}")
-            return None
+def store_final_summary(visit_id, summary, verified_codes, table=None):
+    """Write the visit's finalSummary row, in the format the workflow's States.JsonToString wrote it."""
+    def to_string(value):
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
 
-    except ClientError as e:
-        print(f"Error querying knowledge base: {str(e)}")
-        return None
+    item = {
+        'visitId': visit_id,
+        'dataCategory': 'finalSummary',
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        'verifiedCodes': to_string(verified_codes),
+    }
+    for field in SUMMARY_FIELDS:
+        if field in summary:
+            item[field] = to_string(summary[field])
+    (table or boto3.resource('dynamodb').Table(VISIT_DATA_TABLE)).put_item(Item=item)
+    logger.info("Stored final summary")
@@ -0,0 +1,231 @@
+import json
+import os
+import re
+import time
+import boto3
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from asclepius_shared import bedrock_client, icd10, live_draft, log, prompts
+from asclepius_shared.deadline import Deadline
+
+## Builds a draft of the visit while it is still being recorded
+##
+## {"action": "delta", "visitId": ..., "seq": n, "segments": [...]} folds new transcript segments into a rolling
+## clinical summary and looks up ICD-10 codes for any new diagnoses. The streaming server sends deltas one at a
+## time, in order. {"action": "finalize", "visitId": ..., "patientId": ...} is sent when the recording stops: it
+## generates a speculative care plan with routing from the draft and the patient's history digest, which the
+## workflow reuses if the final diagnoses match.
+
+MODEL_ID = 'us.amazon.nova-micro-v1:0'
+CARE_PLAN_FUNCTION = os.environ.get('CARE_PLAN_FUNCTION', 'asclepius-generate-care-plan')
+KNOWLEDGE_BASE_ID = os.environ.get('KNOWLEDGE_BASE_ID')
+
+# Drafts are only needed until the visit's workflow has run
+DRAFT_TTL_SECONDS = 2 * 24 * 3600
+
+# Earlier lines repeated in each update so the model can resolve references like "it" or "that one"
+CONTEXT_LINES = 6
+# Lines carried to the next delta when an update fails; older ones are dropped
+MAX_PENDING_LINES = 200
+
+logger = log.get_logger('live-draft')
+
+
+def lambda_handler(event, context):
+    visit_id = event.get('visitId')
+    if not visit_id:
+        raise ValueError("Missing visitId in event")
+    action = event.get('action', 'delta')
+    logger.bind(visitId=visit_id, action=action)
+
+    table = live_draft.get_table()
+    bedrock_runtime = bedrock_client.get_runtime_client('us-east-1')
+    deadline = Deadline.from_context(context)
+    if action == 'finalize':
+        return finalize(table, bedrock_runtime, boto3.client('lambda'), visit_id, deadline, event.get('patientId'))
+    return apply_delta(table, bedrock_runtime, visit_id, int(event.get('seq', 0)), event.get('segments', []), deadline)
+
+
+def new_draft(visit_id):
+    return {
+        'visitID': visit_id,
+        'lastSeq': 0,
+        'status': 'recording',
+        'summary': {key: [] for key in live_draft.SUMMARY_KEYS},
+        'diagnoses': [],
+        'codes': {},
+        'recentLines': [],
+        'pendingLines': []
+    }
+
+
+def format_line(segment):
+    speaker = (segment.get('speaker') or segment.get('channel') or 'SPEAKER').replace('_0', '')
+    return f"{speaker}: {segment['content'].strip()}"
+
+
+def apply_delta(table, bedrock_runtime, visit_id, seq, segments, deadline):
+    """Fold one delta of final transcript segments into the visit's draft."""
+    draft = live_draft.get_draft(visit_id, table) or new_draft(visit_id)
+    if seq <= int(draft['lastSeq']):
+        logger.info("Delta %d already applied", seq, lastSeq=int(draft['lastSeq']))
+        return {'statusCode': 200, 'visitId': visit_id, 'applied': False}
+
+    lines = list(draft.get('pendingLines') or []) + [
+        format_line(segment) for segment in segments if (segment.get('content') or '').strip()
+    ]
+    if lines:
+        update_draft(bedrock_runtime, draft, lines, visit_id, deadline)
+    save_draft(table, draft, seq)
+    return {
+        'statusCode': 200,
+        'visitId': visit_id,
+        'applied': True,
+        'diagnoses': len(draft['diagnoses']),
+        'pendingLines': len(draft['pendingLines'])
+    }
+
+
+def update_draft(bedrock_runtime, draft, lines, visit_id, deadline):
+    """Update the draft's summary, diagnoses and codes in place with new transcript lines.
+
+    If the model call fails, the lines stay pending and go out with the next delta.
+    """
+    try:
+        summary = update_summary(bedrock_runtime, draft['summary'], draft.get('recentLines') or [],
+                                 lines, visit_id, deadline)
+    except Exception:
+        logger.exception("Could not update the live summary, keeping %d lines for the next delta", len(lines))
+        draft['pendingLines'] = lines[-MAX_PENDING_LINES:]
+        return
+
+    draft['summary'] = summary
+    draft['pendingLines'] = []
+    draft['recentLines'] = (list(draft.get('recentLines') or []) + lines)[-CONTEXT_LINES:]
+    draft['diagnoses'] = icd10.extract_diagnoses_from_assessment(summary['assessment'])
+    if KNOWLEDGE_BASE_ID:
+        # Only diagnoses new to this visit are queried; the rest come from the draft's cache
+        codes = dict(draft.get('codes') or {})
+        icd10.lookup_codes(draft['diagnoses'], KNOWLEDGE_BASE_ID, codes, visit_id)
+        draft['codes'] = codes
+    logger.info("Updated live draft with %d lines", len(lines), diagnoses=len(draft['diagnoses']))
+
+
+def update_summary(bedrock_runtime, summary, recent_lines, new_lines, visit_id, deadline):
+    """Ask the model to fold new transcript lines into the running summary."""
+    prompt = f"""You are keeping a running clinical summary of a patient visit that is still in progress.
+
+Current summary:
+{prompts.compact_json(plain(summary))}
+
+Earlier lines, for context only:
+{chr(10).join(recent_lines) or '(start of visit)'}
+
+New transcript lines:
+{chr(10).join(new_lines)}
+
+Update the summary with what the new lines add or change, keeping everything that is still accurate. Return only a JSON object with exactly these keys, each a list of short statements: {', '.join(live_draft.SUMMARY_KEYS)}. Write each assessment entry as one diagnosis, without codes."""
+
+    request_body = {
+        "schemaVersion": "messages-v1",
+        "messages": [{"role": "user", "content": [{"text": prompt}]}],
+        "system": [{"text": "You are a medical scribe. Always respond with the requested JSON object only."}],
+        "inferenceConfig": {
+            "maxTokens": 1500,
+            "temperature": 0.2,
+            "topP": 0.9
+        }
+    }
+    response_body = bedrock_client.invoke_model(bedrock_runtime, request_body, stage='live-draft',
+                                                model_id=MODEL_ID, visit_id=visit_id, deadline=deadline)
+    return parse_summary(bedrock_client.get_response_text(response_body))
+
+
+def parse_summary(text):
+    """The summary JSON object in a model response, with every key a list of strings."""
+    match = re.search(r'\{[\s\S]*\}', text)
+    if not match:
+        raise ValueError("No JSON object in the summary response")
+    parsed = json.loads(match.group(0))
+    summary = {}
+    for key in live_draft.SUMMARY_KEYS:
+        value = parsed.get(key) or []
+        if not isinstance(value, list):
+            value = [value]
+        summary[key] = [str(item) for item in value if str(item).strip()]
+    return summary
+
+
+def plain(value):
+    """Convert DynamoDB values (Decimal) to JSON-serializable ones."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {key: plain(inner) for key, inner in value.items()}
+    if isinstance(value, list):
+        return [plain(inner) for inner in value]
+    return value
+
+
+def save_draft(table, draft, seq):
+    """Write the draft unless a later delta has been applied since it was read."""
+    item = dict(draft, lastSeq=seq, updatedAt=int(time.time() * 1000),
+                expiresAt=int(time.time()) + DRAFT_TTL_SECONDS)
+    try:
+        table.put_item(
+            Item=item,
+            ConditionExpression='attribute_not_exists(visitID) OR lastSeq < :seq',
+            ExpressionAttributeValues={':seq': seq}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("A later delta was applied first, dropping delta %d", seq)
+
+
+def finalize(table, bedrock_runtime, lambda_client, visit_id, deadline, patient_id=None):
+    """Generate the speculative care plan and routing from the finished draft."""
+    draft = live_draft.get_draft(visit_id, table)
+    if not draft:
+        logger.info("No live draft to finalize")
+        return {'statusCode': 200, 'visitId': visit_id, 'status': 'missing'}
+    if draft.get('pendingLines'):
+        update_draft(bedrock_runtime, draft, list(draft['pendingLines']), visit_id, deadline)
+    if not draft['diagnoses']:
+        logger.info("Live draft has no diagnoses, leaving the care plan to the workflow")
+        save_draft(table, dict(draft, status='recorded'), int(draft['lastSeq']) + 1)
+        return {'statusCode': 200, 'visitId': visit_id, 'status': 'recorded'}
+
+    # Same function, prompt and fused routing the workflow would use on the final summary
+    response = lambda_client.invoke(
+        FunctionName=CARE_PLAN_FUNCTION,
+        Payload=json.dumps({
+            'summary': plain(draft['summary']),
+            'visitId': visit_id,
+            'patientId': patient_id,
+            'fusedRouting': True,
+            'speculative': True
+        })
+    )
+    result = json.loads(response['Payload'].read())
+    care_plan = None if response.get('FunctionError') else result.get('carePlan')
+    # generate-care-plan reports a failed model call as empty sections with an error, not a FunctionError
+    if not live_draft.complete_care_plan(care_plan):
+        logger.error("Speculative care plan failed", error=(care_plan or {}).get('error') or result)
+        save_draft(table, dict(draft, status='failed'), int(draft['lastSeq']) + 1)
+        return {'statusCode': 500, 'visitId': visit_id, 'status': 'failed'}
+
+    care_plan = {key: value for key, value in care_plan.items() if key != 'visitId'}
+    draft.update({
+        'status': 'ready',
+        'carePlan': care_plan,
+        'carePlanDiagnoses': list(draft['diagnoses']),
+        # The care-plan function only returns patientHistory when the digest was in its prompt
+        'carePlanWithHistory': 'patientHistory' in result
+    })
+    if result.get('requiredExperts'):
+        draft['requiredExperts'] = result['requiredExperts']
+    save_draft(table, draft, int(draft['lastSeq']) + 1)
+    logger.info("Speculative care plan ready", diagnoses=len(draft['diagnoses']),
+                routed='requiredExperts' in draft)
+    return {'statusCode': 200, 'visitId': visit_id, 'status': 'ready'}
@@ -1,35 +1,59 @@
 import json
-import boto3
 import os
+from asclepius_shared import bedrock_client, expert_panel, log, prompts, routing_cache
+from asclepius_shared.experts import default_routing, needed_experts, skip_low_priority_experts, validate_routing
+from asclepius_shared.budget import VisitBudget
+
+logger = log.get_logger('orchestrator')
 
 ## Takes care plan as input and invokes NOVA to determine which of 12 healthcare experts should be consulted. Returns JSON with reasoning.
 
 def lambda_handler(event, context):
-    print("Received event:", json.dumps(event, indent=2))
-    
     # Use environment variable for region
     region = os.environ.get('AWS_REGION', 'us-east-1')
-    bedrock_runtime = boto3.client('bedrock-runtime', region_name=region)
+    bedrock_runtime = bedrock_client.get_runtime_client(region)
     
     # Extract the care plan from the event
     care_plan = event.get('carePlan', {})
-    print("Extracted care plan:", json.dumps(care_plan, indent=2))
-    
-    required_experts = analyze_expert_needs(bedrock_runtime, care_plan)
+    visit_id = event.get('visitId') or care_plan.get('visitId')
+    logger.bind(visitId=visit_id)
+    logger.debug("Received event", event=event)
+    budget = VisitBudget.from_event(event)
+    required_experts = analyze_expert_needs(
+        bedrock_runtime,
+        care_plan,
+        visit_id,
+        budget.deadline('orchestrator', context)
+    )
+
+    # A visit that is already late skips the experts least likely to change the plan
+    if budget.behind_schedule('orchestrator'):
+        required_experts = skip_low_priority_experts(required_experts)
     
     result = {
         "requiredExperts": required_experts,
+        "expertMode": expert_panel.choose_mode(required_experts, 'orchestrator', visit_id, budget),
         "status": "success"
     }
     
-    print("Required Experts:", json.dumps(required_experts, indent=2))
+    logger.info("Routed visit to %d experts", len(needed_experts(required_experts)),
+                expertMode=result['expertMode'], requiredExperts=required_experts)
+    budget.report('orchestrator', visit_id)
     return result
 
-def analyze_expert_needs(bedrock_runtime, care_plan):
+def analyze_expert_needs(bedrock_runtime, care_plan, visit_id=None, deadline=None):
+    # Near-duplicates of an already routed care plan reuse its routing, except for spot checks
+    cached = routing_cache.lookup(care_plan, visit_id)
+    if cached and cached.hit and not cached.spot_check:
+        return cached.routing
+
+    care_plan_data = prompts.prepare(care_plan, 'orchestrator')
+    care_plan_data.report('orchestrator', visit_id)
+
     prompt = f"""Analyze this care plan and determine which specialized healthcare providers should be consulted.
 
 Care Plan:
-{json.dumps(care_plan, indent=2)}
+{care_plan_data.text}
 
 Consider the following experts:
 1. Certified Diabetes Care and Education Specialist (Focus: diabetes management, education, and support)
@@ -106,33 +130,30 @@ Ensure you provide an entry for each expert, even if they are not needed."""
     }
 
     try:
-        bedrock_response = bedrock_runtime.invoke_model(
-            modelId='us.amazon.nova-micro-v1:0',
-            body=json.dumps(request_body)
+        response_body = bedrock_client.invoke_model(
+            bedrock_runtime,
+            request_body,
+            stage='orchestrator',
+            model_id='us.amazon.nova-micro-v1:0',
+            visit_id=visit_id,
+            deadline=deadline
         )
-        
-        response_body = json.loads(bedrock_response['body'].read())
-        response_text = response_body['output']['message']['content'][0]['text']
+        response_text = bedrock_client.get_response_text(response_body)
         
         try:
-            experts_json = json.loads(response_text)
+            experts_json = validate_routing(json.loads(response_text))
+            if experts_json is None:
+                logger.warning("Routing response has the wrong shape, using default routing", response=response_text)
+                return create_default_response()
+            routing_cache.record(cached, experts_json, visit_id)
             return experts_json
         except json.JSONDecodeError:
-            print(f"Invalid JSON in response: {response_text}")
+            logger.warning("Invalid JSON in routing response, using default routing", response=response_text)
             return create_default_response()
             
-    except Exception as e:
-        print(f"Error analyzing expert needs: {str(e)}")
+    except Exception:
+        logger.exception("Error analyzing expert needs, using default routing")
         return create_default_response()
 
 def create_default_response():
-    experts = [
-        "diabetes_specialist", "allergies_expert", "kidney_expert", "insurance_expert",
-        "nutritionist", "ophthalmologist", "podiatrist", "hospital_care_team",
-        "ada_expert", "social_determinants_expert", "physical_therapist", "pharmacist"
-    ]
-    
-    return {expert: {
-        "needed": False,
-        "reasons": [],
-    } for expert in experts}
+    return default_routing()
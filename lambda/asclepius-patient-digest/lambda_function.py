@@ -0,0 +1,200 @@
+import json
+import os
+import re
+import time
+import boto3
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from asclepius_shared import bedrock_client, log, patient_digest, prompts
+from asclepius_shared.deadline import Deadline
+from asclepius_shared.experts import DATA_CATEGORIES
+from asclepius_shared.icd10 import extract_diagnoses_from_assessment
+
+## Merges a finished visit into its patient's history digest
+##
+## Runs as the workflow's last step. Problems are merged from the visit's assessment and verified codes without
+## a model call. One small model call folds the visit's plan, care plan and expert results into the medications,
+## recommendations and trend notes. Its input is the capped digest plus this one visit, so an update costs the
+## same whatever the length of the patient's history.
+
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+MODEL_ID = 'us.amazon.nova-micro-v1:0'
+
+# Attempts at a read-modify-write before giving up to a workflow retry
+MAX_WRITE_ATTEMPTS = 5
+
+EXPERT_NAMES = {category: expert for expert, category in DATA_CATEGORIES.items()}
+
+logger = log.get_logger('patient-digest')
+
+
+def lambda_handler(event, context):
+    visit_id = event.get('visitId')
+    if not visit_id:
+        raise ValueError("Missing visitId in event")
+    patient_id = event.get('patientId')
+    logger.bind(visitId=visit_id)
+    if not patient_id:
+        logger.info("Visit has no patient, no digest to update")
+        return {'statusCode': 200, 'visitId': visit_id, 'updated': False}
+
+    dynamodb = boto3.resource('dynamodb')
+    table = patient_digest.get_table()
+    visit = load_visit(dynamodb.Table(VISIT_DATA_TABLE), visit_id)
+    visit_date = event.get('visitDate') or time.strftime('%Y-%m-%d')
+    bedrock_runtime = bedrock_client.get_runtime_client('us-east-1')
+    deadline = Deadline.from_context(context)
+
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        current = table.get_item(Key={'patientID': patient_id}, ConsistentRead=True).get('Item')
+        digest = plain(current) if current else patient_digest.new_digest(patient_id)
+        if visit_id in digest['appliedVisits']:
+            logger.info("Visit already merged into the patient digest")
+            return {'statusCode': 200, 'visitId': visit_id, 'updated': False}
+
+        merge_visit(bedrock_runtime, digest, visit, visit_id, visit_date, deadline)
+        try:
+            table.put_item(
+                Item=digest,
+                ConditionExpression='attribute_not_exists(patientID) OR version = :expected',
+                ExpressionAttributeValues={':expected': digest['version'] - 1}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info("Patient digest changed concurrently, retrying")
+            continue
+        logger.info("Updated patient digest", visitCount=digest['visitCount'], problems=len(digest['problems']),
+                    size=len(json.dumps(digest)))
+        return {'statusCode': 200, 'visitId': visit_id, 'updated': True, 'version': digest['version']}
+    raise RuntimeError(f"Could not update the digest of patient {patient_id} after {MAX_WRITE_ATTEMPTS} attempts")
+
+
+def parse(value):
+    """Read an attribute the workflow stored with States.JsonToString."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def plain(value):
+    """Convert DynamoDB values (Decimal) to JSON-serializable ones."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {key: plain(inner) for key, inner in value.items()}
+    if isinstance(value, list):
+        return [plain(inner) for inner in value]
+    return value
+
+
+def load_visit(data_table, visit_id):
+    """The parts of the visit the digest is built from: summary, verified codes, care plan and expert results."""
+    rows = {}
+    kwargs = {
+        'KeyConditionExpression': 'visitId = :vid',
+        'ExpressionAttributeValues': {':vid': visit_id}
+    }
+    while True:
+        response = data_table.query(**kwargs)
+        for item in response.get('Items', []):
+            rows[item['dataCategory']] = item
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    summary = rows.get('finalSummary') or {}
+    care_plan = rows.get('carePlan') or {}
+    experts = {}
+    for category, expert in EXPERT_NAMES.items():
+        result = parse((rows.get(category) or {}).get('expertResult'))
+        if isinstance(result, str) and result.strip():
+            experts[expert] = result
+    return {
+        'assessment': parse(summary.get('assessment')) or [],
+        'plan': parse(summary.get('plan')) or [],
+        'verifiedCodes': parse(summary.get('verifiedCodes')) or {},
+        'treatmentOptions': parse(care_plan.get('treatmentOptions')) or [],
+        'experts': experts
+    }
+
+
+def merge_visit(bedrock_runtime, digest, visit, visit_id, visit_date, deadline):
+    """Merge one visit into the digest in place."""
+    assessment = visit['assessment'] if isinstance(visit['assessment'], list) else [visit['assessment']]
+    codes = visit['verifiedCodes'] if isinstance(visit['verifiedCodes'], dict) else {}
+    digest['problems'] = patient_digest.merge_problems(
+        digest['problems'], extract_diagnoses_from_assessment(assessment), codes, visit_date)
+
+    try:
+        update = summarize_visit(bedrock_runtime, digest, visit, visit_id, deadline)
+    except Exception:
+        logger.exception("Could not update medications, recommendations and trends; keeping the previous ones")
+        update = {}
+    if isinstance(update.get('medications'), list):
+        digest['medications'] = [str(entry) for entry in update['medications'] if str(entry).strip()]
+    # The latest recommendation of each expert, this visit's first
+    recommendations = [
+        {'expert': str(entry.get('expert')), 'text': str(entry.get('text')), 'visitDate': visit_date}
+        for entry in update.get('recommendations') or []
+        if isinstance(entry, dict) and entry.get('expert') in visit['experts'] and str(entry.get('text') or '').strip()
+    ]
+    consulted = {entry['expert'] for entry in recommendations}
+    digest['recommendations'] = recommendations + [entry for entry in digest['recommendations']
+                                                   if entry['expert'] not in consulted]
+    if isinstance(update.get('trends'), list):
+        digest['trends'] = [str(entry) for entry in update['trends'] if str(entry).strip()]
+
+    digest['visitCount'] = digest['visitCount'] + 1
+    digest['lastVisitId'] = visit_id
+    digest['lastVisitDate'] = visit_date
+    digest['appliedVisits'] = digest['appliedVisits'] + [visit_id]
+    digest['version'] = digest['version'] + 1
+    digest['updatedAt'] = int(time.time() * 1000)
+    patient_digest.cap(digest)
+
+
+def summarize_visit(bedrock_runtime, digest, visit, visit_id, deadline):
+    """Ask the model for the updated medications and trends, and one line per expert recommendation."""
+    visit_data = prompts.prepare({
+        'assessment': visit['assessment'],
+        'plan': visit['plan'],
+        'treatmentOptions': visit['treatmentOptions'],
+        'expertResults': visit['experts']
+    }, 'patient-digest')
+    visit_data.report('patient-digest', visit_id)
+
+    prompt = f"""You maintain a short running record of a patient's history. Update it with today's visit.
+
+Current record:
+Medications: {prompts.compact_json(digest['medications'])}
+Trends: {prompts.compact_json(digest['trends'])}
+Problems: {prompts.compact_json([problem['name'] for problem in digest['problems']])}
+
+Today's visit:
+{visit_data.text}
+
+Return only a JSON object with these keys:
+- "medications": the patient's current medications after today's visit, one short entry each with dose if known (at most {patient_digest.MAX_MEDICATIONS})
+- "recommendations": the main recommendation of each expert in today's visit, as [{{"expert": "<expert key from expertResults>", "text": "<one sentence>"}}]
+- "trends": short notes on how the patient's conditions are changing over time, combining the current trends with today's visit (at most {patient_digest.MAX_TRENDS})"""
+
+    request_body = {
+        "schemaVersion": "messages-v1",
+        "messages": [{"role": "user", "content": [{"text": prompt}]}],
+        "system": [{"text": "You are a medical record assistant that keeps concise patient histories. Always respond with the requested JSON object only."}],
+        "inferenceConfig": {
+            "maxTokens": 1200,
+            "temperature": 0.2,
+            "topP": 0.9
+        }
+    }
+    response_body = bedrock_client.invoke_model(bedrock_runtime, request_body, stage='patient-digest',
+                                                model_id=MODEL_ID, visit_id=visit_id, deadline=deadline)
+    match = re.search(r'\{[\s\S]*\}', bedrock_client.get_response_text(response_body))
+    if not match:
+        raise ValueError("No JSON object in the digest update")
+    return json.loads(match.group(0))
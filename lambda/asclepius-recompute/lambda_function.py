@@ -0,0 +1,302 @@
+import json
+import os
+import re
+import time
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer
+from asclepius_shared import bedrock_client, log, prompts
+from asclepius_shared.deadline import Deadline
+from asclepius_shared.experts import AGENT_FUNCTIONS, DATA_CATEGORIES, EXPERT_SUMMARY_FIELDS, needed_experts
+
+## Recomputes only what a clinician's edit to a visit's finalSummary affects
+##
+## Runs on the visit-data stream, for finalSummary rows only. The workflow's own write of the row records a
+## "provenance" row: the summary the pipeline worked from and which of its fields fed each stage. An edit saved
+## from the frontend (which stamps editedAt) is compared with it field by field, and only what depends on a
+## changed field is redone:
+## - care plan: only the sections the edit affects are rewritten
+## - routing: re-run only if a care-plan section changed
+## - experts: re-consulted only if one of their summary fields, the care plan or their routing reasons changed
+## Everything else is left as stored in asclepius-visit-data.
+
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+STAGE = os.environ.get('STAGE')
+MODEL_ID = 'us.amazon.nova-micro-v1:0'
+
+# Summary fields generate-care-plan's prompt reads
+CARE_PLAN_INPUTS = ['chief_complaint', 'history_present_illness', 'assessment']
+CARE_PLAN_SECTIONS = ['diagnosticTests', 'treatmentOptions', 'patientEducation', 'followUpRecommendations',
+                      'specialistReferrals']
+
+# finalSummary attributes that are not summary sections
+SUMMARY_METADATA = {'visitId', 'dataCategory', 'timestamp', 'verifiedCodes', 'editedAt'}
+
+_ICD10_ANNOTATION = re.compile(r"\s*\(ICD-10:[^)]*\)", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+_deserializer = TypeDeserializer()
+
+logger = log.get_logger('recompute')
+
+
+def lambda_handler(event, context):
+    table = boto3.resource('dynamodb').Table(VISIT_DATA_TABLE)
+    deadline = Deadline.from_context(context)
+
+    # Only the latest finalSummary image of each visit in the batch matters
+    latest = {}
+    for record in event.get('Records', []):
+        if record['eventName'] == 'REMOVE':
+            continue
+        image = deserialize(record['dynamodb'].get('NewImage'))
+        if image.get('dataCategory') == 'finalSummary':
+            latest[image['visitId']] = image
+
+    results = []
+    for visit_id, image in latest.items():
+        logger.bind(visitId=visit_id)
+        summary = summary_from_item(image)
+        if image.get('editedAt') is None:
+            record_provenance(table, visit_id, summary)
+            results.append({'visitId': visit_id, 'recorded': True})
+        else:
+            results.append(dict(recompute(table, visit_id, summary, deadline), visitId=visit_id))
+    return {'statusCode': 200, 'results': results}
+
+
+def deserialize(image):
+    return {key: _deserializer.deserialize(value) for key, value in (image or {}).items()}
+
+
+def parse(value):
+    """Read an attribute the workflow stored with States.JsonToString."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def summary_from_item(item):
+    return {key: parse(value) for key, value in item.items() if key not in SUMMARY_METADATA}
+
+
+def normalize(value):
+    """Comparison form of a field: its text without code annotations, case, punctuation or layout.
+
+    The frontend saves edited sections as plain text, so a list and the same
+    items joined into one string compare equal.
+    """
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(str(item) for item in value)
+    text = _ICD10_ANNOTATION.sub('', str(value or ''))
+    return ' '.join(_NON_WORD.sub(' ', text.lower()).split())
+
+
+def stage_inputs():
+    """Which summary fields feed each stage, as recorded with the provenance."""
+    return {
+        'carePlan': CARE_PLAN_INPUTS,
+        'experts': {expert: list(fields) for expert, fields in EXPERT_SUMMARY_FIELDS.items()}
+    }
+
+
+def record_provenance(table, visit_id, summary):
+    table.put_item(Item={
+        'visitId': visit_id,
+        'dataCategory': 'provenance',
+        'summary': json.dumps(summary),
+        'inputs': json.dumps(stage_inputs()),
+        'recordedAt': int(time.time() * 1000)
+    })
+    logger.info("Recorded the summary the pipeline worked from")
+
+
+def load_rows(table, visit_id):
+    rows = {}
+    kwargs = {
+        'KeyConditionExpression': 'visitId = :vid',
+        'ExpressionAttributeValues': {':vid': visit_id}
+    }
+    while True:
+        response = table.query(**kwargs)
+        for item in response.get('Items', []):
+            rows[item['dataCategory']] = item
+        if 'LastEvaluatedKey' not in response:
+            return rows
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def stored_routing(rows):
+    """The visit's routing; visits stored before routing was saved get it from their expert rows."""
+    if 'expertRouting' in rows:
+        return parse(rows['expertRouting']['requiredExperts'])
+    return {expert: {'needed': category in rows, 'reasons': []} for expert, category in DATA_CATEGORIES.items()}
+
+
+def recompute(table, visit_id, summary, deadline):
+    rows = load_rows(table, visit_id)
+    provenance = rows.get('provenance')
+    if not provenance:
+        logger.warning("No provenance recorded for this visit, taking the edited summary as the new baseline")
+        record_provenance(table, visit_id, summary)
+        return {'changedFields': [], 'recorded': True}
+
+    baseline = parse(provenance['summary'])
+    inputs = parse(provenance.get('inputs')) or stage_inputs()
+    changed = sorted(field for field in set(baseline) | set(summary)
+                     if normalize(baseline.get(field)) != normalize(summary.get(field)))
+    if not changed:
+        logger.info("Edit does not change any summary field")
+        return {'changedFields': []}
+    logger.info("Summary fields changed: %s", ', '.join(changed))
+
+    bedrock_runtime = bedrock_client.get_runtime_client('us-east-1')
+    lambda_client = boto3.client('lambda')
+    care_plan = {section: parse(rows['carePlan'].get(section)) or []
+                 for section in CARE_PLAN_SECTIONS} if 'carePlan' in rows else None
+
+    # Care plan: only when one of its inputs changed, and then only the sections the edit affects
+    changed_sections = []
+    edited_inputs = [field for field in changed if field in inputs['carePlan']]
+    if care_plan and edited_inputs:
+        edits = {field: (baseline.get(field), summary.get(field)) for field in edited_inputs}
+        revised = revise_care_plan(bedrock_runtime, care_plan, edits, visit_id, deadline)
+        changed_sections = [section for section, value in revised.items()
+                            if normalize(value) != normalize(care_plan.get(section))]
+        care_plan.update({section: revised[section] for section in changed_sections})
+
+    # Routing reads only the care plan
+    previous_routing = stored_routing(rows)
+    routing = previous_routing
+    if changed_sections:
+        routing = route(lambda_client, care_plan, visit_id)
+
+    # Experts: their own summary fields, the care plan, and why they were consulted
+    needed = needed_experts(routing)
+    reconsult = []
+    for expert in needed:
+        fields = inputs['experts'].get(expert, list(summary))
+        reasons_changed = (routing[expert].get('reasons') or []) != \
+            ((previous_routing.get(expert) or {}).get('reasons') or [])
+        if (DATA_CATEGORIES[expert] not in rows or changed_sections or reasons_changed
+                or any(field in changed for field in fields)):
+            reconsult.append(expert)
+    removed = [expert for expert, category in DATA_CATEGORIES.items() if category in rows and expert not in needed]
+    results = consult(lambda_client, reconsult, routing, summary, care_plan, visit_id)
+
+    with table.batch_writer() as batch:
+        if changed_sections:
+            # Same encoding as the workflow's StoreCarePlan state
+            item = {'visitId': visit_id, 'dataCategory': 'carePlan'}
+            item.update({section: json.dumps(care_plan[section]) for section in CARE_PLAN_SECTIONS})
+            batch.put_item(Item=item)
+        if routing is not previous_routing:
+            batch.put_item(Item={'visitId': visit_id, 'dataCategory': 'expertRouting',
+                                 'requiredExperts': json.dumps(routing)})
+        for expert, result in results.items():
+            if 'response' in result:
+                batch.put_item(Item={'visitId': visit_id, 'dataCategory': DATA_CATEGORIES[expert],
+                                     'expertResult': json.dumps(result['response'])})
+        for expert in removed:
+            batch.delete_item(Key={'visitId': visit_id, 'dataCategory': DATA_CATEGORIES[expert]})
+        batch.put_item(Item={
+            'visitId': visit_id,
+            'dataCategory': 'provenance',
+            'summary': json.dumps(summary),
+            'inputs': json.dumps(stage_inputs()),
+            'recordedAt': int(time.time() * 1000)
+        })
+
+    report = {
+        'changedFields': changed,
+        'carePlanSections': changed_sections,
+        'rerouted': routing is not previous_routing,
+        'reconsulted': reconsult,
+        'reused': [expert for expert in needed if expert not in reconsult],
+        'removed': removed
+    }
+    logger.info("Recomputed visit after edit", **report)
+    return report
+
+
+def revise_care_plan(bedrock_runtime, care_plan, edits, visit_id, deadline):
+    """Return {section: new items} for the care-plan sections the edit affects."""
+    edit_text = '\n\n'.join(
+        f"{field}:\n  before: {prompts.compact_json(before)}\n  after: {prompts.compact_json(after)}"
+        for field, (before, after) in edits.items()
+    )
+    prompt = f"""A clinician edited a visit's clinical summary after its care plan was written.
+
+Edited fields:
+{edit_text}
+
+Current care plan:
+{prompts.compact_json(care_plan)}
+
+Decide which care plan sections the edit affects. Return a JSON object containing only those sections, using the same keys as the care plan, each rewritten in full as a list of complete sentences. Return {{}} if no section needs to change."""
+
+    request_body = {
+        "schemaVersion": "messages-v1",
+        "messages": [{"role": "user", "content": [{"text": prompt}]}],
+        "system": [{"text": "You are a medical assistant that keeps care plans consistent with the clinical summary. Always respond in the requested JSON format."}],
+        "inferenceConfig": {
+            "maxTokens": 2000,
+            "temperature": 0.3,
+            "topP": 0.9
+        }
+    }
+    response_body = bedrock_client.invoke_model(bedrock_runtime, request_body, stage='generate-care-plan',
+                                                model_id=MODEL_ID, visit_id=visit_id, deadline=deadline)
+    text = bedrock_client.get_response_text(response_body)
+    match = re.search(r'\{[\s\S]*\}', text)
+    if not match:
+        logger.warning("No JSON object in the care plan revision, keeping the care plan")
+        return {}
+    revised = json.loads(match.group(0))
+    return {section: [str(item) for item in value] for section, value in revised.items()
+            if section in CARE_PLAN_SECTIONS and isinstance(value, list)}
+
+
+def function_name(base):
+    return f"{base}-{STAGE}" if STAGE else base
+
+
+def invoke(lambda_client, base, payload):
+    response = lambda_client.invoke(FunctionName=function_name(base), Payload=json.dumps(payload))
+    result = json.loads(response['Payload'].read())
+    if response.get('FunctionError'):
+        raise RuntimeError(f"{base} failed: {result}")
+    return result
+
+
+def route(lambda_client, care_plan, visit_id):
+    """Re-run the orchestrator on the revised care plan."""
+    result = invoke(lambda_client, 'asclepius-orchestrator', {
+        'carePlan': dict(care_plan, visitId=visit_id),
+        'visitId': visit_id
+    })
+    return result['requiredExperts']
+
+
+def consult(lambda_client, experts, routing, summary, care_plan, visit_id):
+    """Run each expert's agent on the edited visit, the same way the workflow's fan-out does."""
+    if not experts:
+        return {}
+    # Shaped like the workflow state prompts.agent_context reads
+    original = {
+        'summaryResult': {'Payload': {'summary': summary, 'visitId': visit_id}},
+        'carePlanResult': {'Payload': {'carePlan': dict(care_plan or {}, visitId=visit_id)}}
+    }
+
+    def run(expert):
+        try:
+            return invoke(lambda_client, AGENT_FUNCTIONS[expert], {'expert': routing[expert], 'originalData': original})
+        except Exception as e:
+            logger.exception("Could not re-consult %s", expert)
+            return {'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=len(experts)) as executor:
+        return dict(zip(experts, executor.map(run, experts)))
@@ -0,0 +1,91 @@
+import time
+import boto3
+from asclepius_shared import log, payload_store, search_index, visit_archive
+from asclepius_shared.deadline import Deadline
+
+## Keeps the full-text search index over visit transcripts and summaries current
+##
+## Runs in the visit DB workflow right after the DB writer: the stored visit's conversation and the processed
+## summary are tokenized into a new one-shard index segment in SEARCH_INDEX_BUCKET. {"visitIds": [...]} re-indexes
+## visits from their stored rows (through the visit archive), superseding their earlier copies. A scheduled
+## {"action": "merge"} merges small segments into larger sharded ones (see asclepius_shared.search_index).
+
+VISIT_TABLE = visit_archive.VISIT_TABLE
+VISIT_DATA_TABLE = visit_archive.VISIT_DATA_TABLE
+
+logger = log.get_logger('search-index')
+
+
+def lambda_handler(event, context):
+    logger.bind(visitId=event.get('visitId'))
+    if not search_index.SEARCH_INDEX_BUCKET:
+        logger.info("Search indexing is disabled: SEARCH_INDEX_BUCKET is not set")
+        return {'statusCode': 200, 'body': 'Search indexing is currently disabled'}
+
+    try:
+        if event.get('action') == 'merge' or event.get('source') == 'aws.events':
+            return merge(Deadline.from_context(context))
+
+        dynamodb = boto3.resource('dynamodb')
+        visit_table = dynamodb.Table(VISIT_TABLE)
+        data_table = dynamodb.Table(VISIT_DATA_TABLE)
+        if event.get('visitIds'):
+            indexed = [visit_id for visit_id in event['visitIds'] if index_visit(visit_table, data_table, visit_id)]
+            return {'statusCode': 200, 'indexed': len(indexed)}
+
+        visit_id = event.get('visitId')
+        if not visit_id:
+            raise ValueError("Missing visitId in event")
+        summary = payload_store.resolve(event.get('summary'))
+        if not index_visit(visit_table, data_table, visit_id, summary, patient_id=event.get('patientId')):
+            return {'statusCode': 404, 'body': f'No visit record for visitId: {visit_id}', 'visitId': visit_id}
+        return {'statusCode': 200, 'body': 'Indexed visit for search', 'visitId': visit_id}
+
+    except ValueError as ve:
+        logger.warning("Validation error: %s", ve)
+        return {'statusCode': 400, 'body': f'Validation error: {str(ve)}'}
+    except Exception as e:
+        # Search lags behind rather than failing the visit's workflow; re-index with {"visitIds": [...]}
+        logger.exception("Error indexing visit for search")
+        return {'statusCode': 500, 'body': f'Error indexing visit: {str(e)}'}
+
+
+def index_visit(visit_table, data_table, visit_id, summary=None, patient_id=None):
+    """Write a segment with the visit's current text; returns False if the visit has no Visit item."""
+    visit, rows = visit_archive.load_visit(visit_id, visit_table, data_table, consistent=True)
+    if not visit:
+        logger.warning("No visit record to index", visitId=visit_id)
+        return False
+    if not summary:
+        summary = next((row for row in rows if row.get('dataCategory') == 'finalSummary'), None)
+    texts = search_index.visit_texts(visit, summary)
+    terms = search_index.document_terms(texts)
+    doc = {
+        'visitId': visit_id,
+        'date': str(visit.get('date') or '')[:10] or None,
+        'patientId': visit.get('patientID') or patient_id,
+        'indexedAt': int(time.time() * 1000)
+    }
+    meta = search_index.index_document(doc, terms)
+    logger.info("Indexed visit for search", visitId=visit_id, texts=len(texts), terms=len(terms),
+                segmentId=meta['segmentId'], bytes=meta['bytes'])
+    return True
+
+
+def merge(deadline):
+    """Merge each size tier holding at least MERGE_FACTOR segments into one segment, repeating up the tiers."""
+    merged = removed = 0
+    while not deadline.expired():
+        groups = search_index.merge_candidates(search_index.current_segments(refresh=True))
+        if not groups:
+            break
+        group = groups[0]
+        meta = search_index.merge_segments(group)
+        # The merged segment is visible before its inputs go, so no visit is ever missing from a search
+        for old in group:
+            search_index.delete_segment(old)
+        merged += 1
+        removed += len(group)
+        logger.info("Merged search index segments", segments=len(group), docs=len(meta['docs']),
+                    terms=meta['terms'], bytes=meta['bytes'], segmentId=meta['segmentId'])
+    return {'statusCode': 200, 'merges': merged, 'segmentsRemoved': removed}
@@ -1,5 +1,21 @@
 import json
+import os
 import boto3
+from asclepius_shared import log, payload_store
+from asclepius_shared.budget import VisitBudget
+
+# HealthScribe section name -> key in the clinical summary passed downstream
+SUMMARY_SECTIONS = {
+    'CHIEF_COMPLAINT': 'chief_complaint',
+    'HISTORY_OF_PRESENT_ILLNESS': 'history_present_illness',
+    'REVIEW_OF_SYSTEMS': 'review_systems',
+    'ASSESSMENT': 'assessment',
+    'PLAN': 'plan',
+    'PAST_MEDICAL_HISTORY': 'past_medical_history',
+    'PHYSICAL_EXAMINATION': 'physical_examination',
+}
+
+logger = log.get_logger('summary-processor')
 
 def lambda_handler(event, context):
     s3 = boto3.client('s3')
@@ -16,39 +32,73 @@ def lambda_handler(event, context):
     key = detail['key']
     # Get visitId from detail instead of parsing it from key
     visitId = detail['visitId']
+    logger.bind(visitId=visitId)
+    budget = VisitBudget.from_event(detail)
     
     try:
-        # Get the summary file
+        # Stream the summary file straight into the parser
         response = s3.get_object(Bucket=bucket, Key=key)
-        summary_data = json.loads(response['Body'].read().decode('utf-8'))
-        
-        # Extract relevant sections from summary
-        sections = summary_data['ClinicalDocumentation']['Sections']
+        section_index = parse_clinical_doc(response['Body'])
         
         # Create a simplified structure with just the sections we need
-        clinical_summary = {
-            'chief_complaint': get_section_content('CHIEF_COMPLAINT', sections),
-            'history_present_illness': get_section_content('HISTORY_OF_PRESENT_ILLNESS', sections),
-            'review_systems': get_section_content('REVIEW_OF_SYSTEMS', sections),
-            'assessment': get_section_content('ASSESSMENT', sections),
-            'plan': get_section_content('PLAN', sections)
-        }
+        clinical_summary = build_clinical_summary(section_index, get_requested_sections(detail))
 
+        budget.report('summary-processor', visitId)
+        # Every later state carries this result, so a large summary travels as a reference
         return {
-            "summary": clinical_summary,
+            "summary": payload_store.offload(clinical_summary),
             "bucket": bucket,
             "visitId": visitId,
-            "originalKey": key
+            "originalKey": key,
+            "patientId": detail.get('patientId'),
+            "visitDate": detail.get('visitDate'),
+            "visitBudget": budget.to_dict()
         }
  
     except Exception as e:
-        print(f"Received event:", json.dumps(event, indent=2))  # Add this for debugging
-        print(f"Error: {str(e)}")
+        logger.exception("Error processing clinical summary", bucket=bucket, key=key, event=event)
         raise e
 
-def get_section_content(section_name, sections):
-    """Extract content from a specific section"""
-    for section in sections:
-        if section['SectionName'] == section_name:
-            return [item['SummarizedSegment'] for item in section.get('Summary', [])]
-    return []
+def get_requested_sections(detail):
+    """Resolve the section -> summary key mapping for this invocation.
+
+    Extra sections can be requested per event (``sections``, a list or a
+    comma separated string) or per deployment (SUMMARY_EXTRA_SECTIONS, comma
+    separated); they are keyed by their lower-cased HealthScribe name.
+    """
+    sections = dict(SUMMARY_SECTIONS)
+    extra = detail.get('sections') or os.environ.get('SUMMARY_EXTRA_SECTIONS', '')
+    if isinstance(extra, str):
+        extra = extra.split(',')
+    for name in extra:
+        name = name.strip().upper()
+        if name and name not in sections:
+            sections[name] = name.lower()
+    return sections
+
+def parse_clinical_doc(stream):
+    """Parse clinicalDoc.json and index its sections by name in a single pass.
+
+    Returns {SectionName: section}. Looking sections up afterwards is a dict
+    hit, so the cost stays one traversal of the document however many
+    sections are requested. The first occurrence of a repeated name wins,
+    matching the old linear scan.
+    """
+    document = json.load(stream)
+    index = {}
+    for section in document['ClinicalDocumentation']['Sections']:
+        index.setdefault(section['SectionName'], section)
+    return index
+
+def build_clinical_summary(section_index, sections=SUMMARY_SECTIONS):
+    """Map indexed sections onto summary keys; missing sections become empty lists."""
+    return {
+        summary_key: get_section_content(section_index.get(section_name))
+        for section_name, summary_key in sections.items()
+    }
+
+def get_section_content(section):
+    """Extract content from an indexed section"""
+    if section is None:
+        return []
+    return [item['SummarizedSegment'] for item in section.get('Summary', [])]
@@ -1,5 +1,8 @@
 import json
 import boto3
+from asclepius_shared import log
+
+logger = log.get_logger('transcribe-handler')
 
 def lambda_handler(event, context):
     s3 = boto3.client('s3')
@@ -18,6 +21,7 @@ def lambda_handler(event, context):
             
             # Extract conversation data
             conversation = transcript_data['Conversation']
+            logger.bind(visitId=conversation.get('SessionId'))
             
             # Format dialogue for DynamoDB
             dialogue = []
@@ -40,7 +44,7 @@ def lambda_handler(event, context):
             # Store in DynamoDB
             table.put_item(Item=item)
             
-            print(f"Successfully stored conversation for session: {conversation['SessionId']}")
+            logger.info("Stored conversation", segments=len(dialogue))
             
             return {
                 'statusCode': 200,
@@ -51,7 +55,7 @@ def lambda_handler(event, context):
             }
             
         except Exception as e:
-            print(f"Error: {str(e)}")
+            logger.exception("Error storing conversation", bucket=bucket, key=key)
             raise e
     
     return {
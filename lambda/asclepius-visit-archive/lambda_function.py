@@ -0,0 +1,122 @@
+import os
+from datetime import date, timedelta
+import boto3
+from botocore.exceptions import ClientError
+from asclepius_shared import log, visit_archive
+from asclepius_shared.deadline import Deadline
+
+## Moves visits older than VISIT_ARCHIVE_AFTER_DAYS out of DynamoDB into one compressed S3 object each
+##
+## Runs daily from an EventBridge schedule, or for one visit with {"visitId": ...}. Each visit's Visit item and
+## visit-data rows are written to VISIT_ARCHIVE_BUCKET first; only then is the Visit item cut down to a stub and
+## the rows replaced by a single "archived" row. Its materialized view is dropped, and rebuilt from the archive
+## when the visit is opened again. Readers go through visit_archive, which reads archived visits from S3.
+
+VISIT_VIEW_TABLE = os.environ.get('VISIT_VIEW_TABLE', 'asclepius-visit-view')
+
+# Visits archived per run at most; the rest are picked up by the next run
+MAX_VISITS_PER_RUN = int(os.environ.get('VISIT_ARCHIVE_MAX_VISITS', '500'))
+
+logger = log.get_logger('visit-archive')
+
+
+def lambda_handler(event, context):
+    if not visit_archive.ARCHIVE_BUCKET:
+        logger.info("Visit archiving is disabled: VISIT_ARCHIVE_BUCKET is not set")
+        return {'statusCode': 200, 'archived': 0}
+
+    dynamodb = boto3.resource('dynamodb')
+    tables = (dynamodb.Table(visit_archive.VISIT_TABLE), dynamodb.Table(visit_archive.VISIT_DATA_TABLE),
+              dynamodb.Table(VISIT_VIEW_TABLE))
+    s3 = boto3.client('s3')
+
+    if event.get('visitId'):
+        logger.bind(visitId=event['visitId'])
+        archived = archive_visit(event['visitId'], *tables, s3)
+        return {'statusCode': 200, 'visitId': event['visitId'], 'archived': 1 if archived else 0}
+
+    logger.bind()
+    after_days = int(event.get('afterDays', visit_archive.ARCHIVE_AFTER_DAYS))
+    cutoff = (date.today() - timedelta(days=after_days)).isoformat()
+    deadline = Deadline.from_context(context)
+    archived = failed = 0
+    for visit_id in candidate_visits(tables[0], cutoff):
+        if archived >= MAX_VISITS_PER_RUN or deadline.expired():
+            break
+        try:
+            if archive_visit(visit_id, *tables, s3):
+                archived += 1
+        except Exception:
+            logger.exception("Could not archive visit", visitId=visit_id)
+            failed += 1
+    logger.info("Archived %d visits dated before %s", archived, cutoff, failed=failed)
+    return {'statusCode': 200, 'cutoff': cutoff, 'archived': archived, 'failed': failed}
+
+
+def candidate_visits(visit_table, cutoff):
+    """IDs of visits dated before cutoff (YYYY-MM-DD) that are not archived yet."""
+    kwargs = {
+        'ProjectionExpression': 'visitID',
+        'FilterExpression': '#date < :cutoff AND attribute_not_exists(archivedAt)',
+        'ExpressionAttributeNames': {'#date': 'date'},
+        'ExpressionAttributeValues': {':cutoff': cutoff}
+    }
+    while True:
+        response = visit_table.scan(**kwargs)
+        for item in response.get('Items', []):
+            yield item['visitID']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def archive_visit(visit_id, visit_table, data_table, view_table, s3):
+    """Archive one visit; returns False if there is nothing to archive.
+
+    Safe to repeat: a visit whose rows were already replaced by the archived
+    row (an interrupted run) only has its Visit item marked and its
+    remaining rows removed.
+    """
+    visit = visit_table.get_item(Key={'visitID': visit_id}, ConsistentRead=True).get('Item')
+    if visit is None or visit_archive.is_archived(visit):
+        return False
+    rows = visit_archive.query_rows(data_table, visit_id, consistent=True)
+    stub = next((row for row in rows if row['dataCategory'] == visit_archive.ARCHIVED_CATEGORY), None)
+
+    if stub is None:
+        key = visit_archive.archive_key(visit_id)
+        archived_at = visit_archive.now()
+        body = visit_archive.encode(visit_id, visit, rows, archived_at)
+        s3.put_object(Bucket=visit_archive.ARCHIVE_BUCKET, Key=key, Body=body, ContentType='application/gzip')
+        data_table.put_item(Item={
+            'visitId': visit_id,
+            'dataCategory': visit_archive.ARCHIVED_CATEGORY,
+            'archiveKey': key,
+            'archivedAt': archived_at,
+            'categories': sorted(row['dataCategory'] for row in rows),
+            'archiveBytes': len(body)
+        })
+    else:
+        key, archived_at = stub['archiveKey'], stub['archivedAt']
+
+    try:
+        visit_table.update_item(
+            Key={'visitID': visit_id},
+            UpdateExpression='SET archivedAt = :at, archiveKey = :key REMOVE '
+                             + ', '.join(sorted(visit_archive.ARCHIVED_VISIT_ATTRIBUTES)),
+            ConditionExpression='attribute_exists(visitID) AND attribute_not_exists(archivedAt)',
+            ExpressionAttributeValues={':at': archived_at, ':key': key}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("Visit was archived concurrently", visitId=visit_id)
+        return False
+
+    with data_table.batch_writer() as batch:
+        for row in rows:
+            if row['dataCategory'] != visit_archive.ARCHIVED_CATEGORY:
+                batch.delete_item(Key={'visitId': visit_id, 'dataCategory': row['dataCategory']})
+    view_table.delete_item(Key={'visitID': visit_id})
+    logger.info("Archived visit", visitId=visit_id, rows=len(rows), archiveKey=key)
+    return True
@@ -0,0 +1,52 @@
+import json
+import re
+from asclepius_shared import log, search_index
+
+## Full-text search over visit transcripts and summaries
+##
+## Invoked directly with {"query": ..., "dateFrom": "YYYY-MM-DD", "dateTo": ..., "limit": 50}, or through its
+## IAM-authenticated function URL as GET ?q=...&from=...&to=...&limit=... Queries combine terms with AND by
+## default and support OR, NOT (or a leading -), "quoted phrases", parentheses and a date range; see
+## asclepius_shared.search_index. Results are visits, newest first.
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+logger = log.get_logger('visit-search')
+
+
+def lambda_handler(event, context):
+    logger.bind()
+    http = 'requestContext' in event and 'http' in event['requestContext']
+    params = (event.get('queryStringParameters') or {}) if http else event
+    try:
+        if not search_index.SEARCH_INDEX_BUCKET:
+            raise ValueError("Search is disabled: SEARCH_INDEX_BUCKET is not set")
+        query = params.get('q') if http else params.get('query')
+        if not query or not str(query).strip():
+            raise ValueError("Missing query")
+        date_from = check_date(params.get('from') if http else params.get('dateFrom'))
+        date_to = check_date(params.get('to') if http else params.get('dateTo'))
+        limit = min(max(int(params.get('limit') or DEFAULT_LIMIT), 1), MAX_LIMIT)
+        result = dict(search_index.search(str(query), date_from, date_to, limit), statusCode=200)
+    except ValueError as ve:
+        # QueryError is a ValueError too
+        logger.warning("Invalid search: %s", ve)
+        result = {'statusCode': 400, 'error': str(ve)}
+
+    if not http:
+        return result
+    status = result.pop('statusCode')
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(result)
+    }
+
+
+def check_date(value):
+    if value and not _DATE.match(str(value)):
+        raise ValueError(f"Dates must be YYYY-MM-DD, got {value!r}")
+    return value or None
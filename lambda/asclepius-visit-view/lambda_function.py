@@ -0,0 +1,223 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+import boto3
+from collections import defaultdict
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from asclepius_shared import log, visit_archive
+
+## Maintains one compressed "visit view" per visit: the Visit item and every visit-data row, parsed,
+## in a single document the frontend reads with one GetItem
+##
+## {"action": "build", "visitId": ...} (the workflow's last state) assembles the view from scratch.
+## DynamoDB stream batches from the Visit and visit-data tables then patch only the rows that changed.
+##
+## Archived visits (see asclepius-visit-archive) have no view. Setting rehydrateRequestedAt on an archived Visit
+## item, as the frontend does when it opens one, rebuilds the view from the archive for VIEW_REHYDRATED_TTL_DAYS.
+## A rehydrated view keeps the conversation, which is then in neither table.
+
+VISIT_TABLE = os.environ.get('VISIT_TABLE', 'asclepiusMVP-Visit')
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+VISIT_VIEW_TABLE = os.environ.get('VISIT_VIEW_TABLE', 'asclepius-visit-view')
+
+# Visit attributes the detail page does not use; the conversation is most of the item's size.
+# Views of archived visits keep them, as the archive is the only other copy.
+EXCLUDED_VISIT_ATTRIBUTES = {'conversation'}
+
+# How long a view rebuilt from the archive stays before the table's TTL removes it again
+VIEW_REHYDRATED_TTL_DAYS = float(os.environ.get('VISIT_VIEW_REHYDRATED_TTL_DAYS', '7'))
+
+# Attempts at a read-modify-write before giving up to a stream retry
+MAX_WRITE_ATTEMPTS = 5
+
+_deserializer = TypeDeserializer()
+
+logger = log.get_logger('visit-view')
+
+
+def lambda_handler(event, context):
+    dynamodb = boto3.resource('dynamodb')
+    view_table = dynamodb.Table(VISIT_VIEW_TABLE)
+
+    if 'Records' in event:
+        logger.bind()
+        return apply_stream_records(view_table, event['Records'], dynamodb.Table(VISIT_TABLE),
+                                    dynamodb.Table(VISIT_DATA_TABLE))
+
+    visit_id = event.get('visitId') or event.get('visitID')
+    if not visit_id:
+        raise ValueError("Missing visitId in event")
+    logger.bind(visitId=visit_id)
+    view = build_view(dynamodb.Table(VISIT_TABLE), dynamodb.Table(VISIT_DATA_TABLE), visit_id)
+    etag, version = write_view(view_table, visit_id, lambda current: view, expires_at=view_expiry(view))
+    logger.info("Built visit view", version=version, etag=etag, archived=visit_archive.is_archived(view['visit']))
+    return {
+        'statusCode': 200,
+        'visitId': visit_id,
+        'etag': etag,
+        'version': version
+    }
+
+
+def build_view(visit_table, data_table, visit_id):
+    """Assemble the full view from the Visit item and all of the visit's visit-data rows, or from its archive."""
+    visit, items = visit_archive.load_visit(visit_id, visit_table, data_table)
+    return {
+        'visitId': visit_id,
+        'visit': visit_section(visit),
+        'data': {item['dataCategory']: data_section(item) for item in items}
+    }
+
+
+def view_expiry(view):
+    """TTL of a view rebuilt from the archive; views of visits in the tables do not expire."""
+    if not visit_archive.is_archived(view.get('visit')):
+        return None
+    return int(time.time() + VIEW_REHYDRATED_TTL_DAYS * 24 * 3600)
+
+
+def visit_section(visit):
+    if not visit:
+        return None
+    excluded = set() if visit_archive.is_archived(visit) else EXCLUDED_VISIT_ATTRIBUTES
+    return {key: plain(value) for key, value in visit.items() if key not in excluded}
+
+
+def data_section(item):
+    """A visit-data row with its JSON-string attributes (States.JsonToString) parsed."""
+    section = {}
+    for key, value in item.items():
+        if key in ('visitId', 'dataCategory'):
+            continue
+        if isinstance(value, str) and value[:1] in ('[', '{', '"'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        section[key] = plain(value)
+    return section
+
+
+def plain(value):
+    """Convert DynamoDB values (Decimal, sets) to JSON-serializable ones."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {key: plain(inner) for key, inner in value.items()}
+    if isinstance(value, (list, set)):
+        return [plain(inner) for inner in value]
+    return value
+
+
+def apply_stream_records(view_table, records, visit_table=None, data_table=None):
+    """Patch each affected visit's view once per batch with the latest image of each changed row.
+
+    Archived visits whose Visit item asks for rehydration get their view
+    rebuilt from the archive instead.
+    """
+    changes = defaultdict(dict)
+    rehydrate = set()
+    for record in records:
+        table = record['eventSourceARN'].split(':table/')[1].split('/')[0]
+        keys = deserialize(record['dynamodb']['Keys'])
+        image = deserialize(record['dynamodb'].get('NewImage')) if record['eventName'] != 'REMOVE' else None
+        if table == VISIT_TABLE:
+            if visit_archive.is_archived(image):
+                # Archiving drops the view; only a rehydration request brings it back
+                if image.get('rehydrateRequestedAt'):
+                    rehydrate.add(keys['visitID'])
+                continue
+            changes[keys['visitID']][('visit',)] = visit_section(image)
+        elif table == VISIT_DATA_TABLE:
+            # Later records for the same row overwrite earlier ones, so only the final state is applied
+            changes[keys['visitId']][('data', keys['dataCategory'])] = data_section(image) if image else None
+
+    patched = 0
+    for visit_id, visit_changes in changes.items():
+        def patch(current):
+            if current is None:
+                # Not built yet: the workflow's build step will read these rows
+                return None
+            if visit_archive.is_archived(current.get('visit')):
+                # Rebuilt from the archive; row changes are the archive job's own
+                return None
+            for path, section in visit_changes.items():
+                if path == ('visit',):
+                    current['visit'] = section
+                elif section is None:
+                    current['data'].pop(path[1], None)
+                else:
+                    current['data'][path[1]] = section
+            return current
+
+        if write_view(view_table, visit_id, patch)[0]:
+            patched += 1
+
+    for visit_id in rehydrate:
+        view = build_view(visit_table, data_table, visit_id)
+        write_view(view_table, visit_id, lambda current: view, expires_at=view_expiry(view))
+    logger.info("Applied %d stream records to %d of %d visit views", len(records), patched, len(changes),
+                rehydrated=len(rehydrate))
+    return {'statusCode': 200, 'visits': len(changes), 'patched': patched, 'rehydrated': len(rehydrate)}
+
+
+def deserialize(image):
+    return {key: _deserializer.deserialize(value) for key, value in (image or {}).items()}
+
+
+def encode_view(view):
+    """Return (gzip bytes, etag) for a view; the etag is a hash of the uncompressed document."""
+    raw = json.dumps(view, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return gzip.compress(raw, compresslevel=6, mtime=0), hashlib.sha256(raw).hexdigest()[:32]
+
+
+def decode_view(item):
+    # boto3 returns binary attributes as Binary, which converts with bytes()
+    return json.loads(gzip.decompress(bytes(item['view'])))
+
+
+def write_view(view_table, visit_id, update, expires_at=None):
+    """Read-modify-write the visit's view with optimistic locking on its version.
+
+    update gets the current view (or None) and returns the new one, or None
+    to leave it unchanged. expires_at (epoch seconds) sets the item's TTL.
+    Returns (etag, version), or (None, None) if nothing was written.
+    """
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        item = view_table.get_item(Key={'visitID': visit_id}, ConsistentRead=True).get('Item')
+        current = decode_view(item) if item else None
+        view = update(current)
+        if view is None:
+            return None, None
+        body, etag = encode_view(view)
+        # An unchanged view is not rewritten, unless its TTL is being extended
+        if item and item.get('etag') == etag and expires_at is None:
+            return etag, int(item['version'])
+
+        version = int(item['version']) + 1 if item else 1
+        new_item = {
+            'visitID': visit_id,
+            'view': body,
+            'etag': etag,
+            'version': version,
+            'updatedAt': int(time.time() * 1000)
+        }
+        if expires_at is not None:
+            new_item['expiresAt'] = expires_at
+        try:
+            # A view deleted since it was read (the visit was archived) is not recreated from the stale copy
+            if item:
+                view_table.put_item(Item=new_item, ConditionExpression='version = :expected',
+                                    ExpressionAttributeValues={':expected': version - 1})
+            else:
+                view_table.put_item(Item=new_item, ConditionExpression='attribute_not_exists(visitID)')
+            return etag, version
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info("Visit view changed concurrently, retrying", visitId=visit_id)
+    raise RuntimeError(f"Could not update visit view for {visit_id} after {MAX_WRITE_ATTEMPTS} attempts")
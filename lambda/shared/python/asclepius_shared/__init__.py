@@ -0,0 +1,5 @@
+"""Shared Python helpers for the Asclepius pipeline functions.
+
+Packaged as a Lambda layer (see AsclepiusStack), so modules here are
+importable from every handler as ``asclepius_shared.<module>``.
+"""
@@ -0,0 +1,139 @@
+"""Compact structured output for the expert agents, rendered locally into prose.
+
+In the default prose format each agent writes up to 2000 tokens of
+paragraphs following its persona's template, and generation time is
+mostly output tokens. In the structured format the agent gets only its
+persona's role and returns a small JSON object of short phrases:
+
+    {"focus": "...", "goals": [...], "actions": [...], "monitoring": [...], "referrals": [...]}
+
+render() expands it deterministically into the paragraphs the UI shows,
+so the stored expertResult is text in both formats.
+
+AGENT_STRUCTURED_RATE is the fraction of visits whose agents use the
+structured format (0 = prose only, 1 = all); an event's "outputMode"
+overrides it. The choice hashes the visit ID, so every expert of a visit
+uses the same format. Structured calls are tracked under their own stage,
+"agent-structured", so their output tokens and latency per expert can be
+compared with prose calls ("agent") in the Bedrock metrics.
+"""
+import hashlib
+import json
+import os
+import re
+
+from asclepius_shared import log
+from asclepius_shared.personas import PERSONAS
+
+STRUCTURED_RATE = float(os.environ.get('AGENT_STRUCTURED_RATE', '0'))
+
+PROSE_MAX_TOKENS = 2000
+STRUCTURED_MAX_TOKENS = 600
+
+MAX_ITEMS = 5
+
+# (key, paragraph heading) in rendering order
+SECTIONS = [
+    ('goals', 'Goals'),
+    ('actions', 'Recommended actions'),
+    ('monitoring', 'Monitoring'),
+    ('referrals', 'Referrals'),
+]
+
+STRUCTURED_INSTRUCTIONS = f"""Based on the patient data provided, give your recommendations as a JSON object only, in this format:
+{{
+  "focus": "the main focus of care from your specialty, in one short phrase",
+  "goals": ["treatment goals"],
+  "actions": ["specific recommendations: medications, lifestyle changes, education"],
+  "monitoring": ["what to monitor and how often"],
+  "referrals": ["referrals or follow-up, with the reason"]
+}}
+Write every entry as a short phrase of at most 15 words, with doses and frequencies where relevant. Give at most {MAX_ITEMS} entries per list, and leave a list empty if nothing applies."""
+
+logger = log.get_logger('agent-output')
+
+
+def is_structured(event, visit_id=None):
+    """Whether this invocation uses the structured format."""
+    mode = (event or {}).get('outputMode')
+    if mode in ('structured', 'prose'):
+        return mode == 'structured'
+    if STRUCTURED_RATE >= 1:
+        return True
+    if STRUCTURED_RATE <= 0 or not visit_id:
+        return False
+    bucket = int(hashlib.md5(str(visit_id).encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < STRUCTURED_RATE
+
+
+def stage(structured):
+    return 'agent-structured' if structured else 'agent'
+
+
+def max_tokens(structured):
+    return STRUCTURED_MAX_TOKENS if structured else PROSE_MAX_TOKENS
+
+
+def instructions(expert, structured):
+    """The persona part of an agent's prompt: the full persona, or its role and the JSON format."""
+    if not structured:
+        return PERSONAS[expert]
+    role = PERSONAS[expert].split('\n\n', 1)[0]
+    return f"{role}\n\n{STRUCTURED_INSTRUCTIONS}"
+
+
+def parse(text):
+    """The structured recommendation in a response, normalised, or None if there is none."""
+    match = re.search(r'\{[\s\S]*\}', text or '')
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    structured = {'focus': ' '.join(str(data.get('focus') or '').split())}
+    for key, _ in SECTIONS:
+        items = data.get(key) or []
+        if not isinstance(items, list):
+            items = [items]
+        structured[key] = [' '.join(str(item).split()) for item in items if str(item).strip()][:MAX_ITEMS]
+    if not structured['focus'] and not any(structured[key] for key, _ in SECTIONS):
+        return None
+    return structured
+
+
+def _sentence(phrase):
+    phrase = phrase.strip().rstrip(';,')
+    if not phrase:
+        return ''
+    # Words like eGFR or pH keep their case
+    if phrase.split()[0].islower():
+        phrase = phrase[0].upper() + phrase[1:]
+    return phrase if phrase[-1] in '.!?' else phrase + '.'
+
+
+def render(structured):
+    """Expand a structured recommendation into paragraphs: one per non-empty section."""
+    paragraphs = []
+    if structured.get('focus'):
+        paragraphs.append(f"The primary focus should be on {structured['focus'].rstrip('.')}.")
+    for key, heading in SECTIONS:
+        sentences = [_sentence(item) for item in structured.get(key) or []]
+        sentences = [sentence for sentence in sentences if sentence]
+        if sentences:
+            paragraphs.append(f"{heading}: {' '.join(sentences)}")
+    return '\n\n'.join(paragraphs)
+
+
+def result(content, structured):
+    """The agent's return value for a model response in the given format."""
+    if not structured:
+        return {"response": content}
+    recommendation = parse(content)
+    if recommendation is None:
+        # Keep whatever the model wrote rather than losing the expert's input
+        logger.warning("No structured recommendation in the response, storing it as written")
+        return {"response": content, "outputMode": "structured"}
+    return {"response": render(recommendation), "structured": recommendation, "outputMode": "structured"}
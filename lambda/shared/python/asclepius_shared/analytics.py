@@ -0,0 +1,122 @@
+"""Flat analytics records of a visit, for the columnar export.
+
+asclepius-analytics-export writes two Parquet datasets from these:
+
+- visits, partitioned by date: one record per visit, with its ICD-10
+  codes, routed experts and one boolean column per expert result;
+- visit-data, partitioned by date and dataCategory: one record per
+  visit-data row, with its size but not its content.
+
+A visit's records are always projected from its whole current state (read
+through the visit archive), never from the single change that triggered
+the export. So an update that arrives late, such as the ICD-10 insertion
+after the DB writer, only replaces an older record, whatever the order
+of the changes. Records carry exportedAt (epoch ms); of several records
+with the same key, the one with the latest exportedAt is current, and a
+current record with deleted set means the row no longer exists.
+"""
+import json
+from decimal import Decimal
+
+from asclepius_shared.experts import DATA_CATEGORIES, needed_experts
+from asclepius_shared.fhir import diagnoses
+from asclepius_shared.patient_history import CARE_PLAN_SECTIONS
+
+# Expert result columns of the visits dataset, one per dataCategory
+EXPERT_COLUMNS = list(DATA_CATEGORIES.values())
+
+# Attributes that are the row's key rather than its content
+KEY_ATTRIBUTES = {'visitId', 'dataCategory'}
+
+
+def _parse(value):
+    """Read an attribute the workflow stored with States.JsonToString."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value, key=str)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _count_items(value):
+    """Entries in the list attributes of a row, nested lists included."""
+    if isinstance(value, list):
+        return sum(_count_items(entry) if isinstance(entry, (list, dict)) else 1 for entry in value)
+    if isinstance(value, dict):
+        return sum(_count_items(entry) for entry in value.values())
+    return 0
+
+
+def visit_date(visit):
+    """The partition date (YYYY-MM-DD) of a visit, or None if it has none yet."""
+    value = str((visit or {}).get('date') or '')[:10]
+    return value if len(value) == 10 else None
+
+
+def visit_record(visit, rows, exported_at):
+    """The visits-dataset record of a visit, from its Visit item and visit-data rows."""
+    by_category = {row.get('dataCategory'): row for row in rows}
+    visit_diagnoses = diagnoses(visit, by_category.get('finalSummary'))
+    codes = []
+    for _, code in visit_diagnoses:
+        if code and code not in codes:
+            codes.append(code)
+
+    care_plan = by_category.get('carePlan') or {}
+    sections = [_parse(care_plan.get(section)) or [] for section in CARE_PLAN_SECTIONS]
+    sections = [section if isinstance(section, list) else [section] for section in sections]
+    routing = _parse((by_category.get('expertRouting') or {}).get('requiredExperts'))
+
+    record = {
+        'visitId': visit['visitID'],
+        'patientId': visit.get('patientID') or visit.get('patientId'),
+        'primaryIcd10': codes[0] if codes else None,
+        'icd10Codes': codes,
+        'diagnosisCount': len(visit_diagnoses),
+        'carePlanItems': sum(len(section) for section in sections),
+        'carePlanChars': sum(len(str(entry)) for section in sections for entry in section),
+        'routedExperts': needed_experts(routing) if isinstance(routing, dict) else [],
+        'expertCount': sum(1 for category in EXPERT_COLUMNS if category in by_category),
+        'archived': bool(visit.get('archivedAt')),
+        'exportedAt': exported_at,
+        'deleted': False,
+    }
+    for category in EXPERT_COLUMNS:
+        record[category] = category in by_category
+    return record
+
+
+def data_record(visit, row, exported_at):
+    """The visit-data-dataset record of one visit-data row."""
+    content = {key: _parse(value) for key, value in row.items() if key not in KEY_ATTRIBUTES}
+    return {
+        'visitId': visit['visitID'],
+        'patientId': visit.get('patientID') or visit.get('patientId'),
+        'attributes': sorted(content),
+        'chars': len(json.dumps(content, separators=(',', ':'), ensure_ascii=False, default=_plain)),
+        'items': _count_items(content),
+        'exportedAt': exported_at,
+        'deleted': False,
+    }
+
+
+def deleted_data_record(visit, exported_at):
+    """The record marking a visit-data row of the visit as removed."""
+    return {
+        'visitId': visit['visitID'],
+        'patientId': visit.get('patientID') or visit.get('patientId'),
+        'attributes': [],
+        'chars': 0,
+        'items': 0,
+        'exportedAt': exported_at,
+        'deleted': True,
+    }
@@ -0,0 +1,453 @@
+"""Resilient, instrumented Bedrock invocation shared by every model caller in the pipeline.
+
+Each call emits one EMF record (namespace Asclepius/Bedrock) with wall time,
+time to first token for streaming calls, token usage, retries, hedges,
+throttles and an estimated cost, dimensioned by stage, expert and model so
+the slowest and most expensive experts stand out in CloudWatch.
+
+Calls first take a token from the shared adaptive rate limiter for their
+model, and report back whether Bedrock throttled them so the limiter can
+adjust its rate. The limiter fails open: if its table cannot be reached the
+call goes ahead unlimited. Latency of expert-agent calls is also recorded in
+latency_stats, where other functions can read it.
+
+Throttling and transient errors are retried with full-jitter exponential
+backoff. A call still running past the recent p95 latency for its stage
+gets one hedged duplicate request and the first result wins; only the
+winner's token usage is counted. When a
+Deadline is supplied (normally from the Lambda context), retries stop once
+the backoff would overrun it and maxTokens is lowered to what can be
+generated in the time left.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+from asclepius_shared import latency_stats, log, metrics, rate_limiter
+from asclepius_shared.deadline import DeadlineExceeded
+
+DEFAULT_MODEL_ID = 'us.amazon.nova-micro-v1:0'
+METRICS_NAMESPACE = 'Asclepius/Bedrock'
+
+logger = log.get_logger('bedrock')
+
+# USD per 1,000 tokens (input, output), on-demand pricing in us-east-1
+MODEL_PRICING = {
+    'amazon.nova-micro-v1:0': (0.000035, 0.00014),
+    'amazon.nova-lite-v1:0': (0.00006, 0.00024),
+    'amazon.nova-pro-v1:0': (0.0008, 0.0032),
+}
+
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+}
+
+TRANSIENT_ERROR_CODES = {
+    'ModelTimeoutException',
+    'ModelNotReadyException',
+    'ServiceUnavailableException',
+    'InternalServerException',
+}
+
+TRANSIENT_EXCEPTIONS = (ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError)
+
+MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', '4'))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+# Hedge after the p95 of this many recent latencies; before that, after a fixed delay
+LATENCY_WINDOW = 50
+MIN_LATENCY_SAMPLES = 10
+DEFAULT_HEDGE_AFTER = float(os.environ.get('BEDROCK_HEDGE_AFTER_SECONDS', '20'))
+HEDGING_ENABLED = os.environ.get('BEDROCK_HEDGING', 'true').lower() == 'true'
+
+# Output rate assumed until calls have been observed, and the smallest useful answer
+DEFAULT_OUTPUT_TOKENS_PER_SECOND = 100.0
+MIN_MAX_TOKENS = 256
+# Fixed per-call overhead (request, queueing, prompt processing) in seconds
+CALL_OVERHEAD = 1.5
+
+_clients = {}
+_executor = ThreadPoolExecutor(max_workers=8)
+
+
+def get_runtime_client(region_name='us-east-1'):
+    """Return a cached bedrock-runtime client with SDK retries disabled.
+
+    Retries are handled here instead, so botocore's own retry loop is turned
+    off to keep attempts visible and bounded by the deadline.
+    """
+    client = _clients.get(region_name)
+    if client is None:
+        client = _clients[region_name] = boto3.client(
+            'bedrock-runtime',
+            region_name=region_name,
+            config=Config(
+                retries={'total_max_attempts': 1, 'mode': 'standard'},
+                connect_timeout=5,
+                read_timeout=60,
+                max_pool_connections=16,
+            ),
+        )
+    return client
+
+
+class LatencyTracker:
+    """Rolling per-key latency and output throughput observed in this container."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._latencies = {}
+        self._throughput = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds, output_tokens):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+            if output_tokens and seconds > CALL_OVERHEAD:
+                self._throughput.setdefault(key, deque(maxlen=self.window)).append(
+                    output_tokens / (seconds - CALL_OVERHEAD))
+
+    def p95(self, key):
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def tokens_per_second(self, key):
+        with self._lock:
+            samples = sorted(self._throughput.get(key, ()))
+        if not samples:
+            return DEFAULT_OUTPUT_TOKENS_PER_SECOND
+        # A low percentile so the cap holds for slower-than-usual calls too
+        return samples[len(samples) // 5]
+
+
+latency_tracker = LatencyTracker()
+
+
+def estimate_cost(model_id, input_tokens, output_tokens):
+    """Estimate the USD cost of a call; unknown models are costed at 0."""
+    # Cross-region inference profiles prefix the model ID with a geography
+    base_model = model_id.split('/')[-1]
+    if base_model.count('.') > 1:
+        base_model = base_model.split('.', 1)[1]
+    input_price, output_price = MODEL_PRICING.get(base_model, (0.0, 0.0))
+    return input_tokens / 1000 * input_price + output_tokens / 1000 * output_price
+
+
+class AttemptUsage:
+    """Token usage and SDK retries of one request.
+
+    Each attempt, hedges included, collects its own; only the attempt whose
+    result is returned is added to the InvocationRecord.
+    """
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.retries = 0
+
+    def add_usage(self, usage):
+        """Record token counts from a Nova ``usage`` block or stream invocation metrics."""
+        if not usage:
+            return
+        self.input_tokens += usage.get('inputTokens', usage.get('inputTokenCount', 0))
+        self.output_tokens += usage.get('outputTokens', usage.get('outputTokenCount', 0))
+
+    def add_response_metadata(self, response):
+        """Record retries botocore made before returning this response."""
+        self.retries += response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+
+class InvocationRecord(AttemptUsage):
+    """Telemetry collected for a single logical model invocation (all attempts)."""
+
+    def __init__(self, stage, model_id, visit_id=None, expert=None):
+        super().__init__()
+        self.stage = stage
+        self.model_id = model_id
+        self.visit_id = visit_id
+        self.expert = expert
+        self.started = time.perf_counter()
+        self.first_token_ms = None
+        self.throttles = 0
+        self.throttle_signalled = False
+        self.hedges = 0
+        self.rate_limit_wait_ms = 0.0
+        self.max_tokens = None
+        self.error = None
+        self.limiter = None
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def mark_first_token(self):
+        if self.first_token_ms is None:
+            self.first_token_ms = self.elapsed_ms()
+
+    def add_attempt(self, attempt):
+        """Count the usage of the attempt whose result is returned."""
+        self.input_tokens += attempt.input_tokens
+        self.output_tokens += attempt.output_tokens
+        self.retries += attempt.retries
+
+    def emit(self):
+        values = {
+            'Latency': (self.elapsed_ms(), 'Milliseconds'),
+            'InputTokens': (self.input_tokens, 'Count'),
+            'OutputTokens': (self.output_tokens, 'Count'),
+            'Retries': (self.retries, 'Count'),
+            'Throttles': (self.throttles, 'Count'),
+            'Hedges': (self.hedges, 'Count'),
+            'Errors': (1 if self.error else 0, 'Count'),
+            'RateLimitWait': (self.rate_limit_wait_ms, 'Milliseconds'),
+            'EstimatedCost': (estimate_cost(self.model_id, self.input_tokens, self.output_tokens), 'None'),
+        }
+        if self.first_token_ms is not None:
+            values['TimeToFirstToken'] = (self.first_token_ms, 'Milliseconds')
+        return metrics.emit(
+            values,
+            {'Stage': self.stage, 'Expert': self.expert, 'ModelId': self.model_id},
+            {'visitId': self.visit_id, 'error': self.error, 'maxTokens': self.max_tokens},
+            namespace=METRICS_NAMESPACE,
+        )
+
+
+def _limiter_call(limiter, action, default=None):
+    """Call limiter.<action>(), failing open if the rate-limit table cannot be used."""
+    try:
+        return getattr(limiter, action)()
+    except Exception as e:
+        logger.warning("Rate limiter %s failed, continuing without it: %s", action, e)
+        return default
+
+
+def _signal_throttle(record):
+    """Report a throttle to the limiter, at most once per invocation."""
+    if not record.throttle_signalled:
+        record.throttle_signalled = True
+        _limiter_call(record.limiter, 'on_throttle')
+
+
+@contextmanager
+def track_invocation(stage, model_id=DEFAULT_MODEL_ID, visit_id=None, expert=None):
+    """Rate-limit and time a model call, emitting its telemetry when the block exits.
+
+    Use directly for APIs other than invoke_model (e.g. knowledge base
+    retrieve_and_generate); the caller fills in usage on the yielded record.
+    Exceptions are recorded and re-raised.
+    """
+    limiter = rate_limiter.get_limiter(model_id)
+    record = InvocationRecord(stage, model_id, visit_id, expert)
+    record.limiter = limiter
+    record.rate_limit_wait_ms = _limiter_call(limiter, 'acquire', 0.0) * 1000
+    try:
+        yield record
+    except ClientError as e:
+        code = error_code(e)
+        if code in THROTTLING_ERROR_CODES:
+            record.throttles += 1
+        record.retries += e.response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        record.error = code
+        raise
+    except Exception as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        # Only throttles slow the limiter down; other errors and retries say nothing about capacity
+        if record.throttles:
+            _signal_throttle(record)
+        elif not record.error:
+            _limiter_call(limiter, 'on_success')
+        record.emit()
+
+
+def error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code', 'ClientError')
+    return type(error).__name__
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        return error_code(error) in THROTTLING_ERROR_CODES | TRANSIENT_ERROR_CODES
+    return isinstance(error, TRANSIENT_EXCEPTIONS)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given retry number (1-based)."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def fit_max_tokens(request_body, deadline, key):
+    """Return a copy of request_body with maxTokens lowered to fit the deadline.
+
+    Raises DeadlineExceeded when not even MIN_MAX_TOKENS can be produced in
+    the time left.
+    """
+    remaining = deadline.remaining() if deadline else None
+    if remaining is None:
+        return request_body
+    inference = request_body.get('inferenceConfig', {})
+    requested = inference.get('maxTokens')
+    affordable = int((remaining - CALL_OVERHEAD) * latency_tracker.tokens_per_second(key) * 0.8)
+    if affordable < MIN_MAX_TOKENS:
+        raise DeadlineExceeded(f"{remaining:.1f}s left is not enough for a model call")
+    if requested is not None and requested <= affordable:
+        return request_body
+    capped = dict(request_body, inferenceConfig=dict(inference, maxTokens=affordable))
+    logger.info("Lowering maxTokens from %s to %d to fit %.1fs remaining", requested, affordable, remaining)
+    return capped
+
+
+def _hedged(call, record, hedge_after, deadline):
+    """Run call, starting one duplicate if it is still running after hedge_after seconds.
+
+    Returns the first successful result. The losing request cannot be
+    cancelled mid-flight; its result is discarded.
+    """
+    pending = {_executor.submit(call)}
+    hedge_pending = hedge_after is not None
+    last_error = None
+    while pending:
+        timeout = deadline.remaining() if deadline else None
+        if hedge_pending:
+            timeout = hedge_after if timeout is None else min(timeout, hedge_after)
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+        if not done:
+            if hedge_pending and not (deadline and deadline.expired()):
+                hedge_pending = False
+                # Hedges only go out when the bucket has spare capacity
+                if record.limiter is None or _limiter_call(record.limiter, 'try_acquire', True):
+                    record.hedges += 1
+                    logger.info("Hedging %s call after %.1fs", record.stage, hedge_after)
+                    pending.add(_executor.submit(call))
+                continue
+            raise DeadlineExceeded(f"{record.stage} model call did not finish before the deadline")
+        hedge_pending = False
+    raise last_error
+
+
+def _invoke_with_retries(record, attempt_fn, request_body, deadline, hedge):
+    """Drive attempts of attempt_fn(body, usage) with backoff, hedging and deadline checks."""
+    key = (record.model_id, record.stage)
+    attempt = 0
+    while True:
+        body = fit_max_tokens(request_body, deadline, key)
+        record.max_tokens = body.get('inferenceConfig', {}).get('maxTokens')
+        hedge_after = None
+        if hedge and HEDGING_ENABLED:
+            hedge_after = latency_tracker.p95(key) or DEFAULT_HEDGE_AFTER
+
+        def run():
+            usage = AttemptUsage()
+            return attempt_fn(body, usage), usage
+
+        started = time.perf_counter()
+        try:
+            if hedge_after is None and not deadline:
+                result, usage = run()
+            else:
+                result, usage = _hedged(run, record, hedge_after, deadline)
+            seconds = time.perf_counter() - started
+            record.add_attempt(usage)
+            latency_tracker.record(key, seconds, usage.output_tokens)
+            latency_stats.record(record.stage, seconds, usage.output_tokens, CALL_OVERHEAD)
+            return result
+        except Exception as e:
+            attempt += 1
+            if not is_retryable(e) or attempt >= MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt)
+            remaining = deadline.remaining() if deadline else None
+            if remaining is not None and remaining - delay < CALL_OVERHEAD + MIN_MAX_TOKENS / DEFAULT_OUTPUT_TOKENS_PER_SECOND:
+                logger.warning("Not retrying %s call: %.1fs left", record.stage, remaining)
+                raise
+            code = error_code(e)
+            if code in THROTTLING_ERROR_CODES:
+                record.throttles += 1
+                _signal_throttle(record)
+            record.retries += 1
+            logger.warning("Retrying %s call after %s in %.2fs (attempt %d/%d)",
+                           record.stage, code, delay, attempt + 1, MAX_ATTEMPTS)
+            time.sleep(delay)
+            record.rate_limit_wait_ms += _limiter_call(record.limiter, 'acquire', 0.0) * 1000
+
+
+def invoke_model(bedrock_runtime, request_body, stage, model_id=DEFAULT_MODEL_ID, visit_id=None,
+                 expert=None, deadline=None):
+    """Invoke a model with a messages-v1 request body and return the parsed response body.
+
+    deadline is a Deadline (see Deadline.from_context); without one the call
+    is retried but never capped or timed out.
+    """
+    with track_invocation(stage, model_id, visit_id, expert) as record:
+        def attempt(body, usage):
+            response = bedrock_runtime.invoke_model(
+                modelId=model_id,
+                body=json.dumps(body)
+            )
+            response_body = json.loads(response['body'].read())
+            usage.add_response_metadata(response)
+            usage.add_usage(response_body.get('usage'))
+            return response_body
+
+        return _invoke_with_retries(record, attempt, request_body, deadline, hedge=True)
+
+
+def invoke_model_stream(bedrock_runtime, request_body, stage, model_id=DEFAULT_MODEL_ID, visit_id=None,
+                        expert=None, deadline=None):
+    """Invoke a model with response streaming and return the concatenated text.
+
+    Time to first token is taken at the first text delta. Streaming calls
+    are retried and capped like invoke_model but not hedged.
+    """
+    with track_invocation(stage, model_id, visit_id, expert) as record:
+        def attempt(body, usage):
+            response = bedrock_runtime.invoke_model_with_response_stream(
+                modelId=model_id,
+                body=json.dumps(body)
+            )
+            usage.add_response_metadata(response)
+            parts = []
+            for event in response['body']:
+                chunk = json.loads(event['chunk']['bytes'])
+                delta = chunk.get('contentBlockDelta', {}).get('delta', {}).get('text')
+                if delta:
+                    record.mark_first_token()
+                    parts.append(delta)
+                if 'metadata' in chunk:
+                    usage.add_usage(chunk['metadata'].get('usage'))
+                elif 'amazon-bedrock-invocationMetrics' in chunk and not usage.output_tokens:
+                    usage.add_usage(chunk['amazon-bedrock-invocationMetrics'])
+            return ''.join(parts)
+
+        return _invoke_with_retries(record, attempt, request_body, deadline, hedge=False)
+
+
+def get_response_text(response_body):
+    """Return the first text block of a Nova messages-v1 response."""
+    return response_body['output']['message']['content'][0]['text']
@@ -0,0 +1,125 @@
+"""Visit-level latency budget carried through the pipeline.
+
+asclepius-extract-session-id stamps each visit with the time the recording
+finished and the total budget (VISIT_LATENCY_BUDGET_MS) for delivering its
+care plan. Every later stage receives the same ``visitBudget`` object, works
+out how much of it is left, and owns a slice ending at a fixed cumulative
+share of the budget (STAGE_CHECKPOINTS). Stages use their slice to size
+model calls, skip optional work when behind, and report whether they
+finished inside it.
+
+Timestamps are epoch milliseconds because the budget crosses Lambda
+invocations; Deadline objects handed to model calls are converted to the
+local monotonic clock.
+"""
+import os
+import time
+
+from asclepius_shared import metrics
+from asclepius_shared.deadline import Deadline
+
+DEFAULT_BUDGET_MS = int(os.environ.get('VISIT_LATENCY_BUDGET_MS', '120000'))
+
+# Share of the visit budget by which each stage should have finished.
+# icd10-verify runs alongside care-plan generation and routing rather than
+# before them, so its slice overlaps theirs instead of delaying them.
+STAGE_CHECKPOINTS = {
+    'summary-processor': 0.05,
+    'icd10-verify': 0.50,
+    'generate-care-plan': 0.35,
+    'orchestrator': 0.50,
+    'agent': 1.0,
+}
+
+# Minimum time a model-calling stage always gets, even when the visit is late,
+# so a late visit still produces a (shorter) result rather than none at all
+STAGE_FLOOR_SECONDS = {
+    'generate-care-plan': 20,
+    'orchestrator': 15,
+    'agent': 20,
+}
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class VisitBudget:
+    """A visit's start time and total latency budget, both in epoch milliseconds."""
+
+    def __init__(self, started_at, budget_ms=DEFAULT_BUDGET_MS):
+        self.started_at = int(started_at)
+        self.budget_ms = int(budget_ms)
+
+    @classmethod
+    def start(cls, started_at=None, budget_ms=DEFAULT_BUDGET_MS):
+        return cls(started_at if started_at is not None else now_ms(), budget_ms)
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict) or 'startedAt' not in data:
+            return None
+        return cls(data['startedAt'], data.get('budgetMs', DEFAULT_BUDGET_MS))
+
+    @classmethod
+    def from_event(cls, event):
+        """Find visitBudget in a stage's input, or start a new budget now.
+
+        Looks at the top level, an EventBridge detail, and for agents the
+        earlier results under originalData.
+        """
+        candidates = [event, event.get('detail'), event.get('Payload')]
+        original = event.get('originalData')
+        if isinstance(original, dict):
+            candidates.append(original.get('detail'))
+            for result_key in ('carePlanResult', 'icd10Result', 'summaryResult'):
+                result = original.get(result_key)
+                if isinstance(result, dict):
+                    candidates.append(result.get('Payload'))
+        for candidate in candidates:
+            if isinstance(candidate, dict):
+                budget = cls.from_dict(candidate.get('visitBudget'))
+                if budget:
+                    return budget
+        return cls.start()
+
+    def to_dict(self):
+        return {'startedAt': self.started_at, 'budgetMs': self.budget_ms}
+
+    def remaining_ms(self):
+        return self.started_at + self.budget_ms - now_ms()
+
+    def stage_end_ms(self, stage):
+        return self.started_at + int(self.budget_ms * STAGE_CHECKPOINTS.get(stage, 1.0))
+
+    def stage_remaining_ms(self, stage):
+        """Milliseconds left in a stage's slice; negative once the stage is late."""
+        return self.stage_end_ms(stage) - now_ms()
+
+    def behind_schedule(self, stage):
+        return self.stage_remaining_ms(stage) <= 0
+
+    def stage_deadline(self, stage, floor_seconds=None):
+        """Deadline at the end of the stage's slice, but never sooner than its floor."""
+        if floor_seconds is None:
+            floor_seconds = STAGE_FLOOR_SECONDS.get(stage, 0)
+        seconds = max(self.stage_remaining_ms(stage) / 1000, floor_seconds)
+        return Deadline.after(seconds)
+
+    def deadline(self, stage, context=None):
+        """The earlier of the stage's budget deadline and the Lambda timeout."""
+        return Deadline.from_context(context).earliest(self.stage_deadline(stage))
+
+    def report(self, stage, visit_id=None, expert=None):
+        """Emit whether the stage finished inside its slice."""
+        now = now_ms()
+        stage_remaining = self.stage_end_ms(stage) - now
+        return metrics.emit(
+            {
+                'VisitElapsed': (now - self.started_at, 'Milliseconds'),
+                'StageBudgetRemaining': (stage_remaining, 'Milliseconds'),
+                'WithinBudget': (1 if stage_remaining >= 0 else 0, 'Count'),
+            },
+            {'Stage': stage, 'Expert': expert},
+            {'visitId': visit_id, 'budgetMs': self.budget_ms},
+        )
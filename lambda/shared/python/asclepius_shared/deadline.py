@@ -0,0 +1,52 @@
+"""Time budgets for pipeline stages.
+
+A Deadline is an absolute point in time a stage must finish by. Handlers
+build one from the Lambda context so model calls can size retries and
+generation length to the time actually left instead of running into the
+function timeout.
+"""
+import time
+
+# Time kept back from the Lambda timeout to serialise the result and return
+DEFAULT_RESERVE_MS = 3000
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough time left to start or finish a call."""
+
+
+class Deadline:
+    """An absolute monotonic deadline; None means unbounded."""
+
+    def __init__(self, expires_at=None, clock=time.monotonic):
+        self.expires_at = expires_at
+        self.clock = clock
+
+    @classmethod
+    def after(cls, seconds, clock=time.monotonic):
+        return cls(clock() + seconds, clock)
+
+    @classmethod
+    def from_context(cls, context, reserve_ms=DEFAULT_RESERVE_MS):
+        """Deadline at the Lambda timeout minus a reserve, or unbounded without a context."""
+        if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+            return cls()
+        return cls.after(max(0, context.get_remaining_time_in_millis() - reserve_ms) / 1000)
+
+    def remaining(self):
+        """Seconds left, or None when unbounded."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - self.clock())
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def earliest(self, other):
+        """Return whichever of two deadlines expires first."""
+        if other is None or other.expires_at is None:
+            return self
+        if self.expires_at is None or other.expires_at < self.expires_at:
+            return other
+        return self
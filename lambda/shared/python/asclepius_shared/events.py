@@ -0,0 +1,32 @@
+"""Helpers for reading identifiers out of the pipeline's Step Functions payloads."""
+
+
+def get_visit_id(event):
+    """Return the visit ID carried by a stage's input, or None.
+
+    Core stages receive visitId at the top level. Agents receive the whole
+    workflow state under originalData, where the ID lives in the results of
+    earlier states.
+    """
+    if not isinstance(event, dict):
+        return None
+    visit_id = event.get('visitId') or event.get('visitID')
+    if visit_id:
+        return visit_id
+
+    original = event.get('originalData')
+    if isinstance(original, dict):
+        for result_key, path in (
+            ('carePlanResult', ('Payload', 'carePlan', 'visitId')),
+            ('icd10Result', ('Payload', 'visitId')),
+            ('summaryResult', ('Payload', 'visitId')),
+        ):
+            value = original.get(result_key)
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value:
+                return value
+        detail = original.get('detail')
+        if isinstance(detail, dict) and detail.get('visitId'):
+            return detail['visitId']
+    return None
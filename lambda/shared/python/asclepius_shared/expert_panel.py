@@ -0,0 +1,140 @@
+"""Single-call expert panel: several experts' consultations from one model call.
+
+When routing flags many experts, the fan-out makes one Bedrock call per
+expert. Each of those calls re-sends the same patient context and waits
+for a rate-limiter token. The panel sends the context once, gives the model
+every needed expert's persona, and asks for one marked section per expert.
+asclepius-agent-panel then splits the sections back into the per-expert
+results the fan-out would have stored.
+
+choose_mode picks between the two from the expert count and from the
+latency measured for both modes (latency_stats). The fan-out costs roughly
+one agent call plus any wait for rate-limiter tokens. The panel costs one
+call that has to generate every section. The panel is chosen when it is
+not much slower than the fan-out, or when it still fits comfortably in
+what is left of the visit's latency budget, since it sends far fewer
+input tokens.
+"""
+import math
+import os
+import re
+
+from asclepius_shared import bedrock_client, latency_stats, log, metrics, rate_limiter
+from asclepius_shared.experts import needed_experts
+from asclepius_shared.personas import PERSONAS
+
+# auto picks per visit; panel or fanout forces a mode
+PANEL_MODE = os.environ.get('EXPERT_PANEL_MODE', 'auto').lower()
+PANEL_MIN_EXPERTS = int(os.environ.get('EXPERT_PANEL_MIN_EXPERTS', '6'))
+PANEL_MAX_EXPERTS = int(os.environ.get('EXPERT_PANEL_MAX_EXPERTS', '10'))
+PANEL_MAX_OUTPUT_TOKENS = int(os.environ.get('EXPERT_PANEL_MAX_TOKENS', '5000'))
+
+# Most a panel section is allowed; fan-out agents are allowed 2000 but rarely use half
+PANEL_TOKENS_PER_EXPERT = 800
+
+# The panel may be this much slower than the fan-out estimate and still be
+# chosen, since it sends the patient context once instead of once per expert
+PANEL_LATENCY_TOLERANCE = float(os.environ.get('EXPERT_PANEL_LATENCY_TOLERANCE', '1.25'))
+
+# Share of the agents' remaining visit budget the panel may use
+PANEL_BUDGET_SHARE = 0.8
+
+# Used until latency_stats has measurements for the agents
+DEFAULT_AGENT_LATENCY = 20.0
+
+SECTION_MARKER = re.compile(r"^[ \t]*\[\[([a-z_]+)\]\][ \t]*$", re.MULTILINE)
+
+logger = log.get_logger('expert-panel')
+
+
+def tokens_per_expert(count):
+    return min(PANEL_TOKENS_PER_EXPERT, PANEL_MAX_OUTPUT_TOKENS // max(1, count))
+
+
+def estimate_fanout_seconds(count, model_id=bedrock_client.DEFAULT_MODEL_ID):
+    """One agent call, plus the wait for tokens the bucket cannot cover right away."""
+    stats = latency_stats.get('agent') or {}
+    latency = stats.get('latency', DEFAULT_AGENT_LATENCY)
+    try:
+        tokens, rate = rate_limiter.get_limiter(model_id).available()
+    except Exception as e:
+        logger.warning("Could not read rate limiter state: %s", e)
+        return latency
+    return latency + max(0.0, count - tokens) / max(rate, rate_limiter.DEFAULT_MIN_RATE)
+
+
+def estimate_panel_seconds(count):
+    """Overhead plus the time to generate every section at the measured throughput."""
+    panel = latency_stats.get('agent-panel') or {}
+    agent = latency_stats.get('agent') or {}
+    throughput = (panel.get('tokensPerSecond') or agent.get('tokensPerSecond')
+                  or bedrock_client.DEFAULT_OUTPUT_TOKENS_PER_SECOND)
+    # Sections are usually shorter than their cap; use what agents actually write when known
+    per_expert = min(tokens_per_expert(count), agent.get('outputTokens') or tokens_per_expert(count))
+    return bedrock_client.CALL_OVERHEAD + count * per_expert / throughput
+
+
+def choose_mode(required_experts, stage=None, visit_id=None, budget=None):
+    """Return 'panel' or 'fanout' for this routing and emit the estimates behind it.
+
+    budget is the visit's VisitBudget, if known; without it only the latency
+    comparison applies.
+    """
+    count = len(needed_experts(required_experts))
+    values = {'ExpertsNeeded': (count, 'Count')}
+    if PANEL_MODE in ('panel', 'fanout'):
+        mode = PANEL_MODE if count else 'fanout'
+    elif count < PANEL_MIN_EXPERTS or count > PANEL_MAX_EXPERTS:
+        mode = 'fanout'
+    else:
+        fanout_seconds = estimate_fanout_seconds(count)
+        panel_seconds = estimate_panel_seconds(count)
+        available = budget.stage_remaining_ms('agent') / 1000 * PANEL_BUDGET_SHARE if budget else 0
+        if panel_seconds <= fanout_seconds * PANEL_LATENCY_TOLERANCE or panel_seconds <= available:
+            mode = 'panel'
+        else:
+            mode = 'fanout'
+        logger.info("Expert mode %s for %d experts: panel ~%.1fs, fan-out ~%.1fs, %.1fs of budget available",
+                    mode, count, panel_seconds, fanout_seconds, available)
+        values['EstimatedPanelLatency'] = (panel_seconds * 1000, 'Milliseconds')
+        values['EstimatedFanoutLatency'] = (fanout_seconds * 1000, 'Milliseconds')
+    values['PanelSelected'] = (1 if mode == 'panel' else 0, 'Count')
+    metrics.emit(values, {'Stage': stage}, {'visitId': visit_id, 'expertMode': mode})
+    return mode
+
+
+def build_prompt(context_text, experts):
+    """Prompt asking for one [[expert_key]]-marked section per expert."""
+    words = int(tokens_per_expert(len(experts)) * 0.7)
+    sections = '\n\n'.join(f"[[{key}]]\n{PERSONAS[key]}" for key in experts)
+    return f"""
+
+General Care Plan:
+{context_text}
+
+You are a panel of {len(experts)} healthcare experts. Write a separate response for each expert below, following that expert's instructions as if it were the only one.
+
+Begin each response with a line containing only that expert's marker, exactly as shown (for example [[{experts[0]}]]). Write nothing before the first marker, give the experts in the order listed, and keep each response under about {words} words.
+
+{sections}
+
+"""
+
+
+def split_sections(text, experts):
+    """Map each expert to its section of the panel output; missing experts are left out."""
+    wanted = set(experts)
+    # Every marker ends the section before it; text under an expert that was not asked for is dropped
+    markers = list(SECTION_MARKER.finditer(text))
+    sections = {}
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        body = text[marker.end():end].strip()
+        # A repeated marker keeps its first non-empty section
+        if body and marker.group(1) in wanted and marker.group(1) not in sections:
+            sections[marker.group(1)] = body
+    return sections
+
+
+def max_output_tokens(count):
+    return min(PANEL_MAX_OUTPUT_TOKENS, math.ceil(tokens_per_expert(count) * count * 1.1))
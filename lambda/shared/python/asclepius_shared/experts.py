@@ -0,0 +1,151 @@
+"""The specialist experts the pipeline can route a visit to.
+
+EXPERTS is the single list of expert keys (as used in requiredExperts and
+the workflow's Check<Expert> states) and the description the routing
+prompts give the model for each one.
+"""
+from asclepius_shared import log
+
+logger = log.get_logger('experts')
+
+EXPERTS = [
+    ('diabetes_specialist', "Certified Diabetes Care and Education Specialist (Focus: diabetes management, education, and support)"),
+    ('allergies_expert', "Allergies Expert (Focus: allergy diagnosis, treatment, and management)"),
+    ('kidney_expert', "National Kidney Foundation Expert (Focus: kidney health, disease prevention, and management)"),
+    ('insurance_expert', "Insurance Expert (Focus: healthcare coverage, claims, and financial planning)"),
+    ('nutritionist', "Registered Dietitian Nutritionist (RDN) (Focus: nutrition, diet planning, and nutritional therapy)"),
+    ('ophthalmologist', "Ophthalmologist Expert (Focus: eye health, vision care, and eye disease management)"),
+    ('podiatrist', "Podiatrist Expert (Focus: foot and ankle health, particularly for diabetes-related complications)"),
+    ('hospital_care_team', "Hospital Care Team (Focus: inpatient care coordination and management)"),
+    ('ada_expert', "American Diabetes Association (ADA) Expert (Focus: diabetes research, guidelines, and best practices)"),
+    ('social_determinants_expert', "Social Determinants of Health Expert (Focus: social and environmental factors affecting health)"),
+    ('physical_therapist', "Physical Therapist Expert (Focus: mobility, exercise, and rehabilitation)"),
+    ('pharmacist', "Pharmacist Expert (Focus: medication management, drug interactions, and adherence)"),
+]
+
+EXPERT_KEYS = [key for key, _ in EXPERTS]
+
+# dataCategory under which each expert's result is stored in the visit data table
+DATA_CATEGORIES = {
+    'diabetes_specialist': 'diabetesExpert',
+    'allergies_expert': 'allergiesExpert',
+    'kidney_expert': 'kidneyExpert',
+    'insurance_expert': 'insuranceExpert',
+    'nutritionist': 'nutritionExpert',
+    'ophthalmologist': 'ophthalmologistExpert',
+    'podiatrist': 'podiatristExpert',
+    'hospital_care_team': 'hospitalCareTeamExpert',
+    'ada_expert': 'adaExpert',
+    'social_determinants_expert': 'socialDeterminantsExpert',
+    'physical_therapist': 'physicalTherapistExpert',
+    'pharmacist': 'pharmacistExpert',
+}
+
+# Lambda function (without the stage suffix) that runs each expert on its own
+AGENT_FUNCTIONS = {
+    'diabetes_specialist': 'asclepius-agent-diabetes',
+    'allergies_expert': 'asclepius-agent-allergies',
+    'kidney_expert': 'asclepius-agent-kidney',
+    'insurance_expert': 'asclepius-agent-insurance',
+    'nutritionist': 'asclepius-agent-nutritionist',
+    'ophthalmologist': 'asclepius-agent-ophthalmologist',
+    'podiatrist': 'asclepius-agent-podiatrist',
+    'hospital_care_team': 'asclepius-agent-hospital-care-team',
+    'ada_expert': 'asclepius-agent-ada',
+    'social_determinants_expert': 'asclepius-agent-social-determinants',
+    'physical_therapist': 'asclepius-agent-physical-therapist',
+    'pharmacist': 'asclepius-agent-pharmacist',
+}
+
+# Clinical-summary fields each expert is given (prompts.agent_context). They are
+# also what asclepius-recompute checks to decide whether an edit reaches an expert.
+_CORE_FIELDS = ('chief_complaint', 'assessment', 'plan')
+EXPERT_SUMMARY_FIELDS = {
+    'diabetes_specialist': _CORE_FIELDS + ('history_present_illness', 'past_medical_history', 'physical_examination'),
+    'allergies_expert': _CORE_FIELDS + ('history_present_illness', 'review_systems', 'past_medical_history'),
+    'kidney_expert': _CORE_FIELDS + ('history_present_illness', 'past_medical_history', 'physical_examination'),
+    'insurance_expert': _CORE_FIELDS,
+    'nutritionist': _CORE_FIELDS + ('history_present_illness', 'past_medical_history'),
+    'ophthalmologist': _CORE_FIELDS + ('history_present_illness', 'review_systems', 'physical_examination'),
+    'podiatrist': _CORE_FIELDS + ('history_present_illness', 'physical_examination'),
+    'hospital_care_team': _CORE_FIELDS + ('history_present_illness', 'review_systems', 'past_medical_history',
+                                          'physical_examination'),
+    'ada_expert': _CORE_FIELDS + ('history_present_illness', 'past_medical_history'),
+    'social_determinants_expert': _CORE_FIELDS + ('history_present_illness',),
+    'physical_therapist': _CORE_FIELDS + ('history_present_illness', 'review_systems', 'physical_examination'),
+    'pharmacist': _CORE_FIELDS + ('history_present_illness', 'past_medical_history'),
+}
+SUMMARY_FIELDS = {field for fields in EXPERT_SUMMARY_FIELDS.values() for field in fields}
+
+# Experts dropped first when a visit is running behind its latency budget
+LOW_PRIORITY_EXPERTS = ['insurance_expert', 'social_determinants_expert', 'hospital_care_team', 'ada_expert']
+
+_expert_list = '\n'.join(f"{i}. {description} -> \"{key}\""
+                         for i, (key, description) in enumerate(EXPERTS, 1))
+
+# Appended to the care-plan prompt when it also decides the expert routing
+ROUTING_INSTRUCTIONS = f"""Also determine which of these specialized healthcare providers should be consulted, based on the care plan you write:
+{_expert_list}
+
+Add a "requiredExperts" key to the same JSON object, with an entry for every expert key above:
+"requiredExperts": {{
+  "diabetes_specialist": {{
+    "needed": true/false,
+    "reasons": ["Detailed reason with specific references to the care plan"]
+  }},
+  ...
+}}
+
+The "needed" field MUST be a boolean (true or false), never a string or number."""
+
+
+def summary_for(summary, experts):
+    """The part of a clinical summary the given experts are given.
+
+    Sections outside SUMMARY_FIELDS (extra sections requested from the
+    summary processor) are kept for every expert.
+    """
+    fields = {field for expert in experts for field in EXPERT_SUMMARY_FIELDS.get(expert, SUMMARY_FIELDS)}
+    return {key: value for key, value in summary.items() if key in fields or key not in SUMMARY_FIELDS}
+
+
+def default_routing():
+    """Routing with every expert marked not needed."""
+    return {key: {"needed": False, "reasons": []} for key in EXPERT_KEYS}
+
+
+def needed_experts(required_experts):
+    """Keys of the experts routing marks as needed, in EXPERTS order."""
+    return [key for key in EXPERT_KEYS
+            if isinstance(required_experts.get(key), dict) and required_experts[key].get('needed') is True]
+
+
+def validate_routing(routing):
+    """Return routing normalised to the orchestrator's shape, or None if unusable.
+
+    Every expert must have an entry with a boolean "needed"; reasons are
+    coerced to a list of strings. Unknown keys are dropped.
+    """
+    if not isinstance(routing, dict):
+        return None
+    validated = {}
+    for key in EXPERT_KEYS:
+        entry = routing.get(key)
+        if not isinstance(entry, dict) or not isinstance(entry.get('needed'), bool):
+            return None
+        reasons = entry.get('reasons') or []
+        if not isinstance(reasons, list):
+            reasons = [reasons]
+        validated[key] = {"needed": entry['needed'], "reasons": [str(reason) for reason in reasons]}
+    return validated
+
+
+def skip_low_priority_experts(required_experts):
+    """Mark low-priority experts as not needed, keeping a reason for the record."""
+    for expert in LOW_PRIORITY_EXPERTS:
+        entry = required_experts.get(expert)
+        if isinstance(entry, dict) and entry.get('needed') is True:
+            entry['needed'] = False
+            entry.setdefault('reasons', []).append("Skipped: visit latency budget exhausted")
+            logger.info("Skipping %s: visit is behind its latency budget", expert)
+    return required_experts
@@ -0,0 +1,189 @@
+"""FHIR R4 resources for a visit, built from the Visit and visit-data records.
+
+A visit becomes:
+- one Encounter;
+- one Condition per assessed diagnosis, coded with ICD-10-CM where a code is
+  known, whether from the ICD-10 verification results, an "(ICD-10: X)"
+  annotation in the assessment, or the visit's primary diagnosis;
+- one CarePlan when the visit has a generated care plan.
+
+visit_resources is a generator, so a caller can write resources out as
+they are produced without holding a whole batch in memory.
+"""
+import json
+import re
+
+VISIT_ID_SYSTEM = 'urn:asclepius:visit-id'
+ICD10_SYSTEM = 'http://hl7.org/fhir/sid/icd-10-cm'
+
+_ICD10_ANNOTATION = re.compile(r"\s*\(ICD-10:\s*([A-Z][0-9][0-9A-Z](?:\.[0-9A-Z]{1,4})?)\)")
+_INVALID_ID_CHARS = re.compile(r"[^A-Za-z0-9\-.]")
+
+# Care-plan sections that become activities, with the CarePlan.activity.detail.kind they map to
+CARE_PLAN_ACTIVITIES = [
+    ('diagnosticTests', 'Diagnostic test', 'ServiceRequest'),
+    ('treatmentOptions', 'Treatment', None),
+    ('followUpRecommendations', 'Follow-up', 'Appointment'),
+    ('specialistReferrals', 'Specialist referral', 'ServiceRequest'),
+]
+
+
+def fhir_id(value):
+    """A valid FHIR logical id (64 chars of [A-Za-z0-9-.]) derived from value."""
+    return _INVALID_ID_CHARS.sub('-', str(value))[:64]
+
+
+def _json_attr(item, name, default=None):
+    """Read an attribute the workflow stored with States.JsonToString."""
+    value = (item or {}).get(name)
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return default if value is None else value
+
+
+def _subject(visit):
+    patient_id = visit.get('patientID') or visit.get('patientId')
+    if patient_id:
+        return {'reference': f"Patient/{fhir_id(patient_id)}"}
+    return {'display': 'Unknown patient'}
+
+
+def diagnoses(visit, final_summary):
+    """Return [(diagnosis text, ICD-10 code or None)] for the visit."""
+    assessment = _json_attr(final_summary, 'assessment') or []
+    if isinstance(assessment, str):
+        assessment = [assessment]
+    verified_codes = _json_attr(final_summary, 'verifiedCodes') or {}
+    soap_assessment = (visit.get('soapNote') or {}).get('assessment') or {}
+    if not assessment:
+        assessment = [soap_assessment.get(key, {}).get('condition')
+                      for key in ('primaryDiagnosis', 'secondaryDiagnosis')]
+    primary_code = soap_assessment.get('primaryDiagnosis', {}).get('icd10')
+    if primary_code in ('', 'Not available'):
+        primary_code = None
+
+    diagnoses = []
+    for entry in assessment:
+        if not entry or not isinstance(entry, str):
+            continue
+        match = _ICD10_ANNOTATION.search(entry)
+        # Same cleaning as icd10-verify, whose verifiedCodes are keyed by the cleaned text
+        text = _ICD10_ANNOTATION.sub('', entry).strip().lstrip('-').strip()
+        if not text:
+            continue
+        code = verified_codes.get(text) or (match.group(1) if match else None)
+        if code is None and not diagnoses:
+            code = primary_code
+        diagnoses.append((text, code))
+    return diagnoses
+
+
+def encounter(visit, encounter_id, condition_ids, chief_complaint=None):
+    resource = {
+        'resourceType': 'Encounter',
+        'id': encounter_id,
+        'identifier': [{'system': VISIT_ID_SYSTEM, 'value': visit['visitID']}],
+        'status': 'finished',
+        'class': {
+            'system': 'http://terminology.hl7.org/CodeSystem/v3-ActCode',
+            'code': 'AMB',
+            'display': 'ambulatory',
+        },
+        'subject': _subject(visit),
+    }
+    if visit.get('date'):
+        resource['period'] = {'start': visit['date']}
+    if chief_complaint:
+        resource['reasonCode'] = [{'text': chief_complaint}]
+    if condition_ids:
+        resource['diagnosis'] = [{'condition': {'reference': f"Condition/{condition_id}"}, 'rank': rank}
+                                 for rank, condition_id in enumerate(condition_ids, 1)]
+    return resource
+
+
+def condition(visit, condition_id, encounter_id, text, code=None):
+    resource = {
+        'resourceType': 'Condition',
+        'id': condition_id,
+        'clinicalStatus': {'coding': [{
+            'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical',
+            'code': 'active',
+        }]},
+        # Diagnoses come from an AI summary of the visit and await clinician review
+        'verificationStatus': {'coding': [{
+            'system': 'http://terminology.hl7.org/CodeSystem/condition-ver-status',
+            'code': 'provisional',
+        }]},
+        'category': [{'coding': [{
+            'system': 'http://terminology.hl7.org/CodeSystem/condition-category',
+            'code': 'encounter-diagnosis',
+            'display': 'Encounter Diagnosis',
+        }]}],
+        'code': {'text': text},
+        'subject': _subject(visit),
+        'encounter': {'reference': f"Encounter/{encounter_id}"},
+    }
+    if code:
+        resource['code']['coding'] = [{'system': ICD10_SYSTEM, 'code': code, 'display': text}]
+    if visit.get('date'):
+        resource['recordedDate'] = visit['date']
+    return resource
+
+
+def care_plan(visit, care_plan_id, encounter_id, care_plan_item, condition_ids):
+    activities = []
+    for section, label, kind in CARE_PLAN_ACTIVITIES:
+        for description in _json_attr(care_plan_item, section) or []:
+            detail = {'status': 'not-started', 'code': {'text': label}, 'description': str(description)}
+            if kind:
+                detail['kind'] = kind
+            activities.append({'detail': detail})
+    resource = {
+        'resourceType': 'CarePlan',
+        'id': care_plan_id,
+        'status': 'active',
+        'intent': 'plan',
+        'title': 'Visit care plan',
+        'subject': _subject(visit),
+        'encounter': {'reference': f"Encounter/{encounter_id}"},
+    }
+    if visit.get('date'):
+        resource['created'] = visit['date']
+    if condition_ids:
+        resource['addresses'] = [{'reference': f"Condition/{condition_id}"} for condition_id in condition_ids]
+    if activities:
+        resource['activity'] = activities
+    education = _json_attr(care_plan_item, 'patientEducation') or []
+    if education:
+        resource['note'] = [{'text': str(text)} for text in education]
+    return resource
+
+
+def visit_resources(visit, data_items):
+    """Yield the FHIR resources for one visit.
+
+    visit is the Visit table item; data_items are its visit-data items
+    (finalSummary, carePlan, expert results, ...), of which only the ones
+    needed here are read.
+    """
+    by_category = {item.get('dataCategory'): item for item in data_items}
+    final_summary = by_category.get('finalSummary')
+    encounter_id = fhir_id(visit['visitID'])
+
+    visit_diagnoses = diagnoses(visit, final_summary)
+    condition_ids = [fhir_id(f"{visit['visitID']}-dx{index}") for index in range(1, len(visit_diagnoses) + 1)]
+
+    chief_complaint = (visit.get('soapNote') or {}).get('subjective', {}).get('chiefComplaint')
+    if not chief_complaint:
+        complaints = _json_attr(final_summary, 'chief_complaint') or []
+        chief_complaint = complaints[0] if complaints else None
+
+    yield encounter(visit, encounter_id, condition_ids, chief_complaint)
+    for condition_id, (text, code) in zip(condition_ids, visit_diagnoses):
+        yield condition(visit, condition_id, encounter_id, text, code)
+    if 'carePlan' in by_category:
+        yield care_plan(visit, fhir_id(f"{visit['visitID']}-careplan"), encounter_id,
+                        by_category['carePlan'], condition_ids)
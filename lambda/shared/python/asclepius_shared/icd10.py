@@ -0,0 +1,115 @@
+"""ICD-10 code lookups shared by icd10-verify and the live visit draft.
+
+Diagnoses are the assessment items with their leading dash removed; codes
+are looked up one diagnosis at a time with a retrieve-and-generate query
+against the ICD-10 knowledge base. lookup_codes takes a cache of earlier
+answers (misses included) so a diagnosis is only ever queried once per
+visit.
+"""
+import os
+import re
+
+import boto3
+from botocore.exceptions import ClientError
+
+from asclepius_shared import bedrock_client, log
+
+logger = log.get_logger('icd10')
+
+_CODE_PATTERN = re.compile(r'^[A-Z]\d+(\.\d+)?$')
+
+
+def extract_diagnoses_from_assessment(assessment_items):
+    """Extract potential diagnoses from assessment items"""
+    diagnoses = []
+    for item in assessment_items:
+        # Remove leading/trailing whitespace and dash
+        cleaned_item = item.strip().lstrip('-').strip()
+        diagnoses.append(cleaned_item)
+    return diagnoses
+
+
+def lookup_codes(diagnoses, knowledge_base_id, cache=None, visit_id=None):
+    """Return {diagnosis: code} for the diagnoses a code was found for.
+
+    cache maps diagnoses already looked up to their code, or None for a
+    miss; it is updated in place with every new answer.
+    """
+    cache = {} if cache is None else cache
+    codes = {}
+    for diagnosis in diagnoses:
+        if diagnosis not in cache:
+            cache[diagnosis] = query_knowledge_base(diagnosis, knowledge_base_id, visit_id)
+        if cache[diagnosis]:
+            codes[diagnosis] = cache[diagnosis]
+    return codes
+
+
+def query_knowledge_base(diagnosis, knowledge_base_id, visit_id=None):
+    """Query the knowledge base for ICD-10 code of a diagnosis"""
+    region = os.environ.get('AWS_REGION', 'us-east-1')
+    bedrock_agent = boto3.client('bedrock-agent-runtime', region_name=region)
+    try:
+        query = f"""Find the exact ICD-10 code for: '{diagnosis}'
+
+Rules:
+1. EXACT MATCH REQUIRED: If '{diagnosis}' exists as an exact term match in the database, use that code
+2. Only if no exact match exists:
+   - Use the most general/unspecified version of the condition
+   - Avoid specific subtypes or variants unless explicitly mentioned
+3. Return only a single code
+
+Required format:
+[CODE]"""
+        
+        logger.debug("Querying knowledge base", query=query)
+        
+        with bedrock_client.track_invocation('icd10-verify', 'amazon.nova-micro-v1:0', visit_id) as record:
+            response = bedrock_agent.retrieve_and_generate(
+                input={
+                    'text': query
+                },
+                retrieveAndGenerateConfiguration={
+                    'type': 'KNOWLEDGE_BASE',
+                    'knowledgeBaseConfiguration': {
+                        'knowledgeBaseId': knowledge_base_id,
+                        'modelArn': f'arn:aws:bedrock:{region}::foundation-model/amazon.nova-micro-v1:0',
+                        'retrievalConfiguration': {
+                            'vectorSearchConfiguration': {
+                                'numberOfResults': 3
+                            }
+                        },
+                        'generationConfiguration': {
+                            'promptTemplate': {
+                                'textPromptTemplate': """Given the following retrieved information:
+$search_results$
+
+Return ONLY the single most appropriate ICD-10 code for: {query}
+
+Format: [CODE]"""
+                            },
+                            'inferenceConfig': {
+                                'textInferenceConfig': {
+                                    'maxTokens': 500,
+                                    'temperature': 0,
+                                    'topP': 1
+                                }
+                            }
+                        }
+                    }
+                }
+            )
+            record.add_response_metadata(response)
+        generated_text = response.get('output', {}).get('text', 'No response generated')
+        logger.debug("Raw response from knowledge base", response=generated_text)
+        
+        cleaned_code = generated_text.strip('[]').strip()
+        if _CODE_PATTERN.match(cleaned_code):
+            return cleaned_code
+        else:
+            logger.info("No valid ICD-10 code found in response for %s: %s", diagnosis, cleaned_code)
+            return None
+
+    except ClientError as e:
+        logger.warning("Error querying knowledge base: %s", e)
+        return None
@@ -0,0 +1,113 @@
+"""Latency statistics for model-calling stages, shared across functions.
+
+bedrock_client.LatencyTracker only sees calls made in its own container.
+Some decisions are made in one function about calls that other functions
+make; for example, the orchestrator chooses between the expert fan-out and
+the single-call panel. Those decisions need what the other functions
+measured. This module keeps an exponentially weighted average of latency,
+output tokens and output throughput per stage.
+
+The averages are stored next to the token buckets in the rate-limit table
+(RATE_LIMIT_TABLE), as items whose bucketId is ``latency#<stage>``. Without
+a table an in-process store is used. Updates are read-modify-write without
+a condition: a concurrent update can drop a sample, which is fine for an
+average.
+"""
+import os
+import threading
+import time
+from decimal import Decimal
+
+import boto3
+
+from asclepius_shared import log
+
+logger = log.get_logger('latency-stats')
+
+# Stages whose calls are recorded; recording costs a DynamoDB round trip
+TRACKED_STAGES = {'agent', 'agent-structured', 'agent-panel'}
+
+# Weight of the newest sample in the moving averages
+SMOOTHING = 0.2
+
+FIELDS = ('latency', 'outputTokens', 'tokensPerSecond', 'samples', 'updatedAt')
+
+
+class LocalStatsStore:
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            return dict(item) if item else None
+
+    def put(self, key, stats):
+        with self._lock:
+            self._items[key] = dict(stats)
+
+
+class DynamoDBStatsStore:
+    def __init__(self, table_name, dynamodb=None):
+        self.table = (dynamodb or boto3.resource('dynamodb')).Table(table_name)
+
+    def get(self, key):
+        item = self.table.get_item(Key={'bucketId': key}).get('Item')
+        if not item:
+            return None
+        return {field: float(item[field]) for field in FIELDS if field in item}
+
+    def put(self, key, stats):
+        item = {'bucketId': key}
+        item.update({field: Decimal(repr(value)) for field, value in stats.items()})
+        self.table.put_item(Item=item)
+
+
+_local_store = LocalStatsStore()
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        table_name = os.environ.get('RATE_LIMIT_TABLE')
+        _store = DynamoDBStatsStore(table_name) if table_name else _local_store
+    return _store
+
+
+def _stats_key(stage):
+    return f'latency#{stage}'
+
+
+def get(stage):
+    """Return the stage's averages, or None if nothing has been recorded."""
+    try:
+        return get_store().get(_stats_key(stage))
+    except Exception as e:
+        logger.warning("Could not read latency stats for %s: %s", stage, e)
+        return None
+
+
+def record(stage, seconds, output_tokens, overhead=0.0):
+    """Fold one call into the stage's averages. Never raises."""
+    if stage not in TRACKED_STAGES:
+        return
+    try:
+        store = get_store()
+        key = _stats_key(stage)
+        current = store.get(key)
+        sample = {'latency': seconds, 'outputTokens': float(output_tokens or 0)}
+        if output_tokens and seconds > overhead:
+            sample['tokensPerSecond'] = output_tokens / (seconds - overhead)
+        if current is None:
+            updated = dict(sample, samples=1)
+        else:
+            updated = dict(current, samples=current.get('samples', 0) + 1)
+            for field, value in sample.items():
+                previous = current.get(field)
+                updated[field] = value if previous is None else previous + SMOOTHING * (value - previous)
+        updated['updatedAt'] = time.time()
+        store.put(key, updated)
+    except Exception as e:
+        logger.warning("Could not record latency stats for %s: %s", stage, e)
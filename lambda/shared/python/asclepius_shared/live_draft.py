@@ -0,0 +1,122 @@
+"""The draft of a visit that asclepius-live-draft builds while it is being recorded.
+
+The streaming server sends transcript segments to asclepius-live-draft as
+the encounter goes on. That function keeps one item per visit in
+LIVE_DRAFT_TABLE:
+
+- summary: a rolling clinical summary with the same keys as the
+  summary-processor's output;
+- diagnoses: the summary's current assessment, cleaned as icd10-verify
+  cleans it;
+- codes: ICD-10 lookups already made for those diagnoses (None for a miss);
+- carePlan and requiredExperts: a speculative care plan with fused routing,
+  generated as soon as the recording stops (status "ready", or "failed"
+  when generate-care-plan returned no usable plan);
+  carePlanWithHistory records whether the patient's history digest was in
+  its prompt.
+
+The workflow that runs on HealthScribe's final documents then only has to
+reconcile: icd10-verify reuses the cached codes, and generate-care-plan
+reuses the speculative care plan and routing when the final assessment
+names the same diagnoses as the draft. Without a table, or without a draft
+for the visit, every stage does its full work as before.
+"""
+import os
+import re
+
+import boto3
+
+from asclepius_shared import log
+from asclepius_shared.patient_history import CARE_PLAN_SECTIONS
+
+LIVE_DRAFT_TABLE = os.environ.get('LIVE_DRAFT_TABLE')
+
+# Speculative results are only reused when this is enabled
+REUSE_ENABLED = os.environ.get('LIVE_DRAFT_REUSE', 'true').lower() == 'true'
+
+# Keys of the rolling summary, as produced by asclepius-summary-processor
+SUMMARY_KEYS = [
+    'chief_complaint',
+    'history_present_illness',
+    'review_systems',
+    'assessment',
+    'plan',
+    'past_medical_history',
+    'physical_examination',
+]
+
+_ICD10_ANNOTATION = re.compile(r"\s*\(ICD-10:[^)]*\)", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+logger = log.get_logger('live-draft')
+
+
+def get_table():
+    return boto3.resource('dynamodb').Table(LIVE_DRAFT_TABLE)
+
+
+def get_draft(visit_id, table=None):
+    """The visit's draft item, or None if there is none or it cannot be read."""
+    if not visit_id or not (table or LIVE_DRAFT_TABLE):
+        return None
+    try:
+        table = table or get_table()
+        return table.get_item(Key={'visitID': visit_id}, ConsistentRead=True).get('Item')
+    except Exception as e:
+        logger.warning("Could not read live draft: %s", e)
+        return None
+
+
+def diagnosis_key(diagnosis):
+    """Comparison form of a diagnosis: no code annotation, case or punctuation."""
+    text = _ICD10_ANNOTATION.sub('', str(diagnosis)).strip().lstrip('-')
+    return ' '.join(_NON_WORD.sub(' ', text.lower()).split())
+
+
+def diagnosis_set(assessment):
+    if isinstance(assessment, str):
+        assessment = [assessment]
+    return {key for key in (diagnosis_key(item) for item in assessment or []) if key}
+
+
+def cached_codes(draft):
+    """{diagnosis: code} of the draft's successful ICD-10 lookups."""
+    return {diagnosis: code for diagnosis, code in ((draft or {}).get('codes') or {}).items() if code}
+
+
+def complete_care_plan(care_plan):
+    """Whether a care plan is a usable result rather than generate-care-plan's empty fallback.
+
+    That function returns an error key and empty sections when the model
+    call or its parsing fails.
+    """
+    if not care_plan or care_plan.get('error'):
+        return False
+    return any(care_plan.get(section) for section in CARE_PLAN_SECTIONS)
+
+
+def reusable_care_plan(draft, summary, history=False):
+    """The draft's speculative care plan if it was built from the same diagnoses, else None.
+
+    A patient with a history digest (history true) only reuses a plan that
+    was built with it. The returned dict has the care-plan sections and, if
+    the draft has valid routing, requiredExperts.
+    """
+    if not REUSE_ENABLED or not draft or draft.get('status') != 'ready' or not draft.get('carePlan'):
+        return None
+    if not complete_care_plan(draft['carePlan']):
+        logger.warning("Live draft care plan is empty or failed, not reusing it")
+        return None
+    if history and not draft.get('carePlanWithHistory'):
+        logger.info("Live draft care plan was built without the patient's history, not reusing it")
+        return None
+    final = diagnosis_set((summary or {}).get('assessment'))
+    drafted = diagnosis_set(draft.get('carePlanDiagnoses'))
+    if not final or final != drafted:
+        logger.info("Live draft diagnoses differ from the final summary, not reusing its care plan",
+                    added=sorted(final - drafted), removed=sorted(drafted - final))
+        return None
+    care_plan = dict(draft['carePlan'])
+    if draft.get('requiredExperts'):
+        care_plan['requiredExperts'] = draft['requiredExperts']
+    return care_plan
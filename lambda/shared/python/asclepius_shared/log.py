@@ -0,0 +1,175 @@
+"""Structured, sampled, size-capped logging for the pipeline's functions.
+
+Each record is one JSON line on stdout (CloudWatch Logs indexes the
+fields), for example:
+
+    {"level": "INFO", "stage": "dbwriter", "msg": "Stored visit", "visitId": "..."}
+
+Cost is kept down four ways:
+- Levels: LOG_LEVEL (default INFO). Full events and outputs are logged at
+  DEBUG, so by default they are neither serialized nor shipped.
+- Sampling: DEBUG and INFO records are kept for a fraction of visits, set
+  per stage by LOG_SAMPLE_RATES ("dbwriter=0.1,agent=0.25") with
+  LOG_SAMPLE_RATE as the default (1.0). The decision hashes the visit ID,
+  so a sampled visit is logged by every stage it passes through. Warnings
+  and errors are always kept.
+- Size caps: strings longer than LOG_MAX_FIELD_CHARS and lists longer than
+  MAX_LIST_ITEMS are cut, and a record never exceeds LOG_MAX_RECORD_CHARS.
+- Redaction: fields named in REDACTED_FIELDS (patient conversation and
+  clinical content) are replaced with their type and size.
+
+Formatting is lazy: the message is %-formatted, fields are truncated and
+serialized, and callable field values are called, only when the record
+is actually written.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+LOG_LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), LEVELS['INFO'])
+LOG_MAX_FIELD_CHARS = int(os.environ.get('LOG_MAX_FIELD_CHARS', '1000'))
+LOG_MAX_RECORD_CHARS = int(os.environ.get('LOG_MAX_RECORD_CHARS', '8000'))
+MAX_LIST_ITEMS = 20
+MAX_DEPTH = 6
+
+REDACTED_FIELDS = {
+    'conversation', 'transcript', 'TranscriptSegments', 'soapNote', 'summary', 'clinicalSummary',
+    'chief_complaint', 'history_present_illness', 'review_systems', 'assessment', 'plan',
+    'past_medical_history', 'physical_examination', 'prompt', 'messages', 'expertResult', 'patientHistory',
+}
+REDACTED_FIELDS.update(field.strip() for field in os.environ.get('LOG_REDACT_FIELDS', '').split(',') if field.strip())
+
+
+def _parse_rates(value):
+    rates = {}
+    for entry in value.split(','):
+        stage, _, rate = entry.partition('=')
+        if stage.strip() and rate.strip():
+            rates[stage.strip()] = float(rate)
+    return rates
+
+
+DEFAULT_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+SAMPLE_RATES = _parse_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+
+# Fields bound for the current invocation (stage, visitId, ...) and whether it is sampled
+_context = {}
+_sampled = True
+
+
+def is_sampled(stage, visit_id=None):
+    """Whether DEBUG/INFO records of this visit are kept at this stage."""
+    rate = SAMPLE_RATES.get(stage, DEFAULT_SAMPLE_RATE)
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    key = str(visit_id) if visit_id else str(time.time_ns())
+    bucket = int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < rate
+
+
+def shrink(value, depth=0):
+    """A copy of value small enough to log: redacted, with long strings and lists cut."""
+    if callable(value):
+        value = value()
+    if isinstance(value, str):
+        if len(value) > LOG_MAX_FIELD_CHARS:
+            return f"{value[:LOG_MAX_FIELD_CHARS]}...[+{len(value) - LOG_MAX_FIELD_CHARS} chars]"
+        return value
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if depth >= MAX_DEPTH:
+        return f"[{type(value).__name__}]"
+    if isinstance(value, dict):
+        return {str(key): _redacted(inner) if key in REDACTED_FIELDS else shrink(inner, depth + 1)
+                for key, inner in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        shrunk = [shrink(inner, depth + 1) for inner in items[:MAX_LIST_ITEMS]]
+        if len(items) > MAX_LIST_ITEMS:
+            shrunk.append(f"[{len(items) - MAX_LIST_ITEMS} more items]")
+        return shrunk
+    return shrink(str(value), depth)
+
+
+def _redacted(value):
+    if value is None:
+        return None
+    size = len(value) if hasattr(value, '__len__') else 1
+    return f"[redacted {type(value).__name__} of {size}]"
+
+
+class Logger:
+    def __init__(self, name):
+        self.name = name
+
+    def bind(self, **fields):
+        """Start an invocation's context: records carry these fields, and the
+        visitId (if given) decides whether this invocation is sampled."""
+        global _context, _sampled
+        _context = {'stage': self.name}
+        _context.update({key: value for key, value in fields.items() if value is not None})
+        _sampled = is_sampled(self.name, fields.get('visitId'))
+
+    def enabled(self, level):
+        level_no = LEVELS[level]
+        if level_no < LOG_LEVEL:
+            return False
+        return level_no >= LEVELS['WARNING'] or _sampled
+
+    def debug(self, msg, *args, **fields):
+        if self.enabled('DEBUG'):
+            self._write('DEBUG', msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        if self.enabled('INFO'):
+            self._write('INFO', msg, args, fields)
+
+    def warning(self, msg, *args, **fields):
+        if self.enabled('WARNING'):
+            self._write('WARNING', msg, args, fields)
+
+    def error(self, msg, *args, **fields):
+        if self.enabled('ERROR'):
+            self._write('ERROR', msg, args, fields)
+
+    def exception(self, msg, *args, **fields):
+        """ERROR record with the exception being handled and its traceback."""
+        error_type, error, tb = sys.exc_info()
+        if error is not None:
+            fields.setdefault('error', str(error))
+            fields.setdefault('errorType', error_type.__name__)
+            fields.setdefault('traceback', ''.join(traceback.format_tb(tb)[-5:]))
+        self.error(msg, *args, **fields)
+
+    def _write(self, level, msg, args, fields):
+        try:
+            message = msg % args if args else msg
+        except (TypeError, ValueError):
+            message = f"{msg} {args}"
+        record = {'level': level}
+        record.update(_context)
+        if self.name != record.get('stage'):
+            record['logger'] = self.name
+        record['msg'] = shrink(message)
+        record.update(shrink(fields))
+        line = json.dumps(record, default=str, separators=(',', ':'))
+        if len(line) > LOG_MAX_RECORD_CHARS:
+            line = json.dumps({
+                'level': level,
+                'stage': record.get('stage'),
+                'visitId': record.get('visitId'),
+                'msg': record['msg'],
+                'truncated': line[:LOG_MAX_RECORD_CHARS // 2]
+            }, default=str, separators=(',', ':'))
+        sys.stdout.write(line + '\n')
+
+
+def get_logger(name):
+    return Logger(name)
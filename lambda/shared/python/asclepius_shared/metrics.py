@@ -0,0 +1,37 @@
+"""CloudWatch Embedded Metric Format (EMF) records written to stdout.
+
+Lambda ships stdout to CloudWatch Logs, which extracts any line shaped like
+an EMF document into metrics, so no PutMetricData calls or extra IAM
+permissions are needed.
+"""
+import json
+import os
+import time
+
+DEFAULT_NAMESPACE = 'Asclepius/Pipeline'
+
+
+def emit(metrics, dimensions, properties=None, namespace=None):
+    """Write one EMF record.
+
+    metrics maps metric name -> (value, unit). dimensions maps dimension
+    name -> value; dimensions with a None value are dropped. properties are
+    extra searchable fields (visitId, error codes, ...) that are logged but
+    not turned into metrics.
+    """
+    dimensions = {name: str(value) for name, value in dimensions.items() if value is not None}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace or os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE),
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (value, unit) in metrics.items()],
+            }],
+        },
+    }
+    record.update({name: value for name, value in (properties or {}).items() if value is not None})
+    record.update(dimensions)
+    record.update({name: value for name, (value, unit) in metrics.items()})
+    print(json.dumps(record, default=str))
+    return record
@@ -0,0 +1,143 @@
+"""A size-capped digest of each patient's history, kept current visit by visit.
+
+asclepius-patient-digest merges each completed visit into one item per
+patient in PATIENT_DIGEST_TABLE:
+
+- problems: diagnoses with their ICD-10 codes and the dates first and
+  last seen, merged from the visit's assessment;
+- medications: current medications, as the model last updated them;
+- recommendations: the latest expert recommendations, one line each;
+- trends: short notes on how the patient's conditions are changing.
+
+Each list has a fixed cap and every entry a length cap, so the digest
+(and the prompt text made from it) stays the same size however many
+visits the patient has had. The care plan and the experts are given
+prompt_text(digest) instead of earlier visits.
+"""
+import json
+import os
+import re
+
+import boto3
+
+from asclepius_shared import log
+
+PATIENT_DIGEST_TABLE = os.environ.get('PATIENT_DIGEST_TABLE')
+
+MAX_PROBLEMS = 20
+MAX_MEDICATIONS = 20
+MAX_RECOMMENDATIONS = 12
+MAX_TRENDS = 8
+MAX_ENTRY_CHARS = 200
+# Hard cap on the serialized digest; the oldest entries go first when it is exceeded
+MAX_DIGEST_CHARS = int(os.environ.get('PATIENT_DIGEST_MAX_CHARS', '6000'))
+# Visits remembered so a retried update is not merged twice
+MAX_APPLIED_VISITS = 20
+
+_ICD10_ANNOTATION = re.compile(r"\s*\(ICD-10:\s*([^)]*)\)", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+logger = log.get_logger('patient-digest')
+
+
+def get_table():
+    return boto3.resource('dynamodb').Table(PATIENT_DIGEST_TABLE)
+
+
+def get_digest(patient_id, table=None):
+    """The patient's digest item, or None if there is none or it cannot be read."""
+    if not patient_id or not (table or PATIENT_DIGEST_TABLE):
+        return None
+    try:
+        return (table or get_table()).get_item(Key={'patientID': patient_id}).get('Item')
+    except Exception as e:
+        logger.warning("Could not read patient digest: %s", e)
+        return None
+
+
+def new_digest(patient_id):
+    return {
+        'patientID': patient_id,
+        'version': 0,
+        'visitCount': 0,
+        'appliedVisits': [],
+        'problems': [],
+        'medications': [],
+        'recommendations': [],
+        'trends': [],
+    }
+
+
+def entry_key(text):
+    """Comparison form of an entry: no code annotation, case or punctuation."""
+    text = _ICD10_ANNOTATION.sub('', str(text)).strip().lstrip('-')
+    return ' '.join(_NON_WORD.sub(' ', text.lower()).split())
+
+
+def clip(text):
+    text = ' '.join(str(text).split())
+    return text if len(text) <= MAX_ENTRY_CHARS else text[:MAX_ENTRY_CHARS - 3].rstrip() + '...'
+
+
+def merge_problems(problems, diagnoses, codes, visit_date):
+    """Merge a visit's diagnoses into the problem list; problems not mentioned are kept as they are.
+
+    diagnoses are the visit's cleaned assessment entries, codes maps
+    diagnosis -> verified ICD-10 code.
+    """
+    merged = {entry_key(problem['name']): dict(problem) for problem in problems}
+    for diagnosis in diagnoses:
+        key = entry_key(diagnosis)
+        if not key:
+            continue
+        annotation = _ICD10_ANNOTATION.search(str(diagnosis))
+        code = codes.get(diagnosis) or (annotation.group(1).strip() if annotation else None)
+        problem = merged.setdefault(key, {'name': clip(_ICD10_ANNOTATION.sub('', str(diagnosis)).strip()),
+                                          'firstSeen': visit_date})
+        problem['lastSeen'] = visit_date
+        if code:
+            problem['code'] = code
+    # Most recently seen first, so the cap drops problems not mentioned for longest
+    ordered = sorted(merged.values(), key=lambda problem: problem.get('lastSeen') or '', reverse=True)
+    return ordered[:MAX_PROBLEMS]
+
+
+def cap(digest):
+    """Enforce the per-list and total size caps in place."""
+    digest['problems'] = digest['problems'][:MAX_PROBLEMS]
+    digest['medications'] = [clip(entry) for entry in digest['medications']][:MAX_MEDICATIONS]
+    digest['recommendations'] = [dict(entry, text=clip(entry['text']))
+                                 for entry in digest['recommendations']][:MAX_RECOMMENDATIONS]
+    digest['trends'] = [clip(entry) for entry in digest['trends']][:MAX_TRENDS]
+    digest['appliedVisits'] = digest['appliedVisits'][-MAX_APPLIED_VISITS:]
+
+    # Lists are newest first; trim the longest list's oldest entry until the digest fits
+    trimmable = ('recommendations', 'problems', 'medications', 'trends')
+    while len(json.dumps(digest, default=str)) > MAX_DIGEST_CHARS:
+        longest = max(trimmable, key=lambda key: len(digest[key]))
+        if not digest[longest]:
+            break
+        digest[longest].pop()
+    return digest
+
+
+def prompt_text(digest):
+    """The digest as a short text block for prompts, or '' if there is no history."""
+    if not digest or not int(digest.get('visitCount') or 0):
+        return ''
+    lines = [f"Patient history ({int(digest['visitCount'])} earlier visits, last on {digest.get('lastVisitDate') or 'unknown date'}):"]
+    if digest.get('problems'):
+        lines.append("Problems: " + '; '.join(
+            f"{problem['name']}" + (f" ({problem['code']})" if problem.get('code') else '')
+            + f", last seen {problem.get('lastSeen') or 'unknown'}"
+            for problem in digest['problems']))
+    if digest.get('medications'):
+        lines.append("Current medications: " + '; '.join(digest['medications']))
+    if digest.get('recommendations'):
+        lines.append("Recent expert recommendations:")
+        lines.extend(f"- {entry['expert']} ({entry.get('visitDate') or 'unknown'}): {entry['text']}"
+                     for entry in digest['recommendations'])
+    if digest.get('trends'):
+        lines.append("Trends:")
+        lines.extend(f"- {trend}" for trend in digest['trends'])
+    return '\n'.join(lines)
@@ -0,0 +1,95 @@
+"""A patient's earlier visits, read through the Visit table's patient index.
+
+The dynamoDBwriter keys each Visit item on patientID and date in
+patientID-date-index (keys only), and the workflow stores each visit's
+results as visit-data rows. Together they give the results of a
+patient's previous visits without scanning either table.
+"""
+import json
+import os
+from datetime import date, timedelta
+
+import boto3
+
+from asclepius_shared import log, visit_archive
+
+VISIT_TABLE = os.environ.get('VISIT_TABLE', 'asclepiusMVP-Visit')
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+PATIENT_INDEX = 'patientID-date-index'
+
+# Care-plan sections, as stored by the workflow's StoreCarePlan state
+CARE_PLAN_SECTIONS = ['diagnosticTests', 'treatmentOptions', 'patientEducation', 'followUpRecommendations',
+                      'specialistReferrals']
+
+logger = log.get_logger('patient-history')
+
+
+def previous_visits(patient_id, visit_id=None, before=None, limit=5, max_age_days=None, dynamodb=None):
+    """Index entries ({visitID, patientID, date}) of the patient's earlier visits, newest first.
+
+    The visit itself is excluded, as are visits dated after ``before``
+    (YYYY-MM-DD) or more than ``max_age_days`` before it.
+    """
+    if not patient_id:
+        return []
+    table = (dynamodb or boto3.resource('dynamodb')).Table(VISIT_TABLE)
+    condition = 'patientID = :pid'
+    values = {':pid': patient_id}
+    names = None
+    if before:
+        condition += ' AND #date <= :before'
+        values[':before'] = before
+        names = {'#date': 'date'}
+    # One extra item in case the visit itself is among the newest
+    kwargs = {
+        'IndexName': PATIENT_INDEX,
+        'KeyConditionExpression': condition,
+        'ExpressionAttributeValues': values,
+        'ScanIndexForward': False,
+        'Limit': limit + 1
+    }
+    if names:
+        kwargs['ExpressionAttributeNames'] = names
+    visits = [item for item in table.query(**kwargs).get('Items', []) if item.get('visitID') != visit_id]
+
+    if max_age_days is not None:
+        start = date.fromisoformat(before) if before else date.today()
+        oldest = (start - timedelta(days=max_age_days)).isoformat()
+        visits = [item for item in visits if item.get('date', '') >= oldest]
+    return visits[:limit]
+
+
+def parse_care_plan(item):
+    """Care-plan sections of a carePlan visit-data row (stored with States.JsonToString)."""
+    care_plan = {}
+    for section in CARE_PLAN_SECTIONS:
+        value = item.get(section)
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                value = [value]
+        care_plan[section] = [str(entry) for entry in value] if isinstance(value, list) else []
+    return care_plan
+
+
+def latest_care_plan(patient_id, visit_id=None, before=None, max_age_days=None, dynamodb=None):
+    """The care plan of the patient's most recent earlier visit that has one.
+
+    Returns (care plan, index entry of that visit), or (None, None). Any
+    read error is logged and treated as no history.
+    """
+    dynamodb = dynamodb or boto3.resource('dynamodb')
+    try:
+        visits = previous_visits(patient_id, visit_id, before, max_age_days=max_age_days, dynamodb=dynamodb)
+        data_table = dynamodb.Table(VISIT_DATA_TABLE)
+        for visit in visits:
+            # Earlier visits may be archived; this reads through to the archive
+            item = visit_archive.get_data_row(visit['visitID'], 'carePlan', data_table)
+            if item:
+                care_plan = parse_care_plan(item)
+                if any(care_plan.values()):
+                    return care_plan, visit
+    except Exception as e:
+        logger.warning("Could not read the patient's previous care plan: %s", e)
+    return None, None
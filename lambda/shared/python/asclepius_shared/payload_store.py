@@ -0,0 +1,147 @@
+"""Claim-check storage for large parts of the workflow state.
+
+Step Functions passes the whole state from state to state, and limits it
+to 256 KB. A handler that returns something large (the clinical summary,
+a visit item with its transcript) offloads it instead:
+
+    result = {"summary": payload_store.offload(summary), ...}
+
+offload() writes the value's JSON to PAYLOAD_BUCKET under a key made from
+its SHA-256 and returns a small reference in its place:
+
+    {"payloadRef": "s3://<bucket>/workflow-payloads/ab/ab12...json", "bytes": 18204}
+
+Handlers that read such a field call resolve(), which returns non-references
+unchanged, so inline values (from direct invocations, or below
+PAYLOAD_OFFLOAD_MIN_BYTES) keep working. Equal content has equal keys, so
+offloading it again is a no-op and retries never duplicate objects. Resolved
+and offloaded bodies are kept in a per-container LRU cache of
+PAYLOAD_CACHE_MAX_BYTES, so a warm container reads each payload once.
+
+Without PAYLOAD_BUCKET values are never offloaded.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+import boto3
+
+from asclepius_shared import log
+
+PAYLOAD_BUCKET = os.environ.get('PAYLOAD_BUCKET')
+PAYLOAD_PREFIX = 'workflow-payloads/'
+# Smaller values are cheaper to pass inline than to fetch
+OFFLOAD_MIN_BYTES = int(os.environ.get('PAYLOAD_OFFLOAD_MIN_BYTES', '2048'))
+CACHE_MAX_BYTES = int(os.environ.get('PAYLOAD_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+REF_KEY = 'payloadRef'
+
+logger = log.get_logger('payload-store')
+
+_s3_client = None
+
+
+def _s3():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+
+class _BodyCache:
+    """LRU cache of payload bodies by S3 location, bounded by total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, location):
+        with self._lock:
+            body = self._bodies.get(location)
+            if body is not None:
+                self._bodies.move_to_end(location)
+            return body
+
+    def put(self, location, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if location in self._bodies:
+                self._bodies.move_to_end(location)
+                return
+            self._bodies[location] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_cache = _BodyCache(CACHE_MAX_BYTES)
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def serialize(value):
+    """Canonical JSON of a value: the bytes that are stored and hashed."""
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, ensure_ascii=False,
+                      default=_default).encode('utf-8')
+
+
+def is_ref(value):
+    return isinstance(value, dict) and isinstance(value.get(REF_KEY), str)
+
+
+def _split(location):
+    bucket, _, key = location[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def offload(value, min_bytes=None):
+    """The value, or a reference to a stored copy if its JSON is at least min_bytes long.
+
+    A failed write is logged and the value is passed on inline.
+    """
+    if value is None or is_ref(value) or not PAYLOAD_BUCKET:
+        return value
+    body = serialize(value)
+    if len(body) < (OFFLOAD_MIN_BYTES if min_bytes is None else min_bytes):
+        return value
+    digest = hashlib.sha256(body).hexdigest()
+    key = f"{PAYLOAD_PREFIX}{digest[:2]}/{digest}.json"
+    location = f"s3://{PAYLOAD_BUCKET}/{key}"
+    # Anything in the cache is already stored
+    if _cache.get(location) is None:
+        try:
+            _s3().put_object(Bucket=PAYLOAD_BUCKET, Key=key, Body=body, ContentType='application/json')
+        except Exception as e:
+            logger.warning("Could not offload payload, passing it inline: %s", e, bytes=len(body))
+            return value
+        _cache.put(location, body)
+    logger.debug("Offloaded payload", payloadRef=location, bytes=len(body))
+    return {REF_KEY: location, 'bytes': len(body)}
+
+
+def resolve(value):
+    """The value a reference stands for; anything else is returned as it is."""
+    if not is_ref(value):
+        return value
+    location = value[REF_KEY]
+    body = _cache.get(location)
+    if body is None:
+        bucket, key = _split(location)
+        body = _s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+        expected = key.rsplit('/', 1)[-1].split('.', 1)[0]
+        if hashlib.sha256(body).hexdigest() != expected:
+            raise ValueError(f"Payload at {location} does not match its content hash")
+        _cache.put(location, body)
+    # A fresh copy each time: callers modify what they resolve
+    return json.loads(body)
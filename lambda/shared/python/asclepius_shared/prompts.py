@@ -0,0 +1,285 @@
+"""Compact, token-budgeted serialization of the data embedded in prompts.
+
+Prompts used to embed their data with ``json.dumps(..., indent=2)``. The
+agents embedded the whole Step Functions state, including Lambda response
+metadata. This module builds the prompt data instead:
+
+- serializes it without whitespace;
+- estimates its size in tokens;
+- fits it to a per-stage input-token budget by deterministically shortening
+  the longest fields (long sentences are cut at a sentence boundary, long
+  lists keep their first items);
+- reports how many tokens that saved against the old indented form.
+
+Nova's tokenizer is not published, so estimate_tokens approximates it with
+a sub-word count: punctuation is one token and words cost one token per
+four characters. The estimate is only used to compare against budgets and
+to report savings; billing still uses the counts Bedrock returns.
+"""
+import json
+import math
+import os
+import re
+
+from asclepius_shared import metrics, payload_store
+from asclepius_shared.experts import summary_for
+
+# Input-token budgets for the data part of each stage's prompt
+STAGE_TOKEN_BUDGETS = {
+    'generate-care-plan': int(os.environ.get('PROMPT_BUDGET_CARE_PLAN', '3000')),
+    'orchestrator': int(os.environ.get('PROMPT_BUDGET_ORCHESTRATOR', '2500')),
+    'agent': int(os.environ.get('PROMPT_BUDGET_AGENT', '3500')),
+    'patient-digest': int(os.environ.get('PROMPT_BUDGET_PATIENT_DIGEST', '2000')),
+}
+
+# A field is never shortened below this many tokens
+MIN_FIELD_TOKENS = 40
+
+CHARS_PER_TOKEN = 4
+
+TRUNCATION_MARKER = ' [truncated]'
+OMITTED_MARKER_TOKENS = 8
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_END = re.compile(r"[.!?;]\s")
+_OMITTED = re.compile(r"\[(\d+) more omitted\]")
+
+
+def compact_json(data):
+    """JSON with no insignificant whitespace and unescaped non-ASCII text."""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+def estimate_tokens(text):
+    """Approximate model token count of text."""
+    if not text:
+        return 0
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        count += math.ceil(len(piece) / CHARS_PER_TOKEN) if len(piece) > 1 else 1
+    return count
+
+
+def _value_tokens(value):
+    if isinstance(value, str):
+        return estimate_tokens(value)
+    return estimate_tokens(compact_json(value))
+
+
+def _truncate_text(text, max_tokens):
+    """Cut text to about max_tokens, preferring the last sentence boundary."""
+    if text.endswith(TRUNCATION_MARKER):
+        text = text[:-len(TRUNCATION_MARKER)]
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max_tokens * CHARS_PER_TOKEN
+    cut = text[:limit]
+    # Dense text (numbers, punctuation) costs more than CHARS_PER_TOKEN allows
+    for _ in range(3):
+        tokens = estimate_tokens(cut)
+        if tokens <= max_tokens:
+            break
+        limit = int(limit * max_tokens / tokens)
+        cut = text[:limit]
+    boundaries = [m.end() for m in _SENTENCE_END.finditer(cut)]
+    # Only back up to a sentence end if that keeps most of the allowance
+    if boundaries and boundaries[-1] >= limit // 2:
+        cut = cut[:boundaries[-1]]
+    return cut.rstrip() + TRUNCATION_MARKER
+
+
+def _truncate_list(items, max_tokens):
+    """Keep leading items within max_tokens and note how many were dropped."""
+    already_omitted = 0
+    if items and isinstance(items[-1], str):
+        match = _OMITTED.fullmatch(items[-1])
+        if match:
+            items = items[:-1]
+            already_omitted = int(match.group(1))
+    kept = []
+    # Room for the omitted-items marker
+    used = OMITTED_MARKER_TOKENS
+    for item in items:
+        # Item plus its separator, and its quotes if it is a string
+        cost = _value_tokens(item) + (3 if isinstance(item, str) else 1)
+        if used + cost > max_tokens:
+            # Keep the start of the item that overflows if there is room for it
+            if isinstance(item, str) and (not kept or max_tokens - used >= MIN_FIELD_TOKENS):
+                kept.append(_truncate_text(item, max(MIN_FIELD_TOKENS, max_tokens - used)))
+            break
+        kept.append(item)
+        used += cost
+    omitted = len(items) - len(kept) + already_omitted
+    if omitted:
+        kept.append(f"[{omitted} more omitted]")
+    return kept
+
+
+def _fields(data, path=()):
+    """Yield (path, value) for every string and list that could be shortened.
+
+    Lists are shortened as a whole by dropping trailing items.
+    """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from _fields(value, path + (key,))
+    elif isinstance(data, (list, str)):
+        yield path, data
+
+
+def _water_level(sizes, excess):
+    """Largest size cap that removes at least excess tokens across sizes."""
+    low, high = 0, max(sizes)
+    while low < high:
+        level = (low + high + 1) // 2
+        if sum(size - level for size in sizes if size > level) >= excess:
+            low = level
+        else:
+            high = level - 1
+    return low
+
+
+def _replace(data, path, value):
+    if not path:
+        return value
+    container = data
+    for key in path[:-1]:
+        container = container[key]
+    container[path[-1]] = value
+    return data
+
+
+class PromptData:
+    """Serialized prompt data and what it cost against the indented original."""
+
+    def __init__(self, text, tokens, original_tokens, truncated_fields):
+        self.text = text
+        self.tokens = tokens
+        self.original_tokens = original_tokens
+        self.truncated_fields = truncated_fields
+
+    @property
+    def tokens_saved(self):
+        return self.original_tokens - self.tokens
+
+    def report(self, stage, visit_id=None, expert=None):
+        """Emit token counts for the prompt data as metrics."""
+        return metrics.emit(
+            {
+                'PromptDataTokens': (self.tokens, 'Count'),
+                'PromptTokensSaved': (self.tokens_saved, 'Count'),
+                'PromptFieldsTruncated': (len(self.truncated_fields), 'Count'),
+            },
+            {'Stage': stage, 'Expert': expert},
+            {'visitId': visit_id, 'truncatedFields': self.truncated_fields},
+        )
+
+
+def fit_to_budget(data, max_tokens):
+    """Return (copy of data within max_tokens, list of shortened field paths).
+
+    Caps every field at a common size chosen so the caps together remove
+    the excess, so over-long sections are levelled down together rather
+    than one of them absorbing the whole cut. Fields at or under the cap
+    are untouched and no field is cut below MIN_FIELD_TOKENS, so the same
+    input always gives the same output.
+    """
+    data = json.loads(json.dumps(data))
+    truncated = []
+    total = _value_tokens(data)
+    # Estimates of a cut field can differ slightly from the target; retry a few times
+    for _ in range(4):
+        if total <= max_tokens:
+            break
+        fields = [(path, value, _value_tokens(value)) for path, value in _fields(data)]
+        fields = [field for field in fields if field[2] > MIN_FIELD_TOKENS]
+        if not fields:
+            break
+        level = max(MIN_FIELD_TOKENS, _water_level([field[2] for field in fields], total - max_tokens))
+        changed = False
+        for path, value, size in fields:
+            if size <= level:
+                continue
+            if isinstance(value, str):
+                shortened = _truncate_text(value, level)
+            else:
+                shortened = _truncate_list(value, level)
+            if _value_tokens(shortened) >= size:
+                continue
+            data = _replace(data, path, shortened)
+            changed = True
+            label = '.'.join(str(key) for key in path) or '$'
+            if label not in truncated:
+                truncated.append(label)
+        if not changed:
+            break
+        total = _value_tokens(data)
+    return data, truncated
+
+
+def prepare(data, stage, max_tokens=None, original=None):
+    """Fit data to the stage's budget and serialize it compactly.
+
+    Savings are measured against original (default: data) serialized the
+    old way, with indent=2.
+    """
+    if max_tokens is None:
+        max_tokens = STAGE_TOKEN_BUDGETS.get(stage, STAGE_TOKEN_BUDGETS['agent'])
+    original_tokens = estimate_tokens(json.dumps(data if original is None else original, indent=2))
+    fitted, truncated = fit_to_budget(data, max_tokens)
+    text = compact_json(fitted)
+    return PromptData(text, estimate_tokens(text), original_tokens, truncated)
+
+
+def prepare_sections(sections, stage, max_tokens=None):
+    """Fit a dict of section name -> list of lines to the budget.
+
+    Returns ({name: text joined with newlines}, PromptData) for templates
+    that lay the sections out as prose rather than JSON.
+    """
+    if max_tokens is None:
+        max_tokens = STAGE_TOKEN_BUDGETS.get(stage, STAGE_TOKEN_BUDGETS['agent'])
+    original_tokens = sum(estimate_tokens('\n'.join(lines)) for lines in sections.values())
+    fitted, truncated = fit_to_budget(sections, max_tokens)
+    joined = {name: '\n'.join(str(line) for line in lines) for name, lines in fitted.items()}
+    tokens = sum(estimate_tokens(text) for text in joined.values())
+    return joined, PromptData(compact_json(joined), tokens, original_tokens, truncated)
+
+
+def agent_context(event, experts=None):
+    """The clinical data an expert agent needs from its Step Functions input.
+
+    Agents receive the whole workflow state under originalData. That includes
+    bucket names and budgets, none of which helps the model. This keeps the
+    orchestrator's reasons for this expert, the clinical summary, verified
+    ICD-10 codes, the care plan and the patient's history digest, resolving
+    the ones passed as payload_store references. With experts, the summary
+    is cut to the fields those experts are given.
+    """
+    original = event.get('originalData') or {}
+    context = {}
+    expert = event.get('expert')
+    if isinstance(expert, dict) and expert.get('reasons'):
+        context['consultReasons'] = expert['reasons']
+
+    def payload(key):
+        result = original.get(key)
+        return result.get('Payload') if isinstance(result, dict) else None
+
+    # Verification runs alongside care-plan generation, so agents usually
+    # see the processed summary rather than the ICD-10 result
+    processed = payload('icd10Result') or payload('summaryResult') or {}
+    if processed.get('summary'):
+        summary = payload_store.resolve(processed['summary'])
+        context['clinicalSummary'] = summary_for(summary, experts) if experts else summary
+    if processed.get('verifiedCodes'):
+        context['verifiedCodes'] = processed['verifiedCodes']
+    care_plan_result = payload('carePlanResult') or {}
+    care_plan = dict(care_plan_result.get('carePlan') or {})
+    care_plan.pop('visitId', None)
+    if care_plan:
+        context['carePlan'] = care_plan
+    if care_plan_result.get('patientHistory'):
+        context['patientHistory'] = payload_store.resolve(care_plan_result['patientHistory'])
+    # Fall back to the raw input if it is not shaped like the workflow state
+    return context or event
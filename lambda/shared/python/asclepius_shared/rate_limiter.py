@@ -0,0 +1,222 @@
+"""Distributed adaptive token bucket for Bedrock calls.
+
+Every function that calls Bedrock acquires a token from a bucket shared
+across all Lambda containers before invoking the model. The refill rate
+adapts with AIMD: it grows additively after each clean call and is cut
+multiplicatively when Bedrock throttles, at most once per cooldown window
+so a burst of throttles from concurrent containers counts as one signal.
+
+Bucket state lives in one DynamoDB item per bucket (RATE_LIMIT_TABLE,
+partition key ``bucketId``) and is updated with compare-and-set writes.
+LocalBucketStore is an in-process stand-in with the same interface, used
+when no table is configured.
+"""
+import os
+import threading
+import time
+from decimal import Decimal
+
+import boto3
+from botocore.exceptions import ClientError
+
+from asclepius_shared import log
+
+logger = log.get_logger('rate-limiter')
+
+DEFAULT_RATE = float(os.environ.get('BEDROCK_RATE_LIMIT', '5'))
+DEFAULT_MIN_RATE = float(os.environ.get('BEDROCK_RATE_LIMIT_MIN', '0.5'))
+DEFAULT_MAX_RATE = float(os.environ.get('BEDROCK_RATE_LIMIT_MAX', '20'))
+DEFAULT_BURST = float(os.environ.get('BEDROCK_RATE_LIMIT_BURST', '10'))
+DEFAULT_MAX_WAIT = float(os.environ.get('BEDROCK_RATE_LIMIT_MAX_WAIT', '30'))
+
+# Attempts at a compare-and-set before giving up on a contended update
+MAX_CAS_ATTEMPTS = 8
+
+# Shortest sleep while waiting for a token; avoids spinning on float rounding
+MIN_SLEEP = 0.01
+
+
+class LocalBucketStore:
+    """In-memory bucket store for local runs and single-container use."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, bucket_id):
+        with self._lock:
+            item = self._items.get(bucket_id)
+            return dict(item) if item else None
+
+    def put_if_unchanged(self, bucket_id, state, expected):
+        """Store state only if the current item still equals expected (None = absent)."""
+        with self._lock:
+            if self._items.get(bucket_id) != expected:
+                return False
+            self._items[bucket_id] = dict(state)
+            return True
+
+
+class DynamoDBBucketStore:
+    """Bucket store backed by a DynamoDB table keyed on bucketId."""
+
+    FIELDS = ('tokens', 'updatedAt', 'rate', 'lastDecrease')
+
+    def __init__(self, table_name, dynamodb=None):
+        self.table = (dynamodb or boto3.resource('dynamodb')).Table(table_name)
+
+    def get(self, bucket_id):
+        item = self.table.get_item(Key={'bucketId': bucket_id}, ConsistentRead=True).get('Item')
+        if not item:
+            return None
+        return {field: float(item[field]) for field in self.FIELDS if field in item}
+
+    def put_if_unchanged(self, bucket_id, state, expected):
+        item = {'bucketId': bucket_id}
+        item.update({field: Decimal(repr(value)) for field, value in state.items()})
+        if expected is None:
+            condition = 'attribute_not_exists(bucketId)'
+            values = None
+        else:
+            # updatedAt and rate change on every write, so they identify the version
+            condition = 'updatedAt = :updatedAt AND rate = :rate'
+            values = {
+                ':updatedAt': Decimal(repr(expected['updatedAt'])),
+                ':rate': Decimal(repr(expected['rate'])),
+            }
+        try:
+            if values:
+                self.table.put_item(Item=item, ConditionExpression=condition,
+                                    ExpressionAttributeValues=values)
+            else:
+                self.table.put_item(Item=item, ConditionExpression=condition)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate follows additive-increase/multiplicative-decrease."""
+
+    def __init__(self, store, bucket_id, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE,
+                 max_rate=DEFAULT_MAX_RATE, burst=DEFAULT_BURST, increase=0.1,
+                 decrease_factor=0.5, cooldown=2.0, clock=time.time, sleep=time.sleep):
+        self.store = store
+        self.bucket_id = bucket_id
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+
+    def _refilled(self, state, now):
+        """Return (stored state or None, working state, tokens available at now)."""
+        if state is None:
+            state = {'tokens': self.burst, 'updatedAt': now, 'rate': self.initial_rate, 'lastDecrease': 0.0}
+            return None, state, self.burst
+        elapsed = max(0.0, now - state['updatedAt'])
+        return state, state, min(self.burst, state['tokens'] + elapsed * state['rate'])
+
+    def acquire(self, tokens=1, max_wait=DEFAULT_MAX_WAIT):
+        """Take tokens from the bucket, sleeping until they are available.
+
+        Returns the seconds spent waiting. If tokens are still unavailable
+        after max_wait the call proceeds anyway (fail open): the limiter
+        shapes traffic but must never be the reason a visit loses a result.
+        """
+        started = self.clock()
+        while True:
+            now = self.clock()
+            for _ in range(MAX_CAS_ATTEMPTS):
+                expected, state, available = self._refilled(self.store.get(self.bucket_id), now)
+                if available < tokens:
+                    break
+                new_state = dict(state, tokens=available - tokens, updatedAt=now)
+                if self.store.put_if_unchanged(self.bucket_id, new_state, expected):
+                    return now - started
+                now = self.clock()
+            else:
+                # Heavy contention; back off briefly before re-reading
+                waited = self.clock() - started
+                if waited >= max_wait:
+                    logger.warning("Rate limiter %s: contended for %.1fs, proceeding", self.bucket_id, waited)
+                    return waited
+                self.sleep(0.05)
+                continue
+
+            waited = now - started
+            if waited >= max_wait:
+                logger.warning("Rate limiter %s: no token after %.1fs, proceeding", self.bucket_id, waited)
+                return waited
+            shortfall = (tokens - available) / max(state['rate'], self.min_rate)
+            self.sleep(max(MIN_SLEEP, min(shortfall, max_wait - waited)))
+
+    def available(self):
+        """Return (tokens available now, current refill rate) without taking any."""
+        _, state, tokens = self._refilled(self.store.get(self.bucket_id), self.clock())
+        return tokens, state['rate']
+
+    def try_acquire(self, tokens=1):
+        """Take tokens only if they are available right now; never waits."""
+        for _ in range(MAX_CAS_ATTEMPTS):
+            now = self.clock()
+            expected, state, available = self._refilled(self.store.get(self.bucket_id), now)
+            if available < tokens:
+                return False
+            new_state = dict(state, tokens=available - tokens, updatedAt=now)
+            if self.store.put_if_unchanged(self.bucket_id, new_state, expected):
+                return True
+        return False
+
+    def _adjust(self, update):
+        for _ in range(MAX_CAS_ATTEMPTS):
+            now = self.clock()
+            expected, state, available = self._refilled(self.store.get(self.bucket_id), now)
+            new_state = update(dict(state, tokens=available, updatedAt=now), now)
+            if new_state is None:
+                return
+            if self.store.put_if_unchanged(self.bucket_id, new_state, expected):
+                return
+
+    def on_success(self):
+        """Additive increase after a call that completed without throttling."""
+        def update(state, now):
+            if state['rate'] >= self.max_rate:
+                return None
+            return dict(state, rate=min(self.max_rate, state['rate'] + self.increase))
+        self._adjust(update)
+
+    def on_throttle(self):
+        """Multiplicative decrease, at most once per cooldown window."""
+        def update(state, now):
+            if now - state['lastDecrease'] < self.cooldown:
+                return None
+            rate = max(self.min_rate, state['rate'] * self.decrease_factor)
+            logger.warning("Rate limiter %s: throttled, rate %.2f -> %.2f/s", self.bucket_id, state['rate'], rate)
+            # Drain the bucket so in-flight bursts do not immediately re-throttle
+            return dict(state, rate=rate, tokens=0.0, lastDecrease=now)
+        self._adjust(update)
+
+
+_limiters = {}
+_local_store = LocalBucketStore()
+
+
+def get_limiter(bucket_id):
+    """Return the process-wide limiter for a bucket (one bucket per model ID).
+
+    Uses the shared DynamoDB table when RATE_LIMIT_TABLE is set, otherwise
+    the in-process stand-in.
+    """
+    limiter = _limiters.get(bucket_id)
+    if limiter is None:
+        table_name = os.environ.get('RATE_LIMIT_TABLE')
+        store = DynamoDBBucketStore(table_name) if table_name else _local_store
+        limiter = _limiters[bucket_id] = AdaptiveRateLimiter(store, bucket_id)
+    return limiter
@@ -0,0 +1,287 @@
+"""Approximate-match cache of expert routing for near-duplicate care plans.
+
+Routine visits (a T2DM + HTN follow-up, say) produce care plans that differ
+mostly in wording, and each one paid for a full routing call. The
+orchestrator looks a care plan up here first:
+
+- Signature: a MinHash of the care plan's word shingles (single words and
+  adjacent pairs, without numbers or stop words). The fraction of equal
+  positions in two signatures estimates the Jaccard similarity of the
+  plans' shingle sets.
+- Index: the signature is split into BANDS bands (locality-sensitive
+  hashing). Each band hashes to one bucket item in the store holding the
+  last plan routed into that bucket, so a lookup is one batch read of
+  BANDS keys, and plans sharing any band are candidates.
+- Confidence: a candidate's routing is reused only if its estimated
+  similarity is at least ROUTING_CACHE_THRESHOLD.
+- Drift: a fraction ROUTING_CACHE_SPOT_CHECK_RATE of hits still call the
+  model. How well the cached routing agrees is reported, and the fresh
+  routing replaces the cached one, so changes in the model or in the
+  plans show up in the metrics and correct the cache.
+
+Entries hold only which experts were needed. The model's reasons are about
+the visit they were written for, often naming its patient's details, so a
+hit gives every needed expert the neutral CACHED_REASON instead.
+
+Entries live in ROUTING_CACHE_TABLE (partition key ``bucketId``) and expire
+after ROUTING_CACHE_TTL_DAYS. LocalRoutingStore is an in-process stand-in
+with the same interface, used when no table is configured.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+
+import boto3
+
+from asclepius_shared import log, metrics
+from asclepius_shared.experts import needed_experts, validate_routing
+
+logger = log.get_logger('routing-cache')
+
+ENABLED = os.environ.get('ROUTING_CACHE_ENABLED', 'true').lower() == 'true'
+THRESHOLD = float(os.environ.get('ROUTING_CACHE_THRESHOLD', '0.85'))
+SPOT_CHECK_RATE = float(os.environ.get('ROUTING_CACHE_SPOT_CHECK_RATE', '0.05'))
+TTL_DAYS = float(os.environ.get('ROUTING_CACHE_TTL_DAYS', '30'))
+
+# 16 bands of 4: plans at similarity 0.85 share a band with probability > 0.999, at 0.5 about 0.64
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+
+# Part of every bucket key; change it when the signature or entry format changes so old entries are never read
+SIGNATURE_VERSION = 'v2'
+
+# The reason each needed expert gets on a hit, in place of reasons written about another visit
+CACHED_REASON = "Routed by similarity to a previously routed care plan"
+
+# Care-plan keys that are not clinical content
+IGNORED_KEYS = {'visitId', 'requiredExperts'}
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'if', 'in', 'into', 'is',
+    'it', 'its', 'of', 'on', 'or', 'patient', 'patients', 'per', 'should', 'that', 'the', 'their', 'this',
+    'to', 'with', 'will',
+}
+
+_WORD = re.compile(r"[a-z][a-z0-9]*")
+_PRIME = (1 << 61) - 1
+# Fixed seed: signatures must be comparable across containers and deployments
+_rng = random.Random(20240611)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+
+def _text(value):
+    if isinstance(value, dict):
+        return ' '.join(_text(inner) for key, inner in value.items() if key not in IGNORED_KEYS)
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_text(inner) for inner in value)
+    return str(value or '')
+
+
+def shingles(care_plan):
+    """Words and adjacent word pairs of a care plan, without numbers or stop words."""
+    words = [word for word in _WORD.findall(_text(care_plan).lower()) if word not in STOP_WORDS]
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+def signature(care_plan):
+    """MinHash signature of a care plan: NUM_HASHES ints, or None if it has no text."""
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+              for shingle in shingles(care_plan)]
+    if not hashes:
+        return None
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(1 for x, y in zip(first, second) if x == y) / NUM_HASHES
+
+
+def bucket_ids(sig):
+    ids = []
+    for band in range(BANDS):
+        rows = struct.pack(f'>{ROWS}Q', *sig[band * ROWS:(band + 1) * ROWS])
+        ids.append(f"{SIGNATURE_VERSION}:{band:02d}:{hashlib.sha1(rows).hexdigest()[:16]}")
+    return ids
+
+
+def pack(sig):
+    return struct.pack(f'>{NUM_HASHES}Q', *sig)
+
+
+def unpack(data):
+    return list(struct.unpack(f'>{NUM_HASHES}Q', bytes(data)))
+
+
+class LocalRoutingStore:
+    """In-memory bucket store for local runs and single-container use."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, bucket_ids):
+        now = time.time()
+        with self._lock:
+            return [dict(self._items[bucket_id]) for bucket_id in bucket_ids
+                    if bucket_id in self._items and self._items[bucket_id]['expiresAt'] > now]
+
+    def put_many(self, bucket_ids, entry):
+        with self._lock:
+            for bucket_id in bucket_ids:
+                self._items[bucket_id] = dict(entry, bucketId=bucket_id)
+
+
+class DynamoDBRoutingStore:
+    """Bucket store backed by a DynamoDB table keyed on bucketId, with TTL on expiresAt."""
+
+    def __init__(self, table_name, dynamodb=None):
+        self.dynamodb = dynamodb or boto3.resource('dynamodb')
+        self.table_name = table_name
+        self.table = self.dynamodb.Table(table_name)
+
+    def get_many(self, bucket_ids):
+        now = time.time()
+        request = {self.table_name: {'Keys': [{'bucketId': bucket_id} for bucket_id in bucket_ids]}}
+        items = []
+        # Bounded retries of unprocessed keys; a partial read only lowers the hit rate
+        for _ in range(3):
+            response = self.dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(self.table_name, []))
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+        # TTL deletion lags expiry, so expired items can still be returned
+        return [item for item in items if float(item['expiresAt']) > now]
+
+    def put_many(self, bucket_ids, entry):
+        with self.table.batch_writer() as batch:
+            for bucket_id in bucket_ids:
+                batch.put_item(Item=dict(entry, bucketId=bucket_id))
+
+
+class Lookup:
+    """Result of looking a care plan up: its signature, and the cached routing on a hit."""
+
+    def __init__(self, sig, buckets, routing=None, score=0.0, source_visit_id=None, spot_check=False):
+        self.signature = sig
+        self.buckets = buckets
+        self.routing = routing
+        self.score = score
+        self.source_visit_id = source_visit_id
+        self.spot_check = spot_check
+
+    @property
+    def hit(self):
+        return self.routing is not None
+
+
+_store = None
+
+
+def get_store():
+    """The process-wide store: the shared table when ROUTING_CACHE_TABLE is set, otherwise in-process."""
+    global _store
+    if _store is None:
+        table_name = os.environ.get('ROUTING_CACHE_TABLE')
+        _store = DynamoDBRoutingStore(table_name) if table_name else LocalRoutingStore()
+    return _store
+
+
+def routing_from_flags(flags):
+    """Routing in the orchestrator's shape from a cached entry's {expert: needed}, or None if unusable."""
+    if not isinstance(flags, dict):
+        return None
+    return validate_routing({
+        key: {"needed": needed, "reasons": [CACHED_REASON] if needed is True else []}
+        for key, needed in flags.items()
+    })
+
+
+def lookup(care_plan, visit_id=None, store=None):
+    """Look a care plan up; returns a Lookup, or None if the cache is off or the plan has no text.
+
+    The caller uses lookup.routing on a hit unless lookup.spot_check is set,
+    and passes the lookup to record() whenever it routes with the model.
+    """
+    if not ENABLED:
+        return None
+    started = time.time()
+    sig = signature(care_plan)
+    if sig is None:
+        return None
+    buckets = bucket_ids(sig)
+    result = Lookup(sig, buckets)
+    try:
+        candidates = (store or get_store()).get_many(buckets)
+    except Exception as e:
+        logger.warning("Routing cache lookup failed: %s", e)
+        candidates = []
+
+    best, best_score = None, 0.0
+    for item in candidates:
+        score = similarity(sig, unpack(item['signature']))
+        if score > best_score:
+            best, best_score = item, score
+    result.score = best_score
+    if best is not None and best_score >= THRESHOLD:
+        # A fresh copy: callers adjust routing in place
+        result.routing = routing_from_flags(json.loads(best['requiredExperts']))
+        result.source_visit_id = best.get('visitId')
+        result.spot_check = result.hit and random.random() < SPOT_CHECK_RATE
+
+    values = {
+        'RoutingCacheHit': (1 if result.hit else 0, 'Count'),
+        'RoutingCacheLookupTime': ((time.time() - started) * 1000, 'Milliseconds'),
+        'RoutingCacheCandidates': (len(candidates), 'Count'),
+    }
+    if candidates:
+        values['RoutingCacheSimilarity'] = (best_score, 'None')
+    metrics.emit(values, {'Stage': 'orchestrator'}, {'visitId': visit_id, 'sourceVisitId': result.source_visit_id})
+    logger.info("Routing cache %s", 'hit' if result.hit else 'miss', similarity=round(best_score, 3),
+                candidates=len(candidates), spotCheck=result.spot_check, sourceVisitId=result.source_visit_id)
+    return result
+
+
+def record(result, routing, visit_id=None, store=None):
+    """Cache the model's routing for a looked-up care plan, reporting agreement if it was a spot check."""
+    if result is None:
+        return
+    routing = validate_routing(routing)
+    if routing is None:
+        return
+
+    if result.hit:
+        cached = set(needed_experts(result.routing))
+        fresh = set(needed_experts(routing))
+        mismatched = sorted(cached ^ fresh)
+        metrics.emit(
+            {
+                'RoutingCacheSpotCheckAgreement': (0 if mismatched else 1, 'Count'),
+                'RoutingCacheSpotCheckMismatches': (len(mismatched), 'Count'),
+            },
+            {'Stage': 'orchestrator'},
+            {'visitId': visit_id, 'sourceVisitId': result.source_visit_id, 'similarity': result.score},
+        )
+        if mismatched:
+            logger.warning("Cached routing disagrees with the model", mismatched=mismatched,
+                           similarity=round(result.score, 3), sourceVisitId=result.source_visit_id)
+
+    entry = {
+        'signature': pack(result.signature),
+        # Only the needed flags: the reasons describe this visit's patient
+        'requiredExperts': json.dumps({key: entry['needed'] for key, entry in routing.items()}),
+        'visitId': visit_id,
+        'createdAt': int(time.time() * 1000),
+        'expiresAt': int(time.time() + TTL_DAYS * 24 * 3600),
+    }
+    try:
+        (store or get_store()).put_many(result.buckets, {key: value for key, value in entry.items() if value is not None})
+    except Exception as e:
+        logger.warning("Could not store routing in the cache: %s", e)
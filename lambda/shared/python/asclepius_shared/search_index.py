@@ -0,0 +1,613 @@
+"""Full-text search over visit transcripts and summaries.
+
+The index is a set of immutable segments in SEARCH_INDEX_BUCKET:
+
+    segments/<segmentId>/shard-NNN.bin    inverted index of the terms that hash to shard NNN
+    segments/<segmentId>/meta.json.gz     the segment's documents: visitId, date, patientId, indexedAt
+
+asclepius-search-index writes a one-shard segment for each visit the DB
+writer stores. It then merges segments of similar size into larger ones of
+SEARCH_INDEX_SHARDS shards, MERGE_FACTOR at a time, so each query reads a
+few segments. A segment becomes visible when its meta object is written
+(last) and disappears when it is deleted (first). A visit indexed again
+appears in a newer segment. Its document with the latest indexedAt is
+current, and the postings of older copies are ignored.
+
+A shard is zlib-compressed. It holds the term count, then each term in
+sorted order with its posting list. A posting list holds the number of
+documents and, for each document, the delta of its ordinal in the
+segment, the number of positions and the position deltas. All numbers are
+varints. Positions count tokens through the transcript messages and
+summary sections, with a gap between texts so phrases never match across
+two of them.
+
+search() evaluates queries such as
+
+    "chest pain" metformin
+    (metformin OR insulin) AND NOT hypertension
+    "chest pain" -hypertension
+
+Terms are combined with AND by default. OR, NOT (or a leading -), quoted
+phrases and parentheses are supported, and results can be limited to a
+date range. Segments never change, so their metadata and parsed shards are
+cached per container, and the segment list is refreshed every
+SEARCH_SEGMENT_LIST_TTL_SECONDS.
+"""
+import gzip
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from asclepius_shared import log
+
+SEARCH_INDEX_BUCKET = os.environ.get('SEARCH_INDEX_BUCKET')
+SEGMENT_PREFIX = 'segments/'
+SHARDS = int(os.environ.get('SEARCH_INDEX_SHARDS', '16'))
+MERGE_FACTOR = int(os.environ.get('SEARCH_INDEX_MERGE_FACTOR', '10'))
+# Segments of at least this many documents are not merged further
+MAX_MERGE_DOCS = int(os.environ.get('SEARCH_INDEX_MAX_MERGE_DOCS', '5000'))
+SEGMENT_LIST_TTL_SECONDS = float(os.environ.get('SEARCH_SEGMENT_LIST_TTL_SECONDS', '10'))
+CACHE_MAX_BYTES = int(os.environ.get('SEARCH_INDEX_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+
+FORMAT_VERSION = 1
+META_NAME = 'meta.json.gz'
+# Positions skipped between texts, so a phrase never spans two messages or sections
+POSITION_GAP = 8
+FETCH_WORKERS = 16
+
+# finalSummary attributes that are not summary text
+SUMMARY_METADATA = {'visitId', 'dataCategory', 'timestamp', 'editedAt'}
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:['.][a-z0-9]+)*")
+_QUERY_TOKEN = re.compile(r'"([^"]*)"?|(\()|(\))|([^\s()"]+)')
+
+logger = log.get_logger('search-index')
+
+_s3_client = None
+
+
+def _s3():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+
+class QueryError(ValueError):
+    """Raised for a query that cannot be parsed."""
+
+
+def tokenize(text):
+    """Lower-cased word tokens of a text; codes like E11.9 stay one token."""
+    return _TOKEN.findall(str(text).lower())
+
+
+def _strings(value):
+    if isinstance(value, str):
+        # Attributes the workflow stored with States.JsonToString
+        if value[:1] in '[{"':
+            try:
+                yield from _strings(json.loads(value))
+                return
+            except ValueError:
+                pass
+        yield value
+    elif isinstance(value, list):
+        for entry in value:
+            yield from _strings(entry)
+    elif isinstance(value, dict):
+        for entry in value.values():
+            yield from _strings(entry)
+
+
+def visit_texts(visit, summary):
+    """The texts of a visit that are indexed: each transcript message, then each summary entry."""
+    texts = [entry.get('message') for entry in (visit or {}).get('conversation') or []
+             if isinstance(entry, dict) and entry.get('message')]
+    for section, value in (summary or {}).items():
+        if section not in SUMMARY_METADATA:
+            texts.extend(_strings(value))
+    return texts
+
+
+def document_terms(texts):
+    """{term: [positions]} of a document made of several texts."""
+    positions = defaultdict(list)
+    position = 0
+    for text in texts:
+        for token in tokenize(text):
+            positions[token].append(position)
+            position += 1
+        position += POSITION_GAP
+    return positions
+
+
+def _put_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_postings(postings):
+    """Posting list bytes of [(ordinal, positions)] in ordinal order."""
+    out = bytearray()
+    _put_varint(out, len(postings))
+    previous = 0
+    for ordinal, positions in postings:
+        _put_varint(out, ordinal - previous)
+        previous = ordinal
+        _put_varint(out, len(positions))
+        last = 0
+        for position in positions:
+            _put_varint(out, position - last)
+            last = position
+    return bytes(out)
+
+
+def decode_postings(data):
+    """{ordinal: [positions]} of a posting list."""
+    count, offset = _get_varint(data, 0)
+    postings = {}
+    ordinal = 0
+    for _ in range(count):
+        delta, offset = _get_varint(data, offset)
+        ordinal += delta
+        length, offset = _get_varint(data, offset)
+        positions = []
+        position = 0
+        for _ in range(length):
+            delta, offset = _get_varint(data, offset)
+            position += delta
+            positions.append(position)
+        postings[ordinal] = positions
+    return postings
+
+
+def shard_of(term, shards):
+    return zlib.crc32(term.encode('utf-8')) % shards
+
+
+def encode_shard(terms):
+    """Compressed shard of {term: posting list bytes}."""
+    out = bytearray()
+    _put_varint(out, len(terms))
+    for term in sorted(terms):
+        raw = term.encode('utf-8')
+        _put_varint(out, len(raw))
+        out += raw
+        _put_varint(out, len(terms[term]))
+        out += terms[term]
+    return zlib.compress(bytes(out), 6)
+
+
+def decode_shard(body):
+    """{term: posting list bytes} of a compressed shard."""
+    data = zlib.decompress(body)
+    count, offset = _get_varint(data, 0)
+    terms = {}
+    for _ in range(count):
+        length, offset = _get_varint(data, offset)
+        term = data[offset:offset + length].decode('utf-8')
+        offset += length
+        length, offset = _get_varint(data, offset)
+        terms[term] = data[offset:offset + length]
+        offset += length
+    return terms
+
+
+def new_segment_id():
+    """Segment IDs sort by creation time."""
+    return f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+
+def _key(segment_id, name):
+    return f"{SEGMENT_PREFIX}{segment_id}/{name}"
+
+
+def _shard_name(shard):
+    return f"shard-{shard:03d}.bin"
+
+
+def write_segment(docs, shard_terms, shards, s3=None):
+    """Store a segment: docs are its document metadata by ordinal, shard_terms {shard: {term: postings}}."""
+    s3 = s3 or _s3()
+    segment_id = new_segment_id()
+    written = sorted(shard for shard, terms in shard_terms.items() if terms)
+    size = 0
+    for shard in written:
+        body = encode_shard(shard_terms[shard])
+        size += len(body)
+        s3.put_object(Bucket=SEARCH_INDEX_BUCKET, Key=_key(segment_id, _shard_name(shard)), Body=body)
+    meta = {
+        'version': FORMAT_VERSION,
+        'segmentId': segment_id,
+        'shards': shards,
+        'shardIds': written,
+        'terms': sum(len(shard_terms[shard]) for shard in written),
+        'bytes': size,
+        'docs': docs,
+    }
+    # Written last: the segment is not visible until its shards are all in place
+    s3.put_object(Bucket=SEARCH_INDEX_BUCKET, Key=_key(segment_id, META_NAME),
+                  Body=gzip.compress(json.dumps(meta, separators=(',', ':')).encode('utf-8'), mtime=0),
+                  ContentType='application/json', ContentEncoding='gzip')
+    return meta
+
+
+def index_document(doc, terms, s3=None):
+    """Store one document, {term: positions}, as a one-shard segment."""
+    postings = {term: encode_postings([(0, positions)]) for term, positions in terms.items()}
+    return write_segment([doc], {0: postings}, 1, s3)
+
+
+def list_segment_ids(s3=None):
+    """IDs of the visible segments, oldest first."""
+    s3 = s3 or _s3()
+    ids = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=SEARCH_INDEX_BUCKET, Prefix=SEGMENT_PREFIX):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('/' + META_NAME):
+                ids.append(obj['Key'][len(SEGMENT_PREFIX):-len(META_NAME) - 1])
+    return sorted(ids)
+
+
+def delete_segment(meta, s3=None):
+    """Remove a segment, its meta object first so no new reader picks it up."""
+    s3 = s3 or _s3()
+    segment_id = meta['segmentId']
+    s3.delete_object(Bucket=SEARCH_INDEX_BUCKET, Key=_key(segment_id, META_NAME))
+    keys = [_key(segment_id, _shard_name(shard)) for shard in meta['shardIds']]
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=SEARCH_INDEX_BUCKET, Delete={
+            'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+            'Quiet': True
+        })
+
+
+class _Cache:
+    """LRU cache bounded by the approximate size of its values."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._values = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            self._values.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._values:
+                return
+            self._values[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._values.popitem(last=False)
+                self._size -= evicted
+
+
+_cache = _Cache(CACHE_MAX_BYTES)
+_segment_list = {'ids': None, 'expires': 0.0}
+_segment_list_lock = threading.Lock()
+
+
+def load_meta(segment_id, s3=None):
+    """A segment's metadata, or None if the segment has been deleted."""
+    key = ('meta', segment_id)
+    meta = _cache.get(key)
+    if meta is None:
+        try:
+            body = (s3 or _s3()).get_object(Bucket=SEARCH_INDEX_BUCKET, Key=_key(segment_id, META_NAME))['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        meta = json.loads(gzip.decompress(body))
+        _cache.put(key, meta, len(body) * 4)
+    return meta
+
+
+def load_shard(meta, shard, s3=None):
+    """{term: posting list bytes} of one shard of a segment."""
+    if shard not in meta['shardIds']:
+        return {}
+    key = ('shard', meta['segmentId'], shard)
+    terms = _cache.get(key)
+    if terms is None:
+        body = (s3 or _s3()).get_object(Bucket=SEARCH_INDEX_BUCKET,
+                                        Key=_key(meta['segmentId'], _shard_name(shard)))['Body'].read()
+        terms = decode_shard(body)
+        _cache.put(key, terms, sum(len(term) + len(postings) + 64 for term, postings in terms.items()))
+    return terms
+
+
+def current_segments(s3=None, refresh=False):
+    """Metadata of the visible segments, oldest first, from a list at most SEGMENT_LIST_TTL_SECONDS old."""
+    with _segment_list_lock:
+        ids = _segment_list['ids']
+        if refresh or ids is None or time.monotonic() >= _segment_list['expires']:
+            ids = list_segment_ids(s3)
+            _segment_list['ids'] = ids
+            _segment_list['expires'] = time.monotonic() + SEGMENT_LIST_TTL_SECONDS
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        metas = list(executor.map(lambda segment_id: load_meta(segment_id, s3), ids))
+    return [meta for meta in metas if meta is not None]
+
+
+def current_ordinals(metas):
+    """{segmentId: {ordinal}} of the documents that are each visit's current copy."""
+    latest = {}
+    for meta in metas:
+        for ordinal, doc in enumerate(meta['docs']):
+            current = latest.get(doc['visitId'])
+            if current is None or doc['indexedAt'] >= current[0]:
+                latest[doc['visitId']] = (doc['indexedAt'], meta['segmentId'], ordinal)
+    ordinals = defaultdict(set)
+    for _, segment_id, ordinal in latest.values():
+        ordinals[segment_id].add(ordinal)
+    return ordinals
+
+
+def tier(meta):
+    """Size tier of a segment: the number of digits of its document count, less one."""
+    return len(str(max(len(meta['docs']), 1))) - 1
+
+
+def merge_candidates(metas):
+    """Groups of segments to merge: each tier with at least MERGE_FACTOR segments under MAX_MERGE_DOCS."""
+    tiers = defaultdict(list)
+    for meta in metas:
+        if len(meta['docs']) < MAX_MERGE_DOCS:
+            tiers[tier(meta)].append(meta)
+    return [group for _, group in sorted(tiers.items()) if len(group) >= MERGE_FACTOR]
+
+
+def merge_segments(metas, s3=None):
+    """Write one segment with the current documents of the given ones; returns its metadata.
+
+    Of a visit found in several of the inputs only the copy with the latest
+    indexedAt is kept. Posting lists are re-encoded with new ordinals, so
+    positions are never expanded for more than one term at a time. The
+    inputs are left for the caller to delete.
+    """
+    s3 = s3 or _s3()
+    ordinals = current_ordinals(metas)
+    docs = []
+    remap = []
+    for meta in metas:
+        mapping = {}
+        for ordinal, doc in enumerate(meta['docs']):
+            if ordinal in ordinals[meta['segmentId']]:
+                mapping[ordinal] = len(docs)
+                docs.append(doc)
+        remap.append(mapping)
+
+    shard_terms = defaultdict(dict)
+    for shard in range(SHARDS):
+        inputs = []
+        for meta, mapping in zip(metas, remap):
+            # A segment sharded the same way holds the shard's terms in the same shard
+            input_shards = [shard] if meta['shards'] == SHARDS else meta['shardIds']
+            terms = {}
+            for input_shard in input_shards:
+                for term, postings in load_shard(meta, input_shard, s3).items():
+                    if shard_of(term, SHARDS) == shard:
+                        terms[term] = postings
+            inputs.append((terms, mapping))
+        for term in sorted({term for terms, _ in inputs for term in terms}):
+            postings = []
+            for terms, mapping in inputs:
+                if term in terms:
+                    for ordinal, positions in decode_postings(terms[term]).items():
+                        if ordinal in mapping:
+                            postings.append((mapping[ordinal], positions))
+            if postings:
+                shard_terms[shard][term] = encode_postings(postings)
+    return write_segment(docs, shard_terms, SHARDS, s3)
+
+
+def parse_query(text):
+    """The expression tree of a query: ('term', t), ('phrase', [t...]), ('and'|'or', [...]) or ('not', e)."""
+    tokens = []
+    for phrase, opening, closing, word in _QUERY_TOKEN.findall(text or ''):
+        if opening or closing:
+            tokens.append(opening or closing)
+        elif word in ('AND', 'OR', 'NOT'):
+            tokens.append(word)
+        elif word:
+            negated = word.startswith('-') and len(word) > 1
+            if negated:
+                tokens.append('NOT')
+            tokens.append(('words', tokenize(word[1:] if negated else word)))
+        else:
+            tokens.append(('words', tokenize(phrase)))
+
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == 'OR':
+            take()
+            children.append(parse_and())
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parse_and():
+        children = []
+        while peek() is not None and peek() not in ('OR', ')'):
+            if peek() == 'AND':
+                take()
+                continue
+            child = parse_unary()
+            if child is not None:
+                children.append(child)
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def parse_unary():
+        token = take()
+        if token == 'NOT':
+            if peek() is None or peek() in ('OR', ')'):
+                raise QueryError("NOT must be followed by a term")
+            child = parse_unary()
+            return ('not', child) if child is not None else None
+        if token == '(':
+            child = parse_or()
+            if peek() != ')':
+                raise QueryError("Unbalanced parentheses")
+            take()
+            return child
+        if token == ')':
+            raise QueryError("Unbalanced parentheses")
+        words = token[1]
+        if not words:
+            return None
+        return ('term', words[0]) if len(words) == 1 else ('phrase', words)
+
+    tree = parse_or()
+    if position < len(tokens):
+        raise QueryError("Unbalanced parentheses")
+    if tree is None:
+        raise QueryError("The query has no terms")
+    if tree[0] == 'not' or (tree[0] == 'and' and all(child[0] == 'not' for child in tree[1])):
+        raise QueryError("The query needs at least one term that is not negated")
+    return tree
+
+
+def query_terms(tree):
+    if tree[0] == 'term':
+        return {tree[1]}
+    if tree[0] == 'phrase':
+        return set(tree[1])
+    if tree[0] == 'not':
+        return query_terms(tree[1])
+    return set().union(*(query_terms(child) for child in tree[1]))
+
+
+def _phrase_count(position_lists):
+    following = [set(positions) for positions in position_lists[1:]]
+    return sum(1 for start in position_lists[0]
+               if all(start + offset in positions for offset, positions in enumerate(following, 1)))
+
+
+def evaluate(tree, postings, live):
+    """{ordinal: score} of the live documents of a segment matching tree; postings is {term: {ordinal: positions}}."""
+    kind = tree[0]
+    if kind == 'term':
+        return {ordinal: len(positions) for ordinal, positions in postings.get(tree[1], {}).items()
+                if ordinal in live}
+    if kind == 'phrase':
+        lists = [postings.get(term, {}) for term in tree[1]]
+        candidates = set(lists[0]).intersection(*lists[1:]) & live
+        scores = {}
+        for ordinal in candidates:
+            count = _phrase_count([term_postings[ordinal] for term_postings in lists])
+            if count:
+                scores[ordinal] = count * len(lists)
+        return scores
+    if kind == 'not':
+        return {ordinal: 0 for ordinal in live - set(evaluate(tree[1], postings, live))}
+    if kind == 'or':
+        scores = {}
+        for child in tree[1]:
+            for ordinal, score in evaluate(child, postings, live).items():
+                scores[ordinal] = scores.get(ordinal, 0) + score
+        return scores
+    # and: negated children only remove documents
+    positive = [child for child in tree[1] if child[0] != 'not']
+    negative = [child[1] for child in tree[1] if child[0] == 'not']
+    scores = dict.fromkeys(live, 0) if not positive else None
+    for child in positive:
+        child_scores = evaluate(child, postings, live if scores is None else set(scores))
+        scores = child_scores if scores is None else {ordinal: scores[ordinal] + score
+                                                      for ordinal, score in child_scores.items() if ordinal in scores}
+        if not scores:
+            return {}
+    for child in negative:
+        for ordinal in evaluate(child, postings, set(scores)):
+            scores.pop(ordinal, None)
+    return scores
+
+
+def _segment_postings(meta, terms, s3):
+    """{term: {ordinal: positions}} of the query terms in one segment."""
+    postings = {}
+    for term in terms:
+        data = load_shard(meta, shard_of(term, meta['shards']), s3).get(term)
+        if data is not None:
+            postings[term] = decode_postings(data)
+    return postings
+
+
+def search(query, date_from=None, date_to=None, limit=50, s3=None):
+    """Visits matching a query, newest first: {'total': n, 'results': [{visitId, date, patientId, score}]}."""
+    tree = parse_query(query)
+    terms = query_terms(tree)
+    started = time.monotonic()
+    for attempt in range(2):
+        metas = current_segments(s3, refresh=attempt > 0)
+        ordinals = current_ordinals(metas)
+        try:
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                segment_postings = list(executor.map(lambda meta: _segment_postings(meta, terms, s3), metas))
+            break
+        except ClientError as e:
+            # A segment merged away since the list was read
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404') or attempt:
+                raise
+
+    results = []
+    for meta, postings in zip(metas, segment_postings):
+        live = {ordinal for ordinal in ordinals[meta['segmentId']]
+                if (not date_from or (meta['docs'][ordinal]['date'] or '') >= date_from)
+                and (not date_to or (meta['docs'][ordinal]['date'] or '9999') <= date_to)}
+        if not live:
+            continue
+        for ordinal, score in evaluate(tree, postings, live).items():
+            doc = meta['docs'][ordinal]
+            results.append({'visitId': doc['visitId'], 'date': doc['date'], 'patientId': doc.get('patientId'),
+                            'score': score})
+    results.sort(key=lambda result: (result['date'] or '', result['score']), reverse=True)
+    took_ms = round((time.monotonic() - started) * 1000, 1)
+    logger.info("Searched the visit index", terms=len(terms), segments=len(metas), total=len(results), tookMs=took_ms)
+    return {'total': len(results), 'results': results[:limit], 'segments': len(metas), 'tookMs': took_ms}
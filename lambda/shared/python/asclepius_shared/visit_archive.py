@@ -0,0 +1,167 @@
+"""Cold storage for old visits, with read-through from the hot tables.
+
+asclepius-visit-archive moves visits older than VISIT_ARCHIVE_AFTER_DAYS
+out of DynamoDB, one gzipped JSON object per visit in VISIT_ARCHIVE_BUCKET:
+
+    {"version": 1, "visitId": ..., "archivedAt": ..., "visit": <Visit item>, "data": [<visit-data rows>]}
+
+What stays behind is small:
+
+- the Visit item without its conversation, plus archivedAt and archiveKey,
+  so visit lists and the patient index work as before;
+- one visit-data row with dataCategory ARCHIVED_CATEGORY in place of the
+  visit's rows.
+
+load_visit() and get_data_row() read the hot tables and, for an archived
+visit, the archive instead. Archives are cached per container
+(VISIT_ARCHIVE_CACHE_SIZE visits), so repeated reads of a visit fetch it
+from S3 once.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import boto3
+
+from asclepius_shared import log
+
+VISIT_TABLE = os.environ.get('VISIT_TABLE', 'asclepiusMVP-Visit')
+VISIT_DATA_TABLE = os.environ.get('VISIT_DATA_TABLE', 'asclepius-visit-data')
+ARCHIVE_BUCKET = os.environ.get('VISIT_ARCHIVE_BUCKET')
+ARCHIVE_PREFIX = 'visits/'
+ARCHIVE_AFTER_DAYS = int(os.environ.get('VISIT_ARCHIVE_AFTER_DAYS', '365'))
+CACHE_SIZE = int(os.environ.get('VISIT_ARCHIVE_CACHE_SIZE', '32'))
+
+ARCHIVE_VERSION = 1
+# dataCategory of the row left in place of an archived visit's visit-data rows
+ARCHIVED_CATEGORY = 'archived'
+# Visit attributes moved to the archive only; the rest stay in the stub
+ARCHIVED_VISIT_ATTRIBUTES = {'conversation'}
+
+logger = log.get_logger('visit-archive')
+
+_s3_client = None
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _s3():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+
+def archive_key(visit_id):
+    return f"{ARCHIVE_PREFIX}{visit_id}.json.gz"
+
+
+def is_archived(visit):
+    return bool(visit and visit.get('archivedAt'))
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode(visit_id, visit, rows, archived_at):
+    """The gzipped archive document of a visit."""
+    document = {
+        'version': ARCHIVE_VERSION,
+        'visitId': visit_id,
+        'archivedAt': archived_at,
+        'visit': visit,
+        'data': rows,
+    }
+    raw = json.dumps(document, separators=(',', ':'), ensure_ascii=False, default=_default).encode('utf-8')
+    return gzip.compress(raw, compresslevel=6, mtime=0)
+
+
+def decode(body):
+    """An archive document, with numbers as Decimal like the table reads it returned."""
+    return json.loads(gzip.decompress(body), parse_float=Decimal, parse_int=Decimal)
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z')
+
+
+def get_archive(key, bucket=None):
+    """The archive document at key, from the container's cache or S3. Cached documents are shared: do not modify them."""
+    bucket = bucket or ARCHIVE_BUCKET
+    location = f"{bucket}/{key}"
+    with _cache_lock:
+        if location in _cache:
+            _cache.move_to_end(location)
+            return _cache[location]
+    document = decode(_s3().get_object(Bucket=bucket, Key=key)['Body'].read())
+    with _cache_lock:
+        _cache[location] = document
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    logger.info("Read archived visit", visitId=document.get('visitId'), archiveKey=key)
+    return document
+
+
+def query_rows(data_table, visit_id, consistent=False):
+    rows = []
+    kwargs = {
+        'KeyConditionExpression': 'visitId = :vid',
+        'ExpressionAttributeValues': {':vid': visit_id},
+        'ConsistentRead': consistent
+    }
+    while True:
+        response = data_table.query(**kwargs)
+        rows.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return rows
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _archived_visit(document, key):
+    """The archived Visit item, marked as archived like its stub."""
+    return dict(document['visit'], archivedAt=document['archivedAt'], archiveKey=key)
+
+
+def load_visit(visit_id, visit_table=None, data_table=None, consistent=False):
+    """The Visit item and visit-data rows of a visit, from the archive if it has been archived.
+
+    Returns (visit or None, rows). An archived visit's item is the full
+    original, with archivedAt and archiveKey as on its stub.
+    """
+    dynamodb = boto3.resource('dynamodb') if visit_table is None or data_table is None else None
+    visit_table = visit_table or dynamodb.Table(VISIT_TABLE)
+    data_table = data_table or dynamodb.Table(VISIT_DATA_TABLE)
+
+    visit = visit_table.get_item(Key={'visitID': visit_id}, ConsistentRead=consistent).get('Item')
+    if is_archived(visit):
+        document = get_archive(visit['archiveKey'])
+        return _archived_visit(document, visit['archiveKey']), document['data']
+    rows = query_rows(data_table, visit_id, consistent)
+    stub = next((row for row in rows if row['dataCategory'] == ARCHIVED_CATEGORY), None)
+    if stub:
+        # Rows already moved but the Visit item not yet marked (an interrupted archive run)
+        document = get_archive(stub['archiveKey'])
+        return _archived_visit(document, stub['archiveKey']), document['data']
+    return visit, rows
+
+
+def get_data_row(visit_id, category, data_table=None):
+    """One visit-data row of a visit, from the archive if the visit's rows have been archived."""
+    data_table = data_table or boto3.resource('dynamodb').Table(VISIT_DATA_TABLE)
+    row = data_table.get_item(Key={'visitId': visit_id, 'dataCategory': category}).get('Item')
+    if row is not None:
+        return row
+    stub = data_table.get_item(Key={'visitId': visit_id, 'dataCategory': ARCHIVED_CATEGORY}).get('Item')
+    if stub is None:
+        return None
+    document = get_archive(stub['archiveKey'])
+    return next((row for row in document['data'] if row.get('dataCategory') == category), None)
@@ -0,0 +1,97 @@
+"""Shared setup for the Lambda handler tests.
+
+Run from the repository root with ``python -m pytest lambda/tests``. Handlers
+are imported from their own directories, with the shared layer on the path
+as Lambda mounts it at /opt/python.
+"""
+import importlib.util
+import io
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'shared', 'python'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+def load_handler(function_dir):
+    """Import a Lambda's lambda_function.py under a unique module name."""
+    path = os.path.join(LAMBDA_DIR, function_dir, 'lambda_function.py')
+    name = 'test_' + function_dir.replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeS3:
+    """The S3 calls the handlers make, against an in-memory bucket."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        # Keys read with get_object, in order
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self.objects[(Bucket, Key)] = {'Body': bytes(Body), 'LastModified': datetime.now(timezone.utc)}
+        return {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        self.gets.append(Key)
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)]['Body'])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        contents = [{'Key': key, 'LastModified': obj['LastModified']}
+                    for (bucket, key), obj in sorted(self.objects.items())
+                    if bucket == Bucket and key.startswith(Prefix)]
+        yield {'Contents': contents} if contents else {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for obj in Delete['Objects']:
+            self.objects.pop((Bucket, obj['Key']), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'Parts': {}}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId]['Parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)['Parts']
+        body = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        self.objects[(Bucket, Key)] = {'Body': body, 'LastModified': datetime.now(timezone.utc)}
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+        return {}
+
+    def body(self, bucket, key):
+        return self.objects[(bucket, key)]['Body']
+
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3()
@@ -0,0 +1,52 @@
+"""expert_panel.split_sections: which experts' responses survive from one panel output."""
+from asclepius_shared import expert_panel
+
+EXPERTS = ['diabetes_specialist', 'nutritionist', 'pharmacist']
+
+
+def test_each_expert_gets_its_section():
+    text = "[[diabetes_specialist]]\nCheck HbA1c.\n\n[[nutritionist]]\nLower carbohydrates.\n[[pharmacist]]\nTake with food.\n"
+
+    assert expert_panel.split_sections(text, EXPERTS) == {
+        'diabetes_specialist': 'Check HbA1c.',
+        'nutritionist': 'Lower carbohydrates.',
+        'pharmacist': 'Take with food.',
+    }
+
+
+def test_text_before_the_first_marker_is_dropped():
+    text = "Here are the responses.\n[[nutritionist]]\nLower carbohydrates."
+
+    assert expert_panel.split_sections(text, EXPERTS) == {'nutritionist': 'Lower carbohydrates.'}
+
+
+def test_repeated_marker_keeps_its_first_non_empty_section():
+    text = "[[pharmacist]]\n\n[[pharmacist]]\nTake with food.\n[[pharmacist]]\nAgain."
+
+    assert expert_panel.split_sections(text, EXPERTS) == {'pharmacist': 'Take with food.'}
+
+
+def test_unknown_marker_ends_the_previous_section():
+    text = "[[nutritionist]]\nLower carbohydrates.\n[[podiatrist]]\nInspect feet daily.\n[[pharmacist]]\nTake with food."
+
+    assert expert_panel.split_sections(text, EXPERTS) == {
+        'nutritionist': 'Lower carbohydrates.',
+        'pharmacist': 'Take with food.',
+    }
+
+
+def test_empty_and_missing_sections_are_left_out():
+    text = "[[diabetes_specialist]]\n   \n[[nutritionist]]\nLower carbohydrates."
+
+    # Experts left out fall back to their own calls
+    assert expert_panel.split_sections(text, EXPERTS) == {'nutritionist': 'Lower carbohydrates.'}
+
+
+def test_markers_must_be_on_their_own_line():
+    text = "[[nutritionist]]\nSee the [[pharmacist]] note.\n"
+
+    assert expert_panel.split_sections(text, EXPERTS) == {'nutritionist': 'See the [[pharmacist]] note.'}
+
+
+def test_output_without_markers_gives_nothing():
+    assert expert_panel.split_sections("I cannot help with that.", EXPERTS) == {}
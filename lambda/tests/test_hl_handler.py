@@ -0,0 +1,280 @@
+"""asclepius-HLhandler: batching, NDJSON files, pending markers and the import request."""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.exceptions import ParamValidationError
+
+from conftest import load_handler
+
+BUCKET = 'asclepius-healthlake-test'
+ROLE_ARN = 'arn:aws:iam::123456789012:role/healthlake-import'
+KMS_KEY = 'arn:aws:kms:us-east-1:123456789012:key/00000000-0000-0000-0000-000000000000'
+
+
+@pytest.fixture
+def hl():
+    module = load_handler('asclepius-HLhandler')
+    module.EXPORT_BUCKET = BUCKET
+    module.DATASTORE_ID = 'datastore-1'
+    module.IMPORT_ROLE_ARN = ROLE_ARN
+    module.KMS_KEY_ID = KMS_KEY
+    return module
+
+
+def visit_records(visit_id, diagnoses=2):
+    visit = {
+        'visitID': visit_id,
+        'patientID': 'patient-1',
+        'date': '2025-01-15',
+        'soapNote': {'subjective': {'chiefComplaint': 'Fatigue'}},
+    }
+    assessment = [f"- Diagnosis {index} (ICD-10: E11.{index})" for index in range(diagnoses)]
+    items = [
+        {'visitId': visit_id, 'dataCategory': 'finalSummary', 'assessment': json.dumps(assessment)},
+        {'visitId': visit_id, 'dataCategory': 'carePlan', 'treatmentOptions': json.dumps(['Metformin 500 mg'])},
+    ]
+    return visit, items
+
+
+class MemoryWriter:
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = self.aborted = False
+
+    def write(self, data):
+        self.data.extend(data)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+    def lines(self):
+        return [json.loads(line) for line in self.data.decode('utf-8').splitlines()]
+
+
+class FakeDynamoDB:
+    def Table(self, name):
+        return name
+
+
+def export(hl, visit_ids, records, healthlake=None, batch_id='20250115T000000Z-abcd1234'):
+    writers = []
+
+    def open_file(index):
+        assert index == len(writers)
+        writers.append(MemoryWriter())
+        return writers[-1]
+
+    healthlake = healthlake or hl.LocalImportClient()
+    result = hl.export_batch(visit_ids, records.get, open_file, healthlake, batch_id,
+                             f"s3://{BUCKET}/fhir-export/batches/{batch_id}/")
+    return result, writers, healthlake
+
+
+def add_marker(s3, visit_id, age_seconds):
+    s3.objects[(BUCKET, f"fhir-export/pending/{visit_id}")] = {
+        'Body': b'',
+        'LastModified': datetime.now(timezone.utc) - timedelta(seconds=age_seconds),
+    }
+
+
+def test_batch_starts_one_import_for_all_ready_visits(hl):
+    records = {f"visit-{index}": visit_records(f"visit-{index}") for index in range(5)}
+    result, writers, healthlake = export(hl, list(records) + ['visit-missing'], records)
+
+    assert result['exported'] == [f"visit-{index}" for index in range(5)]
+    assert result['skipped'] == ['visit-missing']
+    # One Encounter, two Conditions and one CarePlan per visit
+    assert result['resources'] == 20
+    assert result['files'] == 1 and writers[0].closed
+    assert len(healthlake.jobs) == 1
+    assert result['jobId'] == healthlake.jobs[0]['JobId']
+
+    resources = writers[0].lines()
+    assert [resource['resourceType'] for resource in resources[:4]] == ['Encounter', 'Condition', 'Condition',
+                                                                         'CarePlan']
+    assert {resource['encounter']['reference'] for resource in resources if resource['resourceType'] == 'Condition'} \
+        == {f"Encounter/visit-{index}" for index in range(5)}
+
+
+def test_batch_without_ready_visits_starts_no_import(hl):
+    result, writers, healthlake = export(hl, ['visit-missing'], {})
+
+    assert result['exported'] == [] and result['skipped'] == ['visit-missing']
+    assert writers == [] and healthlake.jobs == []
+    assert 'jobId' not in result
+
+
+def test_ndjson_files_split_at_the_size_limit(hl):
+    records = {f"visit-{index}": visit_records(f"visit-{index}", diagnoses=3) for index in range(40)}
+    _, single, _ = export(hl, list(records), records)
+    lines = single[0].data.splitlines(keepends=True)
+    hl.NDJSON_FILE_MAX_BYTES = max(len(line) for line in lines) * 6
+
+    result, writers, _ = export(hl, list(records), records)
+
+    assert result['files'] == len(writers) > 1
+    assert all(writer.closed for writer in writers)
+    assert all(len(writer.data) <= hl.NDJSON_FILE_MAX_BYTES for writer in writers)
+    # Lines are split between files, never within one, and keep their order
+    assert b''.join(writer.data for writer in writers) == single[0].data
+
+
+def test_line_larger_than_the_limit_gets_its_own_file(hl):
+    hl.NDJSON_FILE_MAX_BYTES = 10
+    records = {'visit-1': visit_records('visit-1', diagnoses=1)}
+
+    result, writers, _ = export(hl, ['visit-1'], records)
+
+    assert result['files'] == result['resources'] == 3
+    assert [len(writer.lines()) for writer in writers] == [1, 1, 1]
+
+
+def test_failed_export_aborts_every_file(hl):
+    hl.NDJSON_FILE_MAX_BYTES = 10
+    records = {'visit-1': visit_records('visit-1')}
+
+    def fetch(visit_id):
+        if visit_id == 'visit-bad':
+            raise RuntimeError('DynamoDB unavailable')
+        return records[visit_id]
+
+    writers = []
+
+    def open_file(index):
+        writers.append(MemoryWriter())
+        return writers[-1]
+
+    healthlake = hl.LocalImportClient()
+    with pytest.raises(RuntimeError):
+        hl.export_batch(['visit-1', 'visit-bad'], fetch, open_file, healthlake, 'batch-1', f"s3://{BUCKET}/batch-1/")
+    assert writers and all(writer.aborted for writer in writers)
+    assert healthlake.jobs == []
+
+
+def test_import_request_matches_the_healthlake_api(hl):
+    records = {'visit-1': visit_records('visit-1')}
+    _, _, healthlake = export(hl, ['visit-1'], records, batch_id='20250115T000000Z-abcd1234')
+
+    job = healthlake.jobs[0]
+    assert job['InputDataConfig'] == {'S3Uri': f"s3://{BUCKET}/fhir-export/batches/20250115T000000Z-abcd1234/"}
+    assert job['JobOutputDataConfig'] == {'S3Configuration': {
+        'S3Uri': f"s3://{BUCKET}/fhir-export/batches/20250115T000000Z-abcd1234-output/",
+        'KmsKeyId': KMS_KEY,
+    }}
+    assert job['DatastoreId'] == 'datastore-1'
+    assert job['DataAccessRoleArn'] == ROLE_ARN
+    assert job['JobName'] == 'asclepius-20250115T000000Z-abcd1234'
+    assert job['ClientToken'] == '20250115T000000Z-abcd1234'
+
+
+def test_retried_batch_reuses_its_import(hl):
+    records = {'visit-1': visit_records('visit-1')}
+    first, _, healthlake = export(hl, ['visit-1'], records)
+    second, _, _ = export(hl, ['visit-1'], records, healthlake=healthlake)
+
+    assert second['jobId'] == first['jobId']
+    assert len(healthlake.jobs) == 1
+
+
+def test_stand_in_rejects_a_request_the_api_would(hl):
+    with pytest.raises(ParamValidationError, match='KmsKeyId'):
+        hl.LocalImportClient().start_fhir_import_job(
+            InputDataConfig={'S3Uri': f"s3://{BUCKET}/batch/"},
+            JobOutputDataConfig={'S3Configuration': {'S3Uri': f"s3://{BUCKET}/batch-output/"}},
+            DatastoreId='datastore-1',
+            DataAccessRoleArn=ROLE_ARN,
+        )
+
+
+@pytest.mark.parametrize('setting', ['IMPORT_ROLE_ARN', 'KMS_KEY_ID'])
+def test_handler_fails_fast_without_import_settings(hl, monkeypatch, setting):
+    setattr(hl, setting, None)
+    monkeypatch.setattr(hl.boto3, 'client', lambda *args, **kwargs: pytest.fail('AWS client created'))
+
+    response = hl.lambda_handler({'visitId': 'visit-1'}, None)
+
+    assert response['statusCode'] == 500
+    assert 'misconfigured' in response['body']
+
+
+def test_handler_is_a_no_op_while_disabled(hl, monkeypatch):
+    hl.DATASTORE_ID = None
+    hl.KMS_KEY_ID = None
+    monkeypatch.setattr(hl.boto3, 'client', lambda *args, **kwargs: pytest.fail('AWS client created'))
+
+    assert hl.lambda_handler({'visitId': 'visit-1'}, None)['statusCode'] == 200
+
+
+def test_visit_event_leaves_a_pending_marker(hl, monkeypatch, fake_s3):
+    monkeypatch.setattr(hl.boto3, 'client', lambda service, **kwargs: fake_s3)
+
+    response = hl.lambda_handler({'visitId': 'visit-1'}, None)
+
+    assert response['statusCode'] == 200
+    assert (BUCKET, 'fhir-export/pending/visit-1') in fake_s3.objects
+
+
+def test_flush_deletes_markers_of_exported_and_expired_visits_only(hl, monkeypatch, fake_s3):
+    records = {'visit-ready': visit_records('visit-ready'), 'visit-young': visit_records('visit-young')}
+    add_marker(fake_s3, 'visit-ready', hl.EXPORT_MIN_AGE_SECONDS + 60)
+    add_marker(fake_s3, 'visit-unwritten', hl.EXPORT_MIN_AGE_SECONDS + 60)
+    add_marker(fake_s3, 'visit-young', 10)
+    add_marker(fake_s3, 'visit-expired', hl.EXPORT_MAX_AGE_SECONDS + 60)
+    monkeypatch.setattr(hl.boto3, 'resource', lambda service, **kwargs: FakeDynamoDB())
+    monkeypatch.setattr(hl, 'fetch_visit', lambda visit_table, data_table, visit_id: records.get(visit_id))
+    healthlake = hl.LocalImportClient()
+
+    result = hl.flush(fake_s3, healthlake)
+
+    assert result['exported'] == ['visit-ready']
+    assert result['skipped'] == ['visit-unwritten']
+    pending = {key.rsplit('/', 1)[1] for _, key in fake_s3.objects if '/pending/' in key}
+    # The unwritten visit is retried next flush; the young one is not due yet
+    assert pending == {'visit-unwritten', 'visit-young'}
+    ndjson = [key for _, key in fake_s3.objects if key.endswith('.ndjson')]
+    assert len(ndjson) == 1 and ndjson[0].startswith(f"fhir-export/batches/{result['batchId']}/")
+    assert len(healthlake.jobs) == 1
+
+
+def test_flush_with_nothing_due_starts_no_import(hl, fake_s3):
+    add_marker(fake_s3, 'visit-young', 10)
+    healthlake = hl.LocalImportClient()
+
+    result = hl.flush(fake_s3, healthlake)
+
+    assert result['body'] == 'No visits pending export'
+    assert healthlake.jobs == []
+    assert (BUCKET, 'fhir-export/pending/visit-young') in fake_s3.objects
+
+
+def test_multipart_writer_uploads_in_parts(hl, fake_s3):
+    writer = hl.S3MultipartWriter(fake_s3, BUCKET, 'batch/visits-0000.ndjson', part_size=16)
+    for index in range(10):
+        writer.write(f"line {index:02d}\n".encode())
+    writer.close()
+
+    assert fake_s3.body(BUCKET, 'batch/visits-0000.ndjson') == b''.join(
+        f"line {index:02d}\n".encode() for index in range(10))
+    assert fake_s3.uploads == {}
+
+
+def test_small_file_is_written_in_one_request(hl, fake_s3):
+    writer = hl.S3MultipartWriter(fake_s3, BUCKET, 'batch/visits-0000.ndjson', part_size=1024)
+    writer.write(b'{"resourceType":"Encounter"}\n')
+    writer.close()
+
+    assert fake_s3.body(BUCKET, 'batch/visits-0000.ndjson') == b'{"resourceType":"Encounter"}\n'
+    assert fake_s3.uploads == {}
+
+
+def test_aborted_multipart_upload_leaves_no_object(hl, fake_s3):
+    writer = hl.S3MultipartWriter(fake_s3, BUCKET, 'batch/visits-0000.ndjson', part_size=4)
+    writer.write(b'partial line')
+    writer.abort()
+
+    assert fake_s3.aborted == ['batch/visits-0000.ndjson']
+    assert (BUCKET, 'batch/visits-0000.ndjson') not in fake_s3.objects
@@ -0,0 +1,123 @@
+"""payload_store: offloading large workflow values to S3 and resolving them back."""
+import hashlib
+
+import pytest
+
+from asclepius_shared import payload_store
+
+BUCKET = 'asclepius-payload-test'
+
+
+@pytest.fixture
+def s3(monkeypatch, fake_s3):
+    monkeypatch.setattr(payload_store, 'PAYLOAD_BUCKET', BUCKET)
+    monkeypatch.setattr(payload_store, '_s3', lambda: fake_s3)
+    monkeypatch.setattr(payload_store, '_cache', payload_store._BodyCache(1024 * 1024))
+    return fake_s3
+
+
+def large_summary():
+    return {'assessment': [f"Diagnosis {index}" for index in range(200)], 'plan': 'Follow up in 3 months'}
+
+
+def test_small_values_stay_inline(s3):
+    summary = {'assessment': ['Type 2 diabetes']}
+
+    assert payload_store.offload(summary) is summary
+    assert s3.objects == {}
+
+
+def test_min_bytes_overrides_the_threshold(s3):
+    summary = {'assessment': ['Type 2 diabetes']}
+
+    assert payload_store.is_ref(payload_store.offload(summary, min_bytes=1))
+
+
+def test_nothing_is_offloaded_without_a_bucket(s3, monkeypatch):
+    monkeypatch.setattr(payload_store, 'PAYLOAD_BUCKET', None)
+    summary = large_summary()
+
+    assert payload_store.offload(summary) is summary
+    assert s3.objects == {}
+
+
+def test_large_values_round_trip(s3):
+    summary = large_summary()
+
+    ref = payload_store.offload(summary)
+
+    assert payload_store.is_ref(ref)
+    assert ref['bytes'] == len(payload_store.serialize(summary))
+    assert payload_store.resolve(ref) == summary
+    assert payload_store.offload(ref) is ref
+
+
+def test_key_is_the_content_hash_and_stable_across_retries(s3, monkeypatch):
+    summary = large_summary()
+    first = payload_store.offload(summary)
+    # A retry in a new container: reordered keys, nothing cached
+    monkeypatch.setattr(payload_store, '_cache', payload_store._BodyCache(1024 * 1024))
+    retried = payload_store.offload(dict(reversed(list(summary.items()))))
+
+    assert retried == first
+    digest = hashlib.sha256(payload_store.serialize(summary)).hexdigest()
+    assert first['payloadRef'] == f"s3://{BUCKET}/workflow-payloads/{digest[:2]}/{digest}.json"
+    assert len(s3.objects) == 1
+
+
+def test_resolve_rejects_a_body_that_does_not_match_its_hash(s3, monkeypatch):
+    ref = payload_store.offload(large_summary())
+    monkeypatch.setattr(payload_store, '_cache', payload_store._BodyCache(1024 * 1024))
+    key = ref['payloadRef'][len(f"s3://{BUCKET}/"):]
+    s3.objects[(BUCKET, key)]['Body'] = b'{"assessment":[]}'
+
+    with pytest.raises(ValueError, match='content hash'):
+        payload_store.resolve(ref)
+
+
+def test_resolve_returns_a_fresh_copy(s3):
+    ref = payload_store.offload(large_summary())
+
+    first = payload_store.resolve(ref)
+    first['assessment'].clear()
+
+    assert payload_store.resolve(ref) == large_summary()
+
+
+def test_resolve_reads_each_payload_once(s3, monkeypatch):
+    ref = payload_store.offload(large_summary())
+    monkeypatch.setattr(payload_store, '_cache', payload_store._BodyCache(1024 * 1024))
+
+    payload_store.resolve(ref)
+    payload_store.resolve(ref)
+
+    assert len(s3.gets) == 1
+
+
+def test_non_references_resolve_to_themselves():
+    summary = {'assessment': ['Type 2 diabetes']}
+
+    assert payload_store.resolve(summary) is summary
+    assert payload_store.resolve(None) is None
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    cache = payload_store._BodyCache(10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'
+
+    cache.put('c', b'1234')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234' and cache.get('c') == b'1234'
+
+
+def test_cache_skips_bodies_larger_than_its_limit():
+    cache = payload_store._BodyCache(10)
+    cache.put('a', b'1234')
+
+    cache.put('big', b'x' * 11)
+
+    assert cache.get('big') is None
+    assert cache.get('a') == b'1234'
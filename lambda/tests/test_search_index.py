@@ -0,0 +1,153 @@
+"""search_index: the posting format, query evaluation, re-indexed visits and segment merges."""
+import pytest
+
+from asclepius_shared import search_index
+
+BUCKET = 'asclepius-search-test'
+
+
+@pytest.fixture
+def s3(monkeypatch, fake_s3):
+    monkeypatch.setattr(search_index, 'SEARCH_INDEX_BUCKET', BUCKET)
+    monkeypatch.setattr(search_index, 'SHARDS', 4)
+    monkeypatch.setattr(search_index, 'SEGMENT_LIST_TTL_SECONDS', 0)
+    monkeypatch.setattr(search_index, '_cache', search_index._Cache(1024 * 1024))
+    monkeypatch.setitem(search_index._segment_list, 'ids', None)
+    return fake_s3
+
+
+def add_visit(s3, visit_id, texts, date='2025-01-15', indexed_at=1):
+    doc = {'visitId': visit_id, 'date': date, 'patientId': 'patient-1', 'indexedAt': indexed_at}
+    return search_index.index_document(doc, search_index.document_terms(texts), s3)
+
+
+def matches(s3, query, **kwargs):
+    return sorted((result['visitId'], result['score'])
+                  for result in search_index.search(query, s3=s3, **kwargs)['results'])
+
+
+def visit_ids(s3, query, **kwargs):
+    return sorted(visit_id for visit_id, _ in matches(s3, query, **kwargs))
+
+
+def test_postings_round_trip():
+    postings = [(0, [0, 5, 300]), (3, [2]), (200, [1, 127, 128, 100000])]
+
+    assert search_index.decode_postings(search_index.encode_postings(postings)) == dict(postings)
+
+
+def test_shard_round_trip():
+    terms = {
+        'metformin': search_index.encode_postings([(0, [4]), (7, [1, 9])]),
+        'e11.9': search_index.encode_postings([(2, [0])]),
+        'café': search_index.encode_postings([(1, [3])]),
+    }
+
+    assert search_index.decode_shard(search_index.encode_shard(terms)) == terms
+
+
+def test_positions_leave_a_gap_between_texts():
+    terms = search_index.document_terms(['Chest pain', 'pain'])
+
+    assert terms['chest'] == [0]
+    assert terms['pain'] == [1, 2 + search_index.POSITION_GAP]
+
+
+@pytest.fixture
+def visits(s3):
+    add_visit(s3, 'visit-metformin', ['Started metformin for type 2 diabetes', 'Chest pain on exertion'],
+              date='2025-01-10')
+    add_visit(s3, 'visit-insulin', ['Switched to insulin', 'No chest pain'], date='2025-02-10')
+    add_visit(s3, 'visit-both', ['Metformin and insulin', 'Pain in the chest', 'Hypertension'], date='2025-03-10')
+    return s3
+
+
+def test_terms_are_combined_with_and(visits):
+    assert visit_ids(visits, 'metformin insulin') == ['visit-both']
+    assert visit_ids(visits, 'metformin AND insulin') == ['visit-both']
+
+
+def test_or(visits):
+    assert visit_ids(visits, 'metformin OR insulin') == ['visit-both', 'visit-insulin', 'visit-metformin']
+    assert visit_ids(visits, '(metformin OR insulin) AND hypertension') == ['visit-both']
+
+
+def test_not(visits):
+    assert visit_ids(visits, 'metformin AND NOT insulin') == ['visit-metformin']
+    assert visit_ids(visits, 'metformin -insulin') == ['visit-metformin']
+    assert visit_ids(visits, 'pain NOT (metformin OR hypertension)') == ['visit-insulin']
+
+
+def test_phrase_needs_the_words_in_order(visits):
+    assert visit_ids(visits, '"chest pain"') == ['visit-insulin', 'visit-metformin']
+    assert visit_ids(visits, '"pain chest"') == []
+    assert visit_ids(visits, 'chest pain') == ['visit-both', 'visit-insulin', 'visit-metformin']
+
+
+def test_phrase_never_spans_two_texts(s3):
+    add_visit(s3, 'visit-1', ['Reports chest', 'pain in the leg'])
+
+    assert visit_ids(s3, '"chest pain"') == []
+    assert visit_ids(s3, 'chest pain') == ['visit-1']
+
+
+def test_results_are_newest_first_and_filtered_by_date(visits):
+    results = search_index.search('chest', s3=visits)['results']
+
+    assert [result['visitId'] for result in results] == ['visit-both', 'visit-insulin', 'visit-metformin']
+    assert visit_ids(visits, 'chest', date_from='2025-02-01', date_to='2025-02-28') == ['visit-insulin']
+
+
+@pytest.mark.parametrize('query', ['', 'NOT metformin', '-metformin', '(metformin', 'metformin)'])
+def test_invalid_queries_are_rejected(query):
+    with pytest.raises(search_index.QueryError):
+        search_index.parse_query(query)
+
+
+def test_reindexed_visit_supersedes_its_older_copy(s3):
+    add_visit(s3, 'visit-1', ['Started metformin'], indexed_at=1)
+    add_visit(s3, 'visit-2', ['Continue metformin'], indexed_at=1)
+    add_visit(s3, 'visit-1', ['Switched to insulin'], indexed_at=2)
+
+    assert visit_ids(s3, 'metformin') == ['visit-2']
+    assert visit_ids(s3, 'insulin') == ['visit-1']
+    assert search_index.search('started OR switched', s3=s3)['total'] == 1
+
+
+def test_merge_keeps_search_results(s3):
+    for index in range(6):
+        add_visit(s3, f"visit-{index}", [f"Metformin {index * 500} mg", 'Chest pain' if index % 2 else 'Fatigue'],
+                  date=f"2025-01-{index + 10}", indexed_at=1)
+    add_visit(s3, 'visit-3', ['Insulin instead of metformin', 'Fatigue'], date='2025-01-13', indexed_at=2)
+    queries = ['metformin', '"chest pain"', 'fatigue -insulin', 'insulin OR "chest pain"', '500']
+    before = {query: matches(s3, query) for query in queries}
+
+    metas = search_index.current_segments(s3, refresh=True)
+    merged = search_index.merge_segments(metas, s3)
+    for meta in metas:
+        search_index.delete_segment(meta, s3)
+
+    assert search_index.list_segment_ids(s3) == [merged['segmentId']]
+    # The superseded copy of visit-3 is dropped
+    assert sorted(doc['visitId'] for doc in merged['docs']) == [f"visit-{index}" for index in range(6)]
+    assert merged['shards'] == 4
+    assert {query: matches(s3, query) for query in queries} == before
+
+
+def test_merging_merged_segments_keeps_search_results(s3, monkeypatch):
+    monkeypatch.setattr(search_index, 'MERGE_FACTOR', 2)
+    for index in range(4):
+        add_visit(s3, f"visit-{index}", [f"Visit {index} metformin"], indexed_at=index)
+    before = matches(s3, 'metformin')
+
+    metas = search_index.current_segments(s3, refresh=True)
+    assert search_index.merge_candidates(metas) == [metas]
+    halves = [search_index.merge_segments(metas[:2], s3), search_index.merge_segments(metas[2:], s3)]
+    for meta in metas:
+        search_index.delete_segment(meta, s3)
+    search_index.merge_segments(halves, s3)
+    for meta in halves:
+        search_index.delete_segment(meta, s3)
+
+    assert len(search_index.list_segment_ids(s3)) == 1
+    assert matches(s3, 'metformin') == before
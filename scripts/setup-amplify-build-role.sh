@@ -265,6 +265,7 @@ else
                 "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-visit-$STAGE",
                 "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-transcript-$STAGE",
                 "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-visit-data-$STAGE",
+                "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-visit-view-$STAGE",
                 "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-patient-$STAGE/index/*",
                 "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-visit-$STAGE/index/*",
                 "arn:aws:dynamodb:$REGION:$ACCOUNT_ID:table/asclepius-transcript-$STAGE/index/*",
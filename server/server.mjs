@@ -6,6 +6,7 @@ import { NodeHttp2Handler } from '@smithy/node-http-handler';
 import { fromNodeProviderChain } from "@aws-sdk/credential-providers";
 import cors from 'cors';
 import { S3Client, PutObjectCommand } from "@aws-sdk/client-s3";
+import { LambdaClient, InvokeCommand } from "@aws-sdk/client-lambda";
 import wav from 'wav';
 import { Readable } from 'stream';
 import { v4 as uuidv4 } from 'uuid';
@@ -28,9 +29,16 @@ const wss = new WebSocketServer({
 });
 const sampleRateHertz = 16000
 
+// Final transcript segments are sent to the live-draft function in batches of at least this many,
+// or whatever has arrived once the oldest unsent segment is this old
+const liveDraftMinSegments = parseInt(process.env.LIVE_DRAFT_MIN_SEGMENTS || '4', 10);
+const liveDraftMaxWaitMs = parseInt(process.env.LIVE_DRAFT_MAX_WAIT_MS || '15000', 10);
+
 class AudioStreamHandler {
-  constructor() {
+  constructor(patientId = null) {
     this.sessionId = uuidv4(); // Unique session ID for each new stream with AWS HealthScribe
+    this.patientId = patientId;
+    this.startedAt = new Date().toISOString();
     this.chunks = [];
     this.configSent = false;
     this.resolver = null;
@@ -220,12 +228,110 @@ class AudioStreamHandler {
       throw error;
     }
   }
+
+  // Lets the pipeline carry the patient and visit date through to the Visit item,
+  // which the Visit table's patient and date indexes are built on
+  async saveSessionMetadata() {
+    const command = new PutObjectCommand({
+      Bucket: process.env.AUDIO_BUCKET_NAME,
+      Key: `session-metadata/${this.sessionId}.json`,
+      Body: JSON.stringify({
+        sessionId: this.sessionId,
+        patientId: this.patientId,
+        startedAt: this.startedAt
+      }),
+      ContentType: 'application/json'
+    });
+
+    await this.s3Client.send(command);
+    console.log(`Session metadata saved to S3: session-metadata/${this.sessionId}.json`);
+  }
 }
 
-wss.on('connection', async (ws) => {
+// Sends final transcript segments to asclepius-live-draft while the visit is recorded, so the
+// pipeline has a draft summary, diagnoses and routing before HealthScribe's final documents land.
+// Deltas go out one at a time, in order; segments that arrive while one is in flight go with the next.
+class LiveDraftPublisher {
+  constructor(sessionId, functionName, patientId = null) {
+    this.sessionId = sessionId;
+    this.functionName = functionName;
+    this.patientId = patientId;
+    this.client = new LambdaClient({
+      region: process.env.AWS_REGION || 'us-east-1',
+      credentials: fromNodeProviderChain()
+    });
+    this.pending = [];
+    this.seq = 0;
+    this.sending = false;
+    this.finished = false;
+    this.timer = null;
+    this.inFlight = Promise.resolve();
+  }
+
+  add(segment) {
+    this.pending.push({
+      segmentId: segment.SegmentId,
+      channel: segment.ChannelId,
+      content: segment.Content,
+      beginTime: segment.BeginAudioTime
+    });
+    this.schedule();
+  }
+
+  schedule() {
+    if (this.sending || this.finished || this.pending.length === 0) return;
+    if (this.pending.length >= liveDraftMinSegments) {
+      this.flush();
+    } else if (!this.timer) {
+      this.timer = setTimeout(() => this.flush(), liveDraftMaxWaitMs);
+    }
+  }
+
+  flush() {
+    clearTimeout(this.timer);
+    this.timer = null;
+    if (this.sending || this.pending.length === 0) return this.inFlight;
+
+    const segments = this.pending;
+    this.pending = [];
+    this.sending = true;
+    this.inFlight = this.invoke({ action: 'delta', visitId: this.sessionId, seq: ++this.seq, segments }, 'RequestResponse')
+      // A lost delta only makes the draft less complete; the final documents are still processed in full
+      .catch(error => console.error('Error sending live draft delta:', error))
+      .finally(() => {
+        this.sending = false;
+        this.schedule();
+      });
+    return this.inFlight;
+  }
+
+  // Sends what is left, then asks for the speculative care plan without waiting for it
+  async finish() {
+    this.finished = true;
+    await this.inFlight;
+    await this.flush();
+    await this.invoke({ action: 'finalize', visitId: this.sessionId, patientId: this.patientId }, 'Event');
+  }
+
+  async invoke(payload, invocationType) {
+    const response = await this.client.send(new InvokeCommand({
+      FunctionName: this.functionName,
+      InvocationType: invocationType,
+      Payload: Buffer.from(JSON.stringify(payload))
+    }));
+    if (response.FunctionError) {
+      throw new Error(`Live draft ${payload.action} failed: ${Buffer.from(response.Payload || []).toString()}`);
+    }
+    return response;
+  }
+}
+
+wss.on('connection', async (ws, req) => {
   console.log('Frontend client connected');
+  const patientId = new URL(req.url, 'http://localhost').searchParams.get('patientId');
 
   let audioHandler = null;
+  let liveDraft = null;
   let transcribeClient = null;
   let isClosing = false;
 
@@ -238,6 +344,12 @@ wss.on('connection', async (ws) => {
         console.log('Starting cleanup process...');
         await audioHandler.end();
 
+        if (liveDraft) {
+          liveDraft.finish().catch(error => {
+            console.error('Error finalizing live draft:', error);
+          });
+        }
+
         try {
           const audioLocation = await audioHandler.saveAudioToS3();
           if (ws.readyState === ws.OPEN) {
@@ -261,8 +373,14 @@ wss.on('connection', async (ws) => {
   };
 
   try {
-    audioHandler = new AudioStreamHandler();
+    audioHandler = new AudioStreamHandler(patientId);
     console.log('New session created with ID:', audioHandler.sessionId);
+    audioHandler.saveSessionMetadata().catch(error => {
+      console.error('Error saving session metadata:', error);
+    });
+    if (process.env.LIVE_DRAFT_FUNCTION_NAME) {
+      liveDraft = new LiveDraftPublisher(audioHandler.sessionId, process.env.LIVE_DRAFT_FUNCTION_NAME, patientId);
+    }
 
     // send session ID immediately after connection
     ws.send(JSON.stringify({ type: 'SESSION_START', sessionId: audioHandler.sessionId }));
@@ -321,6 +439,9 @@ wss.on('connection', async (ws) => {
                   const segment = event.TranscriptEvent.TranscriptSegment;
 
                   console.log('Transcription segment received:', segment);
+                  if (liveDraft && !segment.IsPartial) {
+                    liveDraft.add(segment);
+                  }
                   ws.send(JSON.stringify({
                     channel: segment.ChannelId,
                     transcription: segment.Content,
@@ -1,11 +1,12 @@
 import React, { useEffect, useRef, useState } from 'react';
 import Button from '@cloudscape-design/components/button';
 interface StartTranscriptionButtonProps {
+  patientId?: string;  // Recorded with the session so the pipeline can index the visit by patient
   onTranscriptionUpdate: (transcription: string, isPartial: boolean) => void;
   onSessionStart?: (sessionId: string) => void;  
 }
 
-const StartTranscriptionButton: React.FC<StartTranscriptionButtonProps> = ({onTranscriptionUpdate, onSessionStart}) => {
+const StartTranscriptionButton: React.FC<StartTranscriptionButtonProps> = ({patientId, onTranscriptionUpdate, onSessionStart}) => {
   const [isStreaming, setIsStreaming] = useState(false);
   const [hasPermission, setHasPermission] = useState(false);
   const streamRef = useRef<MediaStream | null>(null);
@@ -82,7 +83,8 @@ const StartTranscriptionButton: React.FC<StartTranscriptionButtonProps> = ({onTr
         return;
       }
       console.log('Connecting to WebSocket endpoint:', wsEndpoint);
-      wsRef.current = new WebSocket(`${wsEndpoint}/stream`);
+      const query = patientId ? `?patientId=${encodeURIComponent(patientId)}` : '';
+      wsRef.current = new WebSocket(`${wsEndpoint}/stream${query}`);
       
       wsRef.current.onopen = () => {
         console.log('WebSocket connected to backend server');
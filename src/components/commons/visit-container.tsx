@@ -12,7 +12,7 @@ import { ConsentModal } from "./modal";
 import Modal from "@cloudscape-design/components/modal";
 import Box from "@cloudscape-design/components/box";
 import { getPatientById, Patient } from "../../services/patientService";
-import { getVisitById, Visit } from "../../services/visitService";
+import { getVisitById, getVisitView, Visit } from "../../services/visitService";
 import { ContentLayout } from "@cloudscape-design/components";
 import { BreadcrumbGroup } from "@cloudscape-design/components";
 
@@ -36,7 +36,9 @@ export function VisitContainer() {
       }
 
       try {
-        const visitData = await getVisitById(visitID);
+        // The materialized view is a single read; visits without one yet use the Visit item
+        const view = await getVisitView(visitID).catch(() => null);
+        const visitData = view?.visit ?? await getVisitById(visitID);
         if (visitData) {
           setVisit(visitData);
         } else {
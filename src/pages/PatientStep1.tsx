@@ -7,10 +7,11 @@ import LiveTranscription from '../components/LiveTranscription';
 
 
 interface PatientStep1Props {
+  patientId?: string;
   onSessionStart: (sessionId: string) => void;
 }
 
-export const PatientStep1: React.FC<PatientStep1Props> = ({ onSessionStart }) => {
+export const PatientStep1: React.FC<PatientStep1Props> = ({ patientId, onSessionStart }) => {
   const [currentTranscription, setCurrentTranscription] = useState('');
   const [isPartial, setIsPartial] = useState(false);
   const [currentSessionId, setCurrentSessionId] = useState<string | null>(null);
@@ -56,6 +57,7 @@ export const PatientStep1: React.FC<PatientStep1Props> = ({ onSessionStart }) =>
               size="xs"
             >
               <StartTranscriptionButton 
+                patientId={patientId}
                 onTranscriptionUpdate={handleTranscriptionUpdate} 
                 onSessionStart={handleSessionStart}
               />
@@ -5,7 +5,7 @@ import Header from '@cloudscape-design/components/header';
 import Textarea from '@cloudscape-design/components/textarea';
 import SpaceBetween from '@cloudscape-design/components/space-between';
 import Button from '@cloudscape-design/components/button';
-import { getFinalSummary, updateVisitData } from '../services/visitService';
+import { getFinalSummary, isVisitArchived, updateVisitData } from '../services/visitService';
 import Alert from '@cloudscape-design/components/alert';
 
 interface PatientStep4Props {
@@ -34,6 +34,8 @@ const PatientStep4: React.FC<PatientStep4Props> = ({ sessionId }) => {
   const [loading, setLoading] = useState<boolean>(true);
   const [error, setError] = useState<string | null>(null);
   const [saveSuccess, setSaveSuccess] = useState<boolean>(false);
+  // Archived visits are read from the archive and cannot be edited
+  const [isArchived, setIsArchived] = useState<boolean>(false);
 
   useEffect(() => {
     if (sessionId) {
@@ -55,6 +57,7 @@ const PatientStep4: React.FC<PatientStep4Props> = ({ sessionId }) => {
         setLoading(true);
         setError(null);
         const data = await getFinalSummary(sessionId); // Use sessionId instead of hardcoded value
+        setIsArchived(await isVisitArchived(sessionId));
         console.log('Fetched care summary data:', data);
         // Find the item with dataCategory "finalSummary"
         const finalSummaryItem = data.find(item => item.dataCategory === "finalSummary");
@@ -136,6 +139,12 @@ const PatientStep4: React.FC<PatientStep4Props> = ({ sessionId }) => {
         </Alert>
       )}
       
+      {isArchived && (
+        <Alert type="info">
+          This visit has been archived. Its care summary is read-only.
+        </Alert>
+      )}
+
       {saveSuccess && (
         <Alert type="success" dismissible onDismiss={() => setSaveSuccess(false)}>
           Changes saved successfully!
@@ -156,7 +165,7 @@ const PatientStep4: React.FC<PatientStep4Props> = ({ sessionId }) => {
                   </SpaceBetween>  
                   </>
                 ) : (
-                  <Button onClick={handleEdit}>Edit</Button>
+                  <Button onClick={handleEdit} disabled={isArchived}>Edit</Button>
                 )}
               </SpaceBetween>
             }
@@ -61,6 +61,7 @@ export default () => {
         description:"Record physician-patient conversation.",
         content: (
           <PatientStep1 
+            patientId={patientID}
             onSessionStart={handleSessionStart}
           />
         )
@@ -19,6 +19,7 @@ const docClient = DynamoDBDocumentClient.from(client);
 // Environment variables for table names
 const VISIT_TABLE = import.meta.env.VITE_VISIT_TABLE || "asclepius-visit-dev";
 const VISIT_DATA_TABLE = import.meta.env.VITE_VISIT_DATA_TABLE || "asclepius-visit-data";
+const VISIT_VIEW_TABLE = import.meta.env.VITE_VISIT_VIEW_TABLE || `asclepius-visit-view-${import.meta.env.VITE_STAGE || "dev"}`;
 
 export interface Visit {
     visitID: string;
@@ -27,6 +28,8 @@ export interface Visit {
     patientID: string;
     soapNote: string;
     summaryFile: string;
+    // Set when asclepius-visit-archive has moved the visit to S3; the conversation is then only in the archive
+    archivedAt?: string;
 }
 
 export interface AIVisit {
@@ -42,6 +45,123 @@ export interface AIVisit {
     treatmentOptions: string;
 }
 
+// Materialized view of a visit, built by the asclepius-visit-view Lambda: the Visit item
+// (without the conversation, unless the view was rebuilt from the archive) and every
+// visit-data row with its JSON attributes parsed
+export interface VisitView {
+    visitId: string;
+    visit: Visit | null;
+    data: Record<string, Record<string, any>>;
+}
+
+// Views already fetched this session, revalidated by etag
+const visitViewCache = new Map<string, { etag: string; view: VisitView }>();
+
+const decompressView = async (body: Uint8Array): Promise<VisitView> => {
+  const stream = new Blob([body]).stream().pipeThrough(new DecompressionStream("gzip"));
+  return JSON.parse(await new Response(stream).text());
+};
+
+// Archived visits have no view until one is asked for: marking the Visit item makes the
+// asclepius-visit-view Lambda rebuild it from the archive, which takes a second or two
+const REHYDRATE_POLL_MS = 1000;
+const REHYDRATE_MAX_POLLS = 10;
+
+// dataCategory of the single row asclepius-visit-archive leaves in place of an archived visit's rows
+const ARCHIVED_CATEGORY = "archived";
+
+// Visit-data attributes stored as JSON strings, which the pages parse themselves
+const JSON_DATA_ATTRIBUTES = new Set([
+  "assessment", "chief_complaint", "history_present_illness", "plan", "review_systems",
+  "diagnosticTests", "followUpRecommendations", "patientEducation", "specialistReferrals", "treatmentOptions"
+]);
+
+const requestRehydration = async (visitID: string): Promise<boolean> => {
+  const visit = await docClient.send(new GetCommand({
+    TableName: VISIT_TABLE,
+    Key: { visitID },
+    ProjectionExpression: "archivedAt"
+  }));
+  if (!visit.Item?.archivedAt) {
+    return false;
+  }
+  await docClient.send(new UpdateCommand({
+    TableName: VISIT_TABLE,
+    Key: { visitID },
+    UpdateExpression: "set rehydrateRequestedAt = :now",
+    ExpressionAttributeValues: { ":now": new Date().toISOString() }
+  }));
+  return true;
+};
+
+// Returns the visit's view in one GetItem, or null if it has not been built yet.
+// A cached view is revalidated by fetching only its etag, which skips transferring
+// and decompressing a view that has not changed. Archived visits are rehydrated on demand.
+export const getVisitView = async (visitID: string): Promise<VisitView | null> => {
+  try {
+    await getCurrentUser();
+
+    const cached = visitViewCache.get(visitID);
+    if (cached) {
+      const head = await docClient.send(new GetCommand({
+        TableName: VISIT_VIEW_TABLE,
+        Key: { visitID },
+        ProjectionExpression: "etag"
+      }));
+      if (head.Item?.etag === cached.etag) {
+        return cached.view;
+      }
+    }
+
+    const getView = async () => (await docClient.send(new GetCommand({
+      TableName: VISIT_VIEW_TABLE,
+      Key: { visitID }
+    }))).Item;
+    let item = await getView();
+    if (!item && await requestRehydration(visitID)) {
+      for (let poll = 0; poll < REHYDRATE_MAX_POLLS && !item; poll++) {
+        await new Promise(resolve => setTimeout(resolve, REHYDRATE_POLL_MS));
+        item = await getView();
+      }
+    }
+    if (!item) {
+      visitViewCache.delete(visitID);
+      return null;
+    }
+    const view = await decompressView(item.view);
+    visitViewCache.set(visitID, { etag: item.etag, view });
+    return view;
+  } catch (error) {
+    console.error("Error fetching visit view:", error);
+    throw error;
+  }
+};
+
+// An archived visit's visit-data rows, from its rehydrated view, in the shape the tables return them
+const getArchivedVisitData = async (visitId: string): Promise<AIVisit[]> => {
+  const view = await getVisitView(visitId);
+  if (!view) {
+    throw new Error(`Archived visit ${visitId} could not be rehydrated`);
+  }
+  return Object.entries(view.data).map(([dataCategory, section]) => {
+    const row: Record<string, any> = { visitId, dataCategory };
+    for (const [key, value] of Object.entries(section)) {
+      row[key] = typeof value !== "string" || JSON_DATA_ATTRIBUTES.has(key) ? JSON.stringify(value) : value;
+    }
+    return row as AIVisit;
+  });
+};
+
+// Whether the visit's rows have been moved to the archive. Archived visits are read-only.
+export const isVisitArchived = async (visitId: string): Promise<boolean> => {
+  const response = await docClient.send(new GetCommand({
+    TableName: VISIT_DATA_TABLE,
+    Key: { visitId, dataCategory: ARCHIVED_CATEGORY },
+    ProjectionExpression: "visitId"
+  }));
+  return Boolean(response.Item);
+};
+
 export const getAllVisits= async (): Promise<Visit[]> => {
   const command = new ScanCommand({
     TableName: VISIT_TABLE,
@@ -85,7 +205,13 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
     }
 
     console.log(`Found visit for visitID: ${visitID}`);
-    return response.Items[0] as Visit;
+    const visit = response.Items[0] as Visit;
+    if (visit.archivedAt) {
+      // The conversation was moved to the archive; the rehydrated view has it
+      const view = await getVisitView(visitID);
+      return view?.visit ?? visit;
+    }
+    return visit;
   } catch (error) {
     console.error("Error querying visit:", {
       visitID,
@@ -98,20 +224,47 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
 };
 
 
-  export const getVisitsByPatientId = async (patientID: string): Promise<Visit[]> => {
-    const command = new ScanCommand({
-      TableName: VISIT_TABLE,
-      FilterExpression: "patientID = :pid",
-      ExpressionAttributeValues: {
-        ":pid": patientID
-      }
-    });
-  
+  // Queries the Visit table's patientID-date-index, newest first. The index is keys-only,
+  // so items carry visitID, patientID and date; use getVisitById for the full visit.
+  // from/to are optional inclusive YYYY-MM-DD bounds on the visit date.
+  export const getVisitsByPatientId = async (
+    patientID: string,
+    range: { from?: string; to?: string } = {}
+  ): Promise<Visit[]> => {
+    let keyCondition = "patientID = :pid";
+    const values: Record<string, string> = { ":pid": patientID };
+    if (range.from && range.to) {
+      keyCondition += " AND #date BETWEEN :from AND :to";
+      values[":from"] = range.from;
+      values[":to"] = range.to;
+    } else if (range.from) {
+      keyCondition += " AND #date >= :from";
+      values[":from"] = range.from;
+    } else if (range.to) {
+      keyCondition += " AND #date <= :to";
+      values[":to"] = range.to;
+    }
+
     try {
       // Verify user is authenticated
       await getCurrentUser();
-      const response = await docClient.send(command);
-      return response.Items as Visit[];
+      const visits: Visit[] = [];
+      let lastKey: Record<string, any> | undefined = undefined;
+      do {
+        const command = new QueryCommand({
+          TableName: VISIT_TABLE,
+          IndexName: "patientID-date-index",
+          KeyConditionExpression: keyCondition,
+          ...(keyCondition.includes("#date") && { ExpressionAttributeNames: { "#date": "date" } }),
+          ExpressionAttributeValues: values,
+          ScanIndexForward: false,
+          ExclusiveStartKey: lastKey
+        });
+        const response = await docClient.send(command);
+        visits.push(...(response.Items as Visit[]));
+        lastKey = response.LastEvaluatedKey;
+      } while (lastKey);
+      return visits;
     } catch (error) {
       console.error("Error fetching visits for patient:", error);
       throw error;
@@ -137,6 +290,10 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
         return [];
       }
       
+      if (response.Items.some(item => item.dataCategory === ARCHIVED_CATEGORY)) {
+        return await getArchivedVisitData(visitId);
+      }
+
       console.log(`Found ${response.Items.length} items for visitId: ${visitId}`);
       return response.Items as AIVisit[];
     } catch (error) {
@@ -163,6 +320,9 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
       const command = new QueryCommand(params);
       const response = await docClient.send(command);
       console.log("final summary service", response)
+      if (!response.Items?.length && await isVisitArchived(visitId)) {
+        return (await getArchivedVisitData(visitId)).filter(item => item.dataCategory === 'finalSummary');
+      }
       return response.Items|| {};
     } catch (error) {
       console.error('Error fetching visit data:', error);
@@ -183,7 +343,9 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
         visitId: visitId,
         dataCategory: 'finalSummary'
       },
-      UpdateExpression: 'set assessment = :assessment, chief_complaint = :chief_complaint, history_present_illness = :history_present_illness, #planField = :plan, review_systems = :review_systems',
+      UpdateExpression: 'set assessment = :assessment, chief_complaint = :chief_complaint, history_present_illness = :history_present_illness, #planField = :plan, review_systems = :review_systems, editedAt = :editedAt',
+      // An archived visit has no finalSummary row; never create one next to its archived row
+      ConditionExpression: 'attribute_exists(dataCategory)',
       ExpressionAttributeNames: {
         '#planField': 'plan'  // Use ExpressionAttributeNames for reserved keyword
       },
@@ -192,7 +354,9 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
         ':chief_complaint': JSON.stringify(updates.chief_complaint),
         ':history_present_illness': JSON.stringify(updates.history_present_illness),
         ':plan': JSON.stringify(updates.plan),
-        ':review_systems': JSON.stringify(updates.review_systems)
+        ':review_systems': JSON.stringify(updates.review_systems),
+        // Marks the row as a clinician edit, which asclepius-recompute propagates to the care plan and experts
+        ':editedAt': new Date().toISOString()
       },
       ReturnValues: 'ALL_NEW'
     };
@@ -202,6 +366,9 @@ export const getVisitById = async (visitID: string): Promise<Visit | null> => {
       const result = await docClient.send(command);
       return result.Attributes;
     } catch (error) {
+      if (error.name === 'ConditionalCheckFailedException' && await isVisitArchived(visitId)) {
+        throw new Error(`Visit ${visitId} is archived and cannot be edited`);
+      }
       console.error('Error updating visit data:', error);
       throw error;
     }